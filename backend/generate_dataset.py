@@ -0,0 +1,230 @@
+"""Generate a synthetic dataset for scale and performance testing.
+
+    MONGO_URL=... DB_NAME=igate python generate_dataset.py --orders 1000000 --seed 42
+
+Creates customers, orders, payments, invoices and contact messages that
+follow the seeded catalog (run POST /api/seed first):
+- order dates grow towards the end of the period (`--days` long, ending at
+  `--end`, today by default), so recent months are busier
+- repeat customers: a small share of users places most orders
+- popular products sell three times as often, a quarter of orders are yearly
+- about 82% of orders are paid, 8% failed and 10% abandoned (cancelled with
+  an expired payment, as the sweeper leaves them), and orders
+  from the last three days are often still pending
+
+Output is a pure function of the seed, the catalog, the counts and `--end`,
+so benchmark runs can be reproduced. Every document carries
+`synthetic: true`, and `--purge` removes them again.
+
+Documents are generated in chunks of `--batch-size` and written with
+insert_many, with up to `--concurrency` chunks in flight.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from datetime import datetime, timezone, timedelta
+
+from server import (
+    db, Order, Payment, Invoice, ContactMessage, OrderStatus, PaymentStatus, UserRole,
+    encode_sortable_id, hash_password, plan_price
+)
+
+COLLECTIONS = ("users", "orders", "payments", "invoices", "contact_messages")
+PAID_SHARE = 0.82
+FAILED_SHARE = 0.08
+YEARLY_SHARE = 0.25
+RECENT_PENDING_SHARE = 0.3
+RECENT_DAYS = 3
+SYNTHETIC_PASSWORD = "synthetic-password"
+
+
+def sortable_id(prefix: str, at: datetime, rng: random.Random) -> str:
+    return encode_sortable_id(prefix, int(at.timestamp() * 1000), rng.getrandbits(80))
+
+
+def user_fields(seed: int, index: int) -> dict:
+    digest = hashlib.sha256(f"{seed}:user:{index}".encode()).hexdigest()
+    return {
+        "user_id": f"user_{digest[:12]}",
+        "email": f"customer{index}@example.com",
+        "name": f"Customer {index}",
+    }
+
+
+class DatasetGenerator:
+    def __init__(self, args, products: list):
+        self.args = args
+        self.products = sorted(products, key=lambda p: p["product_id"])
+        self.weights = [3 if p.get("is_popular") else 1 for p in self.products]
+        self.end = args.end
+        self.start = args.end - timedelta(days=args.days)
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.counts = dict.fromkeys(COLLECTIONS, 0)
+        self.password_hash = hash_password(SYNTHETIC_PASSWORD)
+
+    def rng(self, kind: str, chunk: int) -> random.Random:
+        return random.Random(f"{self.args.seed}:{kind}:{chunk}")
+
+    def timestamp(self, rng: random.Random) -> datetime:
+        # Density grows linearly over the period
+        return self.start + (self.end - self.start) * rng.random() ** 0.5
+
+    def users_chunk(self, chunk: int, first: int, count: int) -> dict:
+        rng = self.rng("users", chunk)
+        return {"users": [
+            {
+                **user_fields(self.args.seed, index),
+                "password_hash": self.password_hash,
+                "role": UserRole.CUSTOMER.value,
+                "created_at": (self.start + (self.end - self.start) * rng.random()).isoformat(),
+                "synthetic": True,
+            }
+            for index in range(first, first + count)
+        ]}
+
+    def orders_chunk(self, chunk: int, first: int, count: int) -> dict:
+        rng = self.rng("orders", chunk)
+        docs = {"orders": [], "payments": [], "invoices": []}
+        for index in range(first, first + count):
+            created_at = self.timestamp(rng)
+            user = user_fields(self.args.seed, int(self.args.users * rng.random() ** 2))
+            product = rng.choices(self.products, self.weights)[0]
+            plan_duration = "yearly" if rng.random() < YEARLY_SHARE else "monthly"
+
+            outcome = rng.random()
+            if self.end - created_at < timedelta(days=RECENT_DAYS) and rng.random() < RECENT_PENDING_SHARE:
+                order_status, payment_status = OrderStatus.PENDING, PaymentStatus.PENDING
+            elif outcome < PAID_SHARE:
+                order_status, payment_status = OrderStatus.COMPLETED, PaymentStatus.PAID
+            elif outcome < PAID_SHARE + FAILED_SHARE:
+                order_status, payment_status = OrderStatus.CANCELLED, PaymentStatus.FAILED
+            else:
+                order_status, payment_status = OrderStatus.CANCELLED, PaymentStatus.EXPIRED
+            paid_at = created_at + timedelta(seconds=rng.randint(10, 900))
+
+            order = Order(
+                order_id=sortable_id("ORD", created_at, rng),
+                user_id=user["user_id"],
+                product_id=product["product_id"],
+                product_name=product["name_ar"],
+                product_name_ar=product["name_ar"],
+                product_name_en=product["name_en"],
+                plan_duration=plan_duration,
+                amount=plan_price(product, plan_duration),
+                status=order_status,
+                payment_status=payment_status,
+                customer_name=user["name"],
+                customer_email=user["email"],
+                created_at=created_at,
+                updated_at=created_at if order_status == OrderStatus.PENDING else paid_at,
+            )
+            payment = Payment(
+                payment_id=sortable_id("PAY", created_at, rng),
+                order_id=order.order_id,
+                kashier_transaction_id=f"SYN-{index}" if payment_status == PaymentStatus.PAID else None,
+                amount=order.amount,
+                status=payment_status,
+                created_at=created_at,
+                updated_at=paid_at,
+            )
+            docs["orders"].append({**order.model_dump(), "synthetic": True})
+            docs["payments"].append({**payment.model_dump(), "synthetic": True})
+
+            if payment_status == PaymentStatus.PAID:
+                invoice = Invoice(
+                    invoice_id=sortable_id("INV", paid_at, rng),
+                    invoice_number=f"IG-S{index + 1:08d}",
+                    order_id=order.order_id,
+                    user_id=order.user_id,
+                    payment_id=payment.payment_id,
+                    customer_name=order.customer_name,
+                    customer_email=order.customer_email,
+                    product_name=order.product_name,
+                    product_name_ar=order.product_name_ar,
+                    product_name_en=order.product_name_en,
+                    plan_duration=plan_duration,
+                    subtotal=order.amount,
+                    total=order.amount,
+                    created_at=paid_at,
+                )
+                docs["invoices"].append({**invoice.model_dump(), "synthetic": True})
+        return docs
+
+    def contacts_chunk(self, chunk: int, first: int, count: int) -> dict:
+        rng = self.rng("contacts", chunk)
+        docs = []
+        for index in range(first, first + count):
+            created_at = self.timestamp(rng)
+            user = user_fields(self.args.seed, rng.randrange(self.args.users))
+            message = ContactMessage(
+                message_id=f"msg_{hashlib.sha256(f'{self.args.seed}:msg:{index}'.encode()).hexdigest()[:12]}",
+                name=user["name"],
+                email=user["email"],
+                message=f"Synthetic inquiry #{index}",
+                is_read=self.end - created_at > timedelta(days=7) or rng.random() < 0.5,
+                created_at=created_at,
+            )
+            docs.append({**message.model_dump(), "synthetic": True})
+        return {"contact_messages": docs}
+
+    async def write_chunk(self, build, chunk: int, first: int, count: int):
+        async with self.semaphore:
+            docs = build(chunk, first, count)
+            await asyncio.gather(*(
+                db[name].insert_many(batch, ordered=False) for name, batch in docs.items() if batch
+            ))
+            for name, batch in docs.items():
+                self.counts[name] += len(batch)
+
+    async def generate(self, build, total: int):
+        size = self.args.batch_size
+        await asyncio.gather(*(
+            self.write_chunk(build, chunk, first, min(size, total - first))
+            for chunk, first in enumerate(range(0, total, size))
+        ))
+
+    async def run(self) -> dict:
+        await self.generate(self.users_chunk, self.args.users)
+        await self.generate(self.orders_chunk, self.args.orders)
+        await self.generate(self.contacts_chunk, self.args.contacts)
+        return self.counts
+
+
+async def purge() -> dict:
+    return {name: (await db[name].delete_many({"synthetic": True})).deleted_count for name in COLLECTIONS}
+
+
+async def main(args):
+    if args.purge:
+        print(await purge())
+        return
+    products = await db.products.find({"is_active": True}, {"_id": 0}).to_list(None)
+    if not products:
+        raise SystemExit("No products, run POST /api/seed first")
+
+    started = time.perf_counter()
+    counts = await DatasetGenerator(args, products).run()
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Inserted {counts} in {elapsed:.1f}s ({total / elapsed:,.0f} docs/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for scale testing")
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--users", type=int, help="default: orders / 4")
+    parser.add_argument("--contacts", type=int, help="default: orders / 20")
+    parser.add_argument("--days", type=int, default=730, help="length of the generated history")
+    parser.add_argument("--end", type=lambda v: datetime.fromisoformat(v).replace(tzinfo=timezone.utc),
+                        default=datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0),
+                        help="end of the history (YYYY-MM-DD), default today 00:00 UTC")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4, help="chunks written in parallel")
+    parser.add_argument("--purge", action="store_true", help="delete previously generated documents")
+    args = parser.parse_args()
+    args.users = args.users or max(1, args.orders // 4)
+    args.contacts = args.contacts if args.contacts is not None else args.orders // 20
+    asyncio.run(main(args))
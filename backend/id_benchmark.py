@@ -0,0 +1,69 @@
+"""Compare the legacy random order/invoice ids with the sortable ids.
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=igate python id_benchmark.py --count 1000000
+
+For each scheme a scratch collection with a unique index on the id is
+filled with insert_many batches, then insert throughput, duplicate key
+rejections and the id index size are reported. The scratch database
+(<DB_NAME>_id_benchmark) is dropped afterwards.
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from server import new_id
+
+SCHEMES = {
+    "legacy order ORD-8hex": lambda: f"ORD-{uuid.uuid4().hex[:8].upper()}",
+    "legacy invoice IG-4digits": lambda: f"IG-{str(uuid.uuid4().int)[:4].zfill(4)}",
+    "sortable ORD-ulid": lambda: new_id("ORD"),
+}
+
+
+def run_scheme(collection, make_id, count: int, batch_size: int) -> dict:
+    collection.drop()
+    collection.create_index("order_id", unique=True)
+    duplicates = 0
+    started = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        batch = [
+            {"order_id": make_id(), "amount": 100.0, "created_at": datetime.now(timezone.utc)}
+            for _ in range(min(batch_size, count - offset))
+        ]
+        try:
+            collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            duplicates += len(e.details["writeErrors"])
+    elapsed = time.perf_counter() - started
+    stats = collection.database.command("collStats", collection.name)
+    return {
+        "inserts_per_second": round((count - duplicates) / elapsed),
+        "duplicates": duplicates,
+        "id_index_mb": round(stats["indexSizes"]["order_id_1"] / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ["MONGO_URL"])
+    database = client[f"{os.environ['DB_NAME']}_id_benchmark"]
+    try:
+        print(f"{'scheme':<28}{'inserts/s':>12}{'duplicates':>12}{'id index MB':>14}")
+        for name, make_id in SCHEMES.items():
+            result = run_scheme(database.ids, make_id, args.count, args.batch_size)
+            print(f"{name:<28}{result['inserts_per_second']:>12}{result['duplicates']:>12}{result['id_index_mb']:>14}")
+    finally:
+        client.drop_database(database.name)
+
+
+if __name__ == "__main__":
+    main()
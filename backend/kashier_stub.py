@@ -0,0 +1,105 @@
+"""Local stand-in for the Kashier API, for offline payment testing.
+
+    python kashier_stub.py --port 8090 --latency-ms 50
+
+then start the API with KASHIER_API_URL=http://localhost:8090 and any
+KASHIER_MERCHANT_ID / KASHIER_API_KEY (pass the same key as --api-key to
+have the stub verify signatures).
+
+Implements the two calls server.py makes:
+- POST /api/v1/payment/session opens a session and returns a redirect URL
+- GET /api/v1/payment/{merchant_order_id} reports the payment status
+
+The outcome of each merchant order is derived from a hash of its id, so
+repeated runs over the same data give the same paid/failed/pending split.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import uuid
+
+from aiohttp import web
+
+
+def outcome(merchant_order_id: str, paid_ratio: float, failed_ratio: float) -> str:
+    bucket = int(hashlib.sha256(merchant_order_id.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    if bucket < paid_ratio:
+        return "success"
+    if bucket < paid_ratio + failed_ratio:
+        return "failed"
+    return "pending"
+
+
+def sign(api_key: str, message: str) -> str:
+    return hmac.new(api_key.encode(), message.encode(), hashlib.sha256).hexdigest().upper()
+
+
+def create_app(api_key: str = "", paid_ratio: float = 0.7, failed_ratio: float = 0.2, latency_ms: int = 0) -> web.Application:
+    app = web.Application()
+    app["stats"] = {"sessions": 0, "status_checks": 0}
+
+    async def simulate_latency():
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    async def create_session(request: web.Request):
+        await simulate_latency()
+        payload = await request.json()
+        if api_key:
+            payload_str = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+            if not hmac.compare_digest(sign(api_key, payload_str), request.headers.get("X-Signature", "")):
+                return web.json_response({"status": False, "message": "Invalid signature"}, status=401)
+        app["stats"]["sessions"] += 1
+        session_id = uuid.uuid4().hex
+        return web.json_response({
+            "status": True,
+            "id": session_id,
+            "redirect_url": f"http://{request.host}/checkout/{session_id}"
+        })
+
+    async def payment_status(request: web.Request):
+        await simulate_latency()
+        merchant_order_id = request.match_info["merchant_order_id"]
+        if api_key:
+            expected = sign(api_key, f"{request.query.get('merchant_id', '')}:{merchant_order_id}")
+            if not hmac.compare_digest(expected, request.headers.get("X-Signature", "")):
+                return web.json_response({"status": False, "message": "Invalid signature"}, status=401)
+        app["stats"]["status_checks"] += 1
+        status = outcome(merchant_order_id, paid_ratio, failed_ratio)
+        return web.json_response({
+            "status": True,
+            "merchant_order_id": merchant_order_id,
+            "payment_status": status,
+            "transaction_id": f"STUB-{merchant_order_id}" if status == "success" else None
+        })
+
+    async def stats(request: web.Request):
+        return web.json_response(app["stats"])
+
+    app.router.add_post("/api/v1/payment/session", create_session)
+    app.router.add_get("/api/v1/payment/{merchant_order_id}", payment_status)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Kashier API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--api-key", default="", help="verify request signatures with this key")
+    parser.add_argument("--paid-ratio", type=float, default=0.7)
+    parser.add_argument("--failed-ratio", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every response")
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.api_key, args.paid_ratio, args.failed_ratio, args.latency_ms),
+        host=args.host,
+        port=args.port,
+        access_log=None
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, DeleteOne, UpdateOne, UpdateMany, ReplaceOne, monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter, create_model
 from typing import List, Optional
+from functools import lru_cache
+from contextvars import ContextVar
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone, timedelta, date
+from decimal import Decimal, ROUND_HALF_UP
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from enum import Enum
 import hashlib
+import ipaddress
+import base64
 import hmac
+import time
 import json
 import io
+import smtplib
+from email.message import EmailMessage
+import gzip
+import csv
+import zipfile
+import asyncio
+from collections import OrderedDict, deque
 import aiohttp
+import numpy as np
+import pandas as pd
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from reportlab.lib import colors
@@ -27,19 +48,121 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import requests
 
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# MongoDB command monitoring
+# Motor runs pymongo in executor threads with a copy of the caller's
+# context, so the listener can attribute each command to the request
+# that issued it through db_profile_var.
+db_profile_var: ContextVar = ContextVar("db_profile", default=None)
+current_handler_var: ContextVar = ContextVar("current_handler", default=None)
+
+def _command_collection(event) -> Optional[str]:
+    target = event.command.get(event.command_name)
+    if isinstance(target, str):
+        return target
+    return event.command.get("collection")  # getMore
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command and reports finished ones to the active request
+    profile and to any registered sinks (called from Motor's executor threads)"""
+    
+    def __init__(self):
+        self._started = {}
+        self.sinks = []
+    
+    def started(self, event):
+        self._started[event.request_id] = event
+    
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+    
+    def failed(self, event):
+        self._finish(event, None)
+    
+    def _finish(self, event, reply):
+        started = self._started.pop(event.request_id, None)
+        if started is None:
+            return
+        
+        reply = reply or {}
+        cursor = reply.get("cursor") or {}
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        record = {
+            "op": event.command_name,
+            "collection": _command_collection(started),
+            "duration_ms": round(event.duration_micros / 1000, 3),
+            "docs": len(batch) if batch is not None else reply.get("n"),
+            "ok": bool(reply)
+        }
+        
+        profile = db_profile_var.get()
+        if profile is not None:
+            profile.record(record, started)
+        for sink in self.sinks:
+            try:
+                sink(record, started)
+            except Exception:
+                logger.exception("Mongo command sink failed")
+
+mongo_command_listener = MongoCommandListener()
+
 # MongoDB connection
+# Replica-set aware: put replicaSet=<name> in MONGO_URL (or MONGO_REPLICA_SET).
+# For local testing a single-host replica set works: `mongod --replSet rs0`,
+# then `rs.initiate()` in mongosh and MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_client_options = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000')),
+}
+if os.environ.get('MONGO_REPLICA_SET'):
+    mongo_client_options["replicaSet"] = os.environ['MONGO_REPLICA_SET']
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_command_listener], **mongo_client_options)
 db = client[os.environ['DB_NAME']]
 
+# Read routing per route class. Checkout, auth and payments always use `db`
+# (primary); admin reports and exports read from `reporting_db`, which may be
+# a secondary lagging by at most REPORTING_MAX_STALENESS_SECONDS.
+READ_PREFERENCE_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def read_preference(mode: str, max_staleness: int = -1):
+    if mode == "primary":
+        return Primary()
+    # MongoDB rejects a max staleness below 90 seconds
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness if max_staleness < 0 else max(90, max_staleness))
+
+REPORTING_READ_PREFERENCE = os.environ.get('REPORTING_READ_PREFERENCE', 'secondaryPreferred')
+REPORTING_MAX_STALENESS_SECONDS = int(os.environ.get('REPORTING_MAX_STALENESS_SECONDS', '120'))
+reporting_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=read_preference(REPORTING_READ_PREFERENCE, REPORTING_MAX_STALENESS_SECONDS)
+)
+
 # JWT Settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'igate-host-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 days
 
+# OAuth session Settings
+SESSION_EXPIRATION_DAYS = 7
+SESSION_CACHE_SECONDS = int(os.environ.get('SESSION_CACHE_SECONDS', '30'))
+SESSION_CACHE_SIZE = 10000
+SESSION_MIGRATION_BATCH_SIZE = 1000
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -47,15 +170,251 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 KASHIER_MERCHANT_ID = os.environ.get('KASHIER_MERCHANT_ID', '')
 KASHIER_API_KEY = os.environ.get('KASHIER_API_KEY', '')
 KASHIER_MODE = os.environ.get('KASHIER_MODE', 'sandbox')
-KASHIER_API_URL = 'https://api.sandbox.kashier.io' if KASHIER_MODE == 'sandbox' else 'https://api.kashier.io'
+KASHIER_API_URL = os.environ.get('KASHIER_API_URL') or ('https://api.sandbox.kashier.io' if KASHIER_MODE == 'sandbox' else 'https://api.kashier.io')
+KASHIER_SESSION_TTL_MINUTES = int(os.environ.get('KASHIER_SESSION_TTL_MINUTES', '30'))
+KASHIER_HTTP_POOL_SIZE = int(os.environ.get('KASHIER_HTTP_POOL_SIZE', '32'))
+KASHIER_HTTP_TIMEOUT_SECONDS = int(os.environ.get('KASHIER_HTTP_TIMEOUT_SECONDS', '15'))
+
+# Invoice PDF Settings
+INVOICE_PDF_CACHE_MB = int(os.environ.get('INVOICE_PDF_CACHE_MB', '64'))
+INVOICE_ARCHIVE_CONCURRENCY = int(os.environ.get('INVOICE_ARCHIVE_CONCURRENCY', '4'))
+INVOICE_ARCHIVE_BATCH_SIZE = 200
+
+# Catalog Settings
+CATALOG_CACHE_TTL_SECONDS = int(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '60'))
+DEFAULT_LANGUAGE = "ar"
+
+# Compression Settings
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_CPU_BUDGET_MS = int(os.environ.get('COMPRESSION_CPU_BUDGET_MS', '200'))  # per second, per worker
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Rate limiting / load shedding Settings
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')  # local or mongo (shared by all workers)
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if p.strip()
+]  # only hops added by these proxies are believed
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '200'))  # long-lived event streams are not counted
+EVENT_LOOP_LAG_THRESHOLD_MS = int(os.environ.get('EVENT_LOOP_LAG_THRESHOLD_MS', '250'))
+
+# DB profiler Settings
+DB_PROFILER_ENABLED = os.environ.get('DB_PROFILER_ENABLED', 'false').lower() == 'true'  # profile every request
+DB_PROFILER_EXPLAIN_SAMPLE = int(os.environ.get('DB_PROFILER_EXPLAIN_SAMPLE', '3'))
+DB_PROFILER_MAX_TIMING_ENTRIES = 30
+
+# Slow query log Settings
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE', '')  # NDJSON file instead of the capped collection
+SLOW_QUERY_LOG_MB = int(os.environ.get('SLOW_QUERY_LOG_MB', '16'))
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = int(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS', '600'))
+
+# Archival Settings
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '365'))
+ARCHIVE_STORAGE = os.environ.get('ARCHIVE_STORAGE', 'collections')  # collections or files
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', str(ROOT_DIR / 'archive')))
+ARCHIVE_INTERVAL_HOURS = int(os.environ.get('ARCHIVE_INTERVAL_HOURS', '0'))  # 0 = only on demand
+ARCHIVE_BATCH_SIZE = 500
+
+# Sweeper Settings
+PENDING_ORDER_MAX_AGE_HOURS = int(os.environ.get('PENDING_ORDER_MAX_AGE_HOURS', '72'))
+PENDING_PAYMENT_MAX_AGE_HOURS = int(os.environ.get('PENDING_PAYMENT_MAX_AGE_HOURS', '24'))
+SWEEP_INTERVAL_MINUTES = int(os.environ.get('SWEEP_INTERVAL_MINUTES', '60'))  # 0 = only on demand
+SWEEP_BATCH_SIZE = 1000
+
+# Payment reconciliation Settings
+RECONCILE_MIN_AGE_MINUTES = int(os.environ.get('RECONCILE_MIN_AGE_MINUTES', '15'))  # leave time for the webhook
+RECONCILE_INTERVAL_MINUTES = int(os.environ.get('RECONCILE_INTERVAL_MINUTES', '10'))  # 0 = only on demand
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '16'))
+RECONCILE_BATCH_SIZE = 200
+
+# Admin event stream Settings
+ADMIN_EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('ADMIN_EVENTS_MAX_SUBSCRIBERS', '100'))  # per worker
+ADMIN_EVENTS_QUEUE_SIZE = 256  # per subscriber, the oldest events are dropped beyond this
+ADMIN_EVENTS_HEARTBEAT_SECONDS = 15
+
+# Order event log Settings
+ORDER_EVENTS_BATCH_SIZE = int(os.environ.get('ORDER_EVENTS_BATCH_SIZE', '500'))
+ORDER_EVENTS_FLUSH_MS = int(os.environ.get('ORDER_EVENTS_FLUSH_MS', '1000'))
+ORDER_EVENTS_MAX_BUFFER = 50000  # oldest entries are dropped if MongoDB stays unreachable
+
+# Sales report Settings
+REPORT_TIMEZONE = os.environ.get('REPORT_TIMEZONE', 'Africa/Cairo')
+REPORT_MAX_DAYS = 3660
+
+# Analytics Settings
+ANALYTICS_BATCH_SIZE = 10000  # orders per columnar batch
+ANALYTICS_USER_LOOKUP_CHUNK = 5000
+
+# Checkout Settings
+MAX_CART_ITEMS = 20
+CHECKOUT_ID_PREFIX = "CHK-"
+
+# Pricing Settings
+PRICING_CACHE_TTL_SECONDS = int(os.environ.get('PRICING_CACHE_TTL_SECONDS', '60'))
+MAX_QUOTE_ITEMS = 100
+MINOR_UNITS = 100  # piastres per pound
+
+# Email outbox Settings
+SMTP_HOST = os.environ.get('SMTP_HOST', '')  # emails are neither queued nor sent while empty
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true'
+SMTP_TIMEOUT_SECONDS = 30
+SMTP_IDLE_SECONDS = 60  # the pooled connection is closed after this long unused
+EMAIL_FROM = os.environ.get('EMAIL_FROM', 'Igate-host <billing@igate-host.com>')
+ADMIN_NOTIFY_EMAIL = os.environ.get('ADMIN_NOTIFY_EMAIL', 'support@igate-host.com')
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', '50'))
+EMAIL_OUTBOX_POLL_SECONDS = int(os.environ.get('EMAIL_OUTBOX_POLL_SECONDS', '5'))
+EMAIL_MAX_ATTEMPTS = 8
+EMAIL_RETRY_BASE_SECONDS = 30  # doubled after every failed attempt
+EMAIL_RETRY_MAX_SECONDS = 3600
+EMAIL_SENT_RETENTION_DAYS = int(os.environ.get('EMAIL_SENT_RETENTION_DAYS', '7'))
+EMAIL_CLAIM_SECONDS = 300  # a claimed batch is retried after this if its worker died
+
+async def track_handler(request: Request):
+    """Remember which endpoint is running so monitored commands can name it"""
+    endpoint = request.scope.get("endpoint")
+    current_handler_var.set(endpoint.__name__ if endpoint else None)
 
 app = FastAPI(title="Igate-host API")
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", dependencies=[Depends(track_handler)])
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# ============== UTILS ==============
+def parse_datetime(value) -> Optional[datetime]:
+    """Parse an ISO string (or pass through a datetime) as an aware UTC datetime"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+# ============== IDS ==============
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+SORTABLE_ID_LENGTH = 26
+
+def encode_sortable_id(prefix: str, ms: int, random_bits: int) -> str:
+    value = (ms << 80) | random_bits
+    chars = []
+    for _ in range(SORTABLE_ID_LENGTH):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return f"{prefix}-{''.join(reversed(chars))}"
+
+class SortableIdGenerator:
+    """ULID-style ids: a 48-bit millisecond timestamp followed by 80 random
+    bits, as 26 Crockford base32 characters after a readable prefix.
+    
+    Ids sort by creation time, so index inserts land on the right-hand edge
+    and an id works as a keyset pagination cursor. Within one millisecond
+    the random part is incremented instead of redrawn, so ids from one
+    worker stay strictly increasing.
+    """
+    
+    def __init__(self):
+        self._last_ms = 0
+        self._last_random = 0
+    
+    def new(self, prefix: str) -> str:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            self._last_random = int.from_bytes(os.urandom(10), "big")
+        else:
+            self._last_random += 1
+            if self._last_random >> 80:  # random part exhausted, borrow the next millisecond
+                self._last_ms += 1
+                self._last_random = int.from_bytes(os.urandom(10), "big")
+        return encode_sortable_id(prefix, self._last_ms, self._last_random)
+
+sortable_ids = SortableIdGenerator()
+
+def new_id(prefix: str) -> str:
+    return sortable_ids.new(prefix)
+
+def is_sortable_id(value: str) -> bool:
+    _, _, suffix = value.rpartition("-")
+    return len(suffix) == SORTABLE_ID_LENGTH and all(c in CROCKFORD_ALPHABET for c in suffix)
+
+def id_timestamp(value: str) -> Optional[datetime]:
+    """Creation time embedded in a sortable id, None for legacy ids"""
+    if not is_sortable_id(value):
+        return None
+    suffix = value.rpartition("-")[2]
+    ms = 0
+    for c in suffix[:10]:
+        ms = (ms << 5) | CROCKFORD_ALPHABET.index(c)
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+def id_query(field: str, value: str) -> dict:
+    """Match a document by id, including legacy ids that were re-keyed
+    because they collided (the old value is kept in legacy_id)"""
+    if is_sortable_id(value):
+        return {field: value}
+    return {"$or": [{field: value}, {"legacy_id": value}]}
+
+async def ensure_unique_id_index(collection, field: str, prefix: str, dependents=()):
+    """Build the unique index on an id field.
+    
+    The first time, legacy ids shared by several documents are re-keyed:
+    the oldest document keeps the id, the others get a sortable id and
+    remember the old one in legacy_id.
+    
+    `dependents` lists the (collection, field) pairs that refer to these
+    ids. A reference to a shared id cannot tell which of the duplicates it
+    meant, so if any duplicated id is referenced nothing is re-keyed: the
+    ids are logged and the index stays non-unique until they are resolved
+    by hand.
+    """
+    index = (await collection.index_information()).get(f"{field}_1")
+    if index and index.get("unique"):
+        return
+    duplicates = await collection.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ], allowDiskUse=True).to_list(None)
+    shared = [d["_id"] for d in duplicates]
+    referenced = {}
+    for dependent, dependent_field in dependents if shared else ():
+        async for row in dependent.aggregate([
+            {"$match": {dependent_field: {"$in": shared}}},
+            {"$group": {"_id": f"${dependent_field}"}}
+        ]):
+            referenced.setdefault(row["_id"], []).append(f"{dependent.name}.{dependent_field}")
+    if referenced:
+        logger.error(
+            f"Not building a unique {collection.name}.{field} index: {len(referenced)} duplicated ids are "
+            f"referenced elsewhere and need resolving by hand: {dict(sorted(referenced.items())[:20])}"
+        )
+        if not index:
+            await collection.create_index(field)
+        return
+    rekeys = [
+        UpdateOne({"_id": _id}, {"$set": {field: new_id(prefix), "legacy_id": d["_id"]}})
+        for d in duplicates for _id in d["ids"][1:]
+    ]
+    if rekeys:
+        await collection.bulk_write(rekeys, ordered=False)
+        logger.warning(f"Re-keyed {len(rekeys)} duplicate {collection.name}.{field} values")
+    if index:
+        await collection.drop_index(f"{field}_1")
+    await collection.create_index(field, unique=True)
+    await collection.create_index("legacy_id", sparse=True)
+
 # ============== ENUMS ==============
 class UserRole(str, Enum):
     ADMIN = "admin"
@@ -66,6 +425,7 @@ class PaymentStatus(str, Enum):
     PAID = "paid"
     FAILED = "failed"
     REFUNDED = "refunded"
+    EXPIRED = "expired"  # superseded or abandoned before completion
 
 class OrderStatus(str, Enum):
     PENDING = "pending"
@@ -78,6 +438,11 @@ class ProductCategory(str, Enum):
     DESIGN = "design"
     MARKETING = "marketing"
 
+class Language(str, Enum):
+    AR = "ar"
+    EN = "en"
+    AUTO = "auto"  # negotiate from Accept-Language
+
 # ============== MODELS ==============
 class UserCreate(BaseModel):
     email: EmailStr
@@ -112,6 +477,20 @@ class Product(BaseModel):
     is_popular: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class LocalizedProduct(BaseModel):
+    """Single-language catalog entry served for ?lang="""
+    model_config = ConfigDict(extra="ignore")
+    product_id: str
+    name: str
+    description: str
+    category: ProductCategory
+    price_monthly: float
+    price_yearly: float
+    features: List[str] = []
+    is_active: bool = True
+    is_popular: bool = False
+    created_at: datetime
+
 class ProductCreate(BaseModel):
     name_ar: str
     name_en: str
@@ -137,18 +516,24 @@ class ProductUpdate(BaseModel):
 
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    order_id: str = Field(default_factory=lambda: f"ORD-{uuid.uuid4().hex[:8].upper()}")
+    order_id: str = Field(default_factory=lambda: new_id("ORD"))
     user_id: str
     product_id: str
     product_name: str
+    product_name_ar: Optional[str] = None
+    product_name_en: Optional[str] = None
     plan_duration: str  # monthly or yearly
-    amount: float
+    amount: float  # total charged, tax included
+    subtotal: Optional[float] = None
+    tax: float = 0
+    tax_percentage: float = 0
     currency: str = "EGP"
     status: OrderStatus = OrderStatus.PENDING
     payment_status: PaymentStatus = PaymentStatus.PENDING
     customer_name: str
     customer_email: str
     customer_phone: Optional[str] = None
+    checkout_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -159,31 +544,76 @@ class OrderCreate(BaseModel):
     customer_email: EmailStr
     customer_phone: Optional[str] = None
 
+class CartItem(BaseModel):
+    product_id: str
+    plan_duration: str
+
+class CheckoutCreate(BaseModel):
+    items: List[CartItem] = Field(..., min_length=1, max_length=MAX_CART_ITEMS)
+    customer_name: str
+    customer_email: EmailStr
+    customer_phone: Optional[str] = None
+
+class QuoteCreate(BaseModel):
+    items: List[CartItem] = Field(..., min_length=1, max_length=MAX_QUOTE_ITEMS)
+
+class QuoteLine(BaseModel):
+    product_id: str
+    plan_duration: str
+    subtotal_minor: int
+    tax_minor: int
+    total_minor: int
+    
+    def order_fields(self, tax_percentage: float) -> dict:
+        return {
+            "amount": from_minor(self.total_minor),
+            "subtotal": from_minor(self.subtotal_minor),
+            "tax": from_minor(self.tax_minor),
+            "tax_percentage": tax_percentage
+        }
+
+class Quote(BaseModel):
+    lines: List[QuoteLine]
+    subtotal_minor: int
+    tax_minor: int
+    total_minor: int
+    tax_percentage: float
+    currency: str = "EGP"
+    minor_units: int = MINOR_UNITS
+
 class Payment(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    payment_id: str = Field(default_factory=lambda: f"PAY-{uuid.uuid4().hex[:8].upper()}")
-    order_id: str
+    payment_id: str = Field(default_factory=lambda: new_id("PAY"))
+    order_id: str  # order_id, or checkout_id when paying for a whole cart
     kashier_transaction_id: Optional[str] = None
     amount: float
     currency: str = "EGP"
     status: PaymentStatus = PaymentStatus.PENDING
     payment_method: str = "card"
+    idempotency_key: Optional[str] = None
+    session_id: Optional[str] = None
+    payment_url: Optional[str] = None
+    session_expires_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Invoice(BaseModel):
     model_config = ConfigDict(extra="ignore")
-    invoice_id: str = Field(default_factory=lambda: f"IG-{str(uuid.uuid4().int)[:4].zfill(4)}")
+    invoice_id: str = Field(default_factory=lambda: new_id("INV"))
     invoice_number: str
     order_id: str
+    user_id: Optional[str] = None  # lets customers list invoices of archived orders
     payment_id: str
     customer_name: str
     customer_email: str
     customer_phone: Optional[str] = None
     product_name: str
+    product_name_ar: Optional[str] = None
+    product_name_en: Optional[str] = None
     plan_duration: str
     subtotal: float
     tax: float = 0
+    tax_percentage: float = 0
     total: float
     currency: str = "EGP"
     status: PaymentStatus = PaymentStatus.PAID
@@ -207,10 +637,84 @@ class ContactMessageCreate(BaseModel):
 
 class UserSession(BaseModel):
     user_id: str
-    session_token: str
-    expires_at: datetime
+    token_digest: str  # sha256 of the opaque session token, the raw token is never stored
+    expires_at: datetime  # native date, drives the TTL index
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ============== FIELD PROJECTION ==============
+# Named compact views for list endpoints, e.g. ?view=summary for table rows
+LIST_VIEWS = {
+    Product: {
+        "summary": ["product_id", "name_ar", "name_en", "category", "price_monthly", "price_yearly", "is_active", "is_popular"],
+    },
+    Order: {
+        "summary": ["order_id", "product_name", "plan_duration", "amount", "currency", "status", "payment_status", "customer_name", "created_at"],
+    },
+    Invoice: {
+        "summary": ["invoice_id", "invoice_number", "order_id", "customer_name", "product_name", "total", "currency", "status", "created_at"],
+    },
+    ContactMessage: {
+        "summary": ["message_id", "name", "email", "is_read", "created_at"],
+    },
+}
+
+@lru_cache(maxsize=256)
+def _projected_list_adapter(model, fields: tuple) -> TypeAdapter:
+    partial_model = create_model(
+        f"{model.__name__}Projection",
+        __config__=ConfigDict(extra="ignore"),
+        **{name: (Optional[model.model_fields[name].annotation], None) for name in fields}
+    )
+    return TypeAdapter(List[partial_model])
+
+class ListProjection:
+    """Resolved fields=/view= selection for a list endpoint.
+    
+    The same field set drives the Mongo projection and the serialized
+    response, so unused fields are neither read from Mongo nor sent.
+    """
+    
+    def __init__(self, model, fields: Optional[tuple] = None):
+        self.model = model
+        self.fields = fields
+    
+    @property
+    def mongo(self) -> dict:
+        if not self.fields:
+            return {"_id": 0}
+        return {"_id": 0, **{name: 1 for name in self.fields}}
+    
+    def response(self, docs: List[dict]):
+        if not self.fields:
+            return docs
+        adapter = _projected_list_adapter(self.model, self.fields)
+        return Response(
+            content=adapter.dump_json(adapter.validate_python(docs)),
+            media_type="application/json"
+        )
+
+def list_projection(model):
+    """Dependency factory parsing ?fields=a,b and ?view=name against `model`"""
+    views = LIST_VIEWS.get(model, {})
+    
+    async def dependency(fields: Optional[str] = None, view: Optional[str] = None) -> ListProjection:
+        requested = set()
+        if view:
+            if view not in views:
+                raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+            requested.update(views[view])
+        if fields:
+            requested.update(name.strip() for name in fields.split(",") if name.strip())
+        
+        unknown = sorted(requested - set(model.model_fields))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {', '.join(unknown)}")
+        
+        # Keep model field order so responses are stable
+        return ListProjection(model, tuple(name for name in model.model_fields if name in requested) or None)
+    
+    return dependency
+
 # ============== AUTH HELPERS ==============
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -223,6 +727,116 @@ def create_jwt_token(user_id: str, email: str, role: str) -> str:
     to_encode = {"user_id": user_id, "email": email, "role": role, "exp": expire}
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def hash_session_token(session_token: str) -> str:
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+class SessionStore:
+    """Opaque (OAuth) session tokens keyed by their sha256 digest.
+    
+    A TTL index on expires_at lets MongoDB delete expired sessions, and
+    resolve() returns the session together with its user in one aggregate
+    ($lookup), fronted by a short-lived in-process cache so repeated
+    requests with the same token usually skip MongoDB entirely.
+    """
+    
+    def __init__(self, collection, cache_seconds: int, cache_size: int):
+        self.collection = collection
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._digests = {}  # user_id -> cached token digest
+    
+    async def migrate_legacy_sessions(self) -> int:
+        """Key sessions written before token digests by the digest of their
+        raw token, with a Date expires_at the TTL monitor understands"""
+        migrated = 0
+        now = datetime.now(timezone.utc)
+        legacy = self.collection.find(
+            {"token_digest": {"$exists": False}}, {"_id": 1, "session_token": 1, "expires_at": 1}
+        ).batch_size(SESSION_MIGRATION_BATCH_SIZE)
+        operations = []
+        async for doc in legacy:
+            expires_at = parse_datetime(doc.get("expires_at"))
+            if not doc.get("session_token") or not expires_at or expires_at <= now:
+                operations.append(DeleteOne({"_id": doc["_id"]}))
+            else:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {
+                    "$set": {"token_digest": hash_session_token(doc["session_token"]), "expires_at": expires_at},
+                    "$unset": {"session_token": ""}
+                }))
+                migrated += 1
+            if len(operations) >= SESSION_MIGRATION_BATCH_SIZE:
+                await self.collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        return migrated
+    
+    async def ensure_indexes(self):
+        migrated = await self.migrate_legacy_sessions()
+        if migrated:
+            logger.info(f"Migrated {migrated} legacy sessions to token digests")
+        await self.collection.create_index("token_digest", unique=True)
+        await self.collection.create_index("user_id", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+    
+    async def create(self, user_id: str, session_token: str, expires_at: datetime):
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {"$set": UserSession(
+                user_id=user_id,
+                token_digest=hash_session_token(session_token),
+                expires_at=expires_at
+            ).model_dump()},
+            upsert=True
+        )
+        # The upsert replaced whatever token this user had before
+        self._cache.pop(self._digests.pop(user_id, None), None)
+    
+    def _forget(self, digest: str, cached: tuple):
+        if self._digests.get(cached[1]["user_id"]) == digest:
+            del self._digests[cached[1]["user_id"]]
+    
+    async def resolve(self, session_token: str) -> Optional[tuple]:
+        """Return (expires_at, user_doc) for a token, user_doc is None if the user is gone"""
+        digest = hash_session_token(session_token)
+        cached = self._cache.get(digest)
+        if cached and cached[0] > time.monotonic():
+            self._cache.move_to_end(digest)
+            return cached[1]["expires_at"], cached[1]["user"]
+        
+        docs = await self.collection.aggregate([
+            {"$match": {"token_digest": digest}},
+            {"$limit": 1},
+            {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "user_id", "as": "user"}},
+            {"$project": {"_id": 0, "user_id": 1, "expires_at": 1, "user": {"$arrayElemAt": ["$user", 0]}}},
+            {"$project": {"user._id": 0, "user.password_hash": 0}}
+        ]).to_list(1)
+        if not docs:
+            return None
+        
+        session_doc = docs[0]
+        user_doc = session_doc.get("user")
+        expires_at = parse_datetime(session_doc["expires_at"])
+        
+        self._cache[digest] = (
+            time.monotonic() + self.cache_seconds,
+            {"user_id": session_doc["user_id"], "expires_at": expires_at, "user": user_doc}
+        )
+        self._digests[session_doc["user_id"]] = digest
+        if len(self._cache) > self.cache_size:
+            self._forget(*self._cache.popitem(last=False))
+        return expires_at, user_doc
+    
+    async def revoke(self, session_token: str):
+        digest = hash_session_token(session_token)
+        cached = self._cache.pop(digest, None)
+        if cached:
+            self._forget(digest, cached)
+        await self.collection.delete_one({"token_digest": digest})
+
+session_store = SessionStore(db.user_sessions, SESSION_CACHE_SECONDS, SESSION_CACHE_SIZE)
+
 async def get_current_user(request: Request) -> User:
     # Check cookie first
     session_token = request.cookies.get("session_token")
@@ -248,20 +862,15 @@ async def get_current_user(request: Request) -> User:
         pass
     
     # Try session token (for Google OAuth)
-    session_doc = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
-    if not session_doc:
+    resolved = await session_store.resolve(session_token)
+    if not resolved:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    # Check expiry
-    expires_at = session_doc["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    # Check expiry (the TTL monitor only sweeps once a minute)
+    expires_at, user_doc = resolved
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
     
-    user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
@@ -272,9 +881,565 @@ async def get_admin_user(current_user: User = Depends(get_current_user)) -> User
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+# ============== DB PROFILER ==============
+# Keys kept when replaying a monitored command through explain
+EXPLAINABLE_COMMAND_KEYS = {
+    "find": ("find", "filter", "sort", "projection", "skip", "limit", "hint"),
+    "aggregate": ("aggregate", "pipeline", "cursor", "hint"),
+    "count": ("count", "query", "skip", "limit", "hint"),
+}
+
+def _plan_stages(plan) -> List[str]:
+    """All stage names in a winning plan tree"""
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _plan_stages(item)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key, value in plan.items():
+        if key in ("inputStage", "inputStages", "queryPlan"):
+            stages.extend(_plan_stages(value))
+    return stages
+
+def _winning_plans(explain_doc) -> list:
+    if isinstance(explain_doc, list):
+        return [plan for item in explain_doc for plan in _winning_plans(item)]
+    if not isinstance(explain_doc, dict):
+        return []
+    if "winningPlan" in explain_doc:
+        return [explain_doc["winningPlan"]]
+    return [plan for value in explain_doc.values() for plan in _winning_plans(value)]
+
+def winning_plan_stages(explain_doc) -> List[str]:
+    return [stage for plan in _winning_plans(explain_doc) for stage in _plan_stages(plan)]
+
+def explainable_command(op: str, command) -> Optional[dict]:
+    """The part of a monitored command that can be replayed through explain"""
+    keys = EXPLAINABLE_COMMAND_KEYS.get(op)
+    if not keys:
+        return None
+    if op == "aggregate" and any("$out" in stage or "$merge" in stage for stage in command.get("pipeline", [])):
+        return None
+    return {k: command[k] for k in keys if k in command}
+
+async def explain_command(database: str, command: dict, verbosity: str = "queryPlanner") -> dict:
+    return await client[database].command({"explain": command, "verbosity": verbosity})
+
+class RequestDbProfile:
+    """Every Mongo command issued while serving one request"""
+    
+    def __init__(self, explain_sample: int = DB_PROFILER_EXPLAIN_SAMPLE):
+        self.explain_sample = explain_sample
+        self.commands = []
+        self._explain_candidates = []
+    
+    def record(self, record: dict, started_event):
+        self.commands.append(record)
+        if len(self._explain_candidates) < self.explain_sample:
+            command = explainable_command(record["op"], started_event.command)
+            if command:
+                self._explain_candidates.append((record, started_event.database_name, command))
+    
+    async def explain_sample_commands(self):
+        """Attach winning plan stages to the sampled commands, flagging collection scans"""
+        token = db_profile_var.set(None)  # explains are not part of the request's own work
+        try:
+            for record, database, command in self._explain_candidates:
+                try:
+                    stages = winning_plan_stages(await explain_command(database, command))
+                except OperationFailure as e:
+                    record["plan_error"] = str(e)
+                    continue
+                record["plan"] = stages
+                record["collscan"] = "COLLSCAN" in stages
+        finally:
+            db_profile_var.reset(token)
+    
+    @property
+    def total_ms(self) -> float:
+        return round(sum(c["duration_ms"] for c in self.commands), 3)
+    
+    def summary(self) -> dict:
+        return {
+            "count": len(self.commands),
+            "total_ms": self.total_ms,
+            "collscans": sum(1 for c in self.commands if c.get("collscan")),
+            "commands": self.commands
+        }
+    
+    def server_timing(self) -> str:
+        entries = [f'db;dur={self.total_ms};desc="{len(self.commands)} commands"']
+        for i, c in enumerate(self.commands[:DB_PROFILER_MAX_TIMING_ENTRIES], start=1):
+            name = f"db{i}-{c['op']}-{c['collection'] or 'admin'}"
+            desc = f"docs={c['docs']}" + (" COLLSCAN" if c.get("collscan") else "")
+            entries.append(f'{name};dur={c["duration_ms"]};desc="{desc}"')
+        return ", ".join(entries)
+
+async def _is_admin_request(scope) -> bool:
+    try:
+        user = await get_current_user(Request(scope))
+    except HTTPException:
+        return False
+    return user.role == UserRole.ADMIN
+
+class DbProfilerMiddleware:
+    """Opt-in per-request database profile.
+    
+    Enabled for every request with DB_PROFILER_ENABLED=true, or per request
+    by an admin sending `X-Debug-Db: 1`. The response gets a Server-Timing
+    header listing each command (operation, collection, duration, docs
+    returned, COLLSCAN from a sampled explain). With `X-Debug-Db: json`, JSON
+    responses are wrapped as {"data": ..., "db_profile": ...}; uvicorn has no
+    HTTP trailer support, so the body is the only place a full profile fits.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        debug_mode = Headers(scope=scope).get("x-debug-db")
+        if not DB_PROFILER_ENABLED and not (debug_mode and await _is_admin_request(scope)):
+            await self.app(scope, receive, send)
+            return
+        
+        profile = RequestDbProfile()
+        wrap_json = debug_mode == "json"
+        start_message = None
+        
+        async def send_with_profile(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            await profile.explain_sample_commands()
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Server-Timing"] = profile.server_timing()
+            
+            if wrap_json and not message.get("more_body") and headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                body = json.dumps({"data": json.loads(message.get("body") or b"null"), "db_profile": profile.summary()}).encode()
+                headers["Content-Length"] = str(len(body))
+                message = {"type": "http.response.body", "body": body}
+            
+            await send(start)
+            await send(message)
+        
+        token = db_profile_var.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            db_profile_var.reset(token)
+
+# ============== SLOW QUERY LOG ==============
+def _shape_value(value):
+    """Replace literals with "?" but keep field names and operators"""
+    if isinstance(value, dict):
+        return {k: _shape_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(v, dict) for v in value):
+            return [_shape_value(v) for v in value]
+        return ["?"]  # $in lists and other literal arrays collapse to one shape
+    return "?"
+
+def query_shape(command) -> dict:
+    shape = {}
+    for key in ("filter", "query", "pipeline"):
+        if key in command:
+            shape[key] = _shape_value(command[key])
+    for key in ("sort", "projection"):
+        if key in command:
+            shape[key] = dict(command[key])
+    for key in ("updates", "deletes"):
+        if command.get(key):
+            shape["q"] = _shape_value(command[key][0].get("q", {}))
+    return shape
+
+def _find_key(doc, key):
+    """First value stored under `key` anywhere in a nested explain document"""
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        values = doc.values()
+    elif isinstance(doc, list):
+        values = doc
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+class SlowQueryRecorder:
+    """Logs Mongo commands slower than SLOW_QUERY_THRESHOLD_MS.
+    
+    The command listener hands slow commands over from Motor's executor
+    threads; a background task normalizes the query shape, samples an
+    executionStats explain (at most once per shape per interval) and writes
+    the entry to a capped `slow_queries` collection or an NDJSON file.
+    """
+    
+    IGNORED_OPS = {"explain", "getMore", "endSessions", "hello", "isMaster", "ping", "killCursors"}
+    
+    def __init__(self, collection, threshold_ms: int, log_file: str = ""):
+        self.collection = collection
+        self.threshold_ms = threshold_ms
+        self.log_file = log_file
+        self.loop = None
+        self.queue = asyncio.Queue(maxsize=1000)
+        self.dropped = 0
+        self._last_explained = {}
+    
+    async def ensure_collection(self):
+        if self.log_file:
+            return
+        if "slow_queries" not in await db.list_collection_names(filter={"name": "slow_queries"}):
+            await db.create_collection("slow_queries", capped=True, size=SLOW_QUERY_LOG_MB * 1024 * 1024)
+        await self.collection.create_index("shape_id")
+    
+    def observe(self, record: dict, started_event):
+        """Command listener sink, runs on an executor thread"""
+        if (
+            self.loop is None
+            or record["duration_ms"] < self.threshold_ms
+            or record["op"] in self.IGNORED_OPS
+            or record["collection"] == self.collection.name
+        ):
+            return
+        item = (record, started_event.database_name, started_event.command, current_handler_var.get())
+        self.loop.call_soon_threadsafe(self._enqueue, item)
+    
+    def _enqueue(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+    
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.write(await self.build_entry(*item))
+            except Exception:
+                logger.exception("Failed to record slow query")
+    
+    async def build_entry(self, record: dict, database: str, command, handler: Optional[str]) -> dict:
+        shape = json.dumps(query_shape(command), sort_keys=True, default=str)
+        shape_id = hashlib.sha1(f"{database}.{record['collection']}:{record['op']}:{shape}".encode()).hexdigest()[:16]
+        entry = {
+            "shape_id": shape_id,
+            "op": record["op"],
+            "database": database,
+            "collection": record["collection"],
+            "shape": shape,
+            "handler": handler,
+            "duration_ms": record["duration_ms"],
+            "docs": record["docs"],
+            "created_at": datetime.now(timezone.utc),
+            "explain": None
+        }
+        
+        command_to_explain = explainable_command(record["op"], command)
+        now = time.monotonic()
+        if command_to_explain and now - self._last_explained.get(shape_id, -SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS) >= SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS:
+            self._last_explained[shape_id] = now
+            try:
+                explain_doc = await explain_command(database, command_to_explain, verbosity="executionStats")
+                stats = _find_key(explain_doc, "executionStats") or {}
+                entry["explain"] = {
+                    "plan": winning_plan_stages(explain_doc),
+                    "keys_examined": stats.get("totalKeysExamined"),
+                    "docs_examined": stats.get("totalDocsExamined"),
+                    "returned": stats.get("nReturned")
+                }
+            except OperationFailure as e:
+                entry["explain"] = {"error": str(e)}
+        return entry
+    
+    async def write(self, entry: dict):
+        if self.log_file:
+            line = json.dumps(entry, default=str) + "\n"
+            await run_in_threadpool(self._append_line, line)
+        else:
+            await self.collection.insert_one(entry)
+    
+    def _append_line(self, line: str):
+        with open(self.log_file, "a") as f:
+            f.write(line)
+
+slow_query_recorder = SlowQueryRecorder(db.slow_queries, SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_LOG_FILE)
+mongo_command_listener.sinks.append(slow_query_recorder.observe)
+
+# ============== RATE LIMITING ==============
+# route: {key type: (burst capacity, seconds to refill the full burst)}
+RATE_LIMITS = {
+    "register": {"ip": (5, 600)},
+    "login": {"ip": (20, 60), "email": (5, 60)},
+    "session": {"ip": (20, 60)},
+    "contact": {"ip": (5, 600), "email": (3, 600)},
+    "seed": {"ip": (2, 60)},
+}
+
+class LocalRateLimitBackend:
+    """Token buckets in this worker's memory (each worker enforces its own budget)"""
+    
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    async def ensure_indexes(self):
+        pass
+    
+    async def consume(self, key: str, capacity: int, refill_per_second: float) -> float:
+        """Take one token; return 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+        
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+class MongoRateLimitBackend:
+    """Token buckets shared by all workers, one document per key updated atomically
+    with a pipeline update. Documents expire once their bucket would be full again."""
+    
+    def __init__(self, collection):
+        self.collection = collection
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+    
+    async def consume(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [
+                    capacity,
+                    {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed_seconds, refill_per_second]}]}
+                ]}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "updated_at": now,
+                    "expires_at": now + timedelta(seconds=capacity / refill_per_second)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / refill_per_second
+
+rate_limit_backend = MongoRateLimitBackend(db.rate_limits) if RATE_LIMIT_BACKEND == "mongo" else LocalRateLimitBackend()
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    """The address to rate limit: the peer, or with RATE_LIMIT_TRUST_FORWARDED
+    the right-most X-Forwarded-For hop not added by a trusted proxy. Entries
+    left of that are written by the client and cannot be believed."""
+    peer = request.client.host if request.client else "unknown"
+    if not RATE_LIMIT_TRUST_FORWARDED:
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+    for hop in reversed(hops + [peer]):
+        if not is_trusted_proxy(hop):
+            return hop
+    # Every hop is a trusted proxy: the left-most one is the closest to the client
+    return hops[0] if hops else peer
+
+async def check_rate_limit(route: str, request: Request, email: Optional[str] = None):
+    """Spend one token from each of the route's buckets, 429 if any is empty"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    
+    keys = {"ip": client_ip(request), "email": email.lower() if email else None}
+    for key_type, (capacity, period) in RATE_LIMITS[route].items():
+        if not keys[key_type]:
+            continue
+        retry_after = await rate_limit_backend.consume(f"{route}:{key_type}:{keys[key_type]}", capacity, capacity / period)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+            )
+
+class EventLoopLagMonitor:
+    """Samples how late asyncio.sleep() wakes up, a direct measure of event loop saturation"""
+    
+    def __init__(self, threshold_ms: int, interval: float = 0.5):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.lag = 0.0
+    
+    @property
+    def overloaded(self) -> bool:
+        return self.lag > self.threshold
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+
+loop_lag_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_THRESHOLD_MS)
+
+class LoadSheddingMiddleware:
+    """Reject requests with 503 before any work is done when this worker
+    already has too many requests in flight or its event loop is lagging."""
+    
+    def __init__(self, app, max_concurrent: int = MAX_CONCURRENT_REQUESTS, monitor: EventLoopLagMonitor = loop_lag_monitor,
+                 exempt_paths: tuple = ("/api/payments/webhook", "/api/admin/events")):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.monitor = monitor
+        self.exempt_paths = exempt_paths
+        self.in_flight = 0
+        self.shed_count = 0
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        
+        if self.in_flight >= self.max_concurrent or self.monitor.overloaded:
+            self.shed_count += 1
+            response = JSONResponse({"detail": "Server busy, please retry"}, status_code=503, headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+        
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+# ============== ADMIN EVENTS ==============
+ADMIN_EVENT_FIELDS = {
+    "order_created": ("order_id", "checkout_id", "customer_name", "product_name", "amount", "currency", "status", "payment_status", "created_at"),
+    "order_updated": ("order_id", "status", "payment_status", "amount", "currency", "updated_at"),
+    "payment_updated": ("payment_id", "order_id", "status", "amount", "currency", "updated_at"),
+    "contact_message": ("message_id", "name", "email", "created_at"),
+}
+
+CHANGE_EVENT_KINDS = {
+    ("orders", "insert"): "order_created",
+    ("orders", "update"): "order_updated",
+    ("payments", "update"): "payment_updated",
+    ("contact_messages", "insert"): "contact_message",
+}
+
+STATUS_CHANGED = {"$or": [
+    {"updateDescription.updatedFields.status": {"$exists": True}},
+    {"updateDescription.updatedFields.payment_status": {"$exists": True}}
+]}
+
+class AdminEventHub:
+    """Fans dashboard deltas out to every admin connected to this worker.
+    
+    There is one upstream source per worker: a change stream on orders,
+    payments and contact_messages when the deployment supports them
+    (replica set or sharded cluster). Otherwise the write paths publish
+    through emit(), which then only covers writes made by this worker.
+    Each subscriber has a bounded queue, and a slow one loses its oldest
+    events instead of holding the others back.
+    """
+    
+    def __init__(self, max_subscribers: int = ADMIN_EVENTS_MAX_SUBSCRIBERS, queue_size: int = ADMIN_EVENTS_QUEUE_SIZE):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.change_streams = False
+        self.published = 0
+    
+    def subscribe(self) -> asyncio.Queue:
+        if len(self.subscribers) >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many event stream connections", headers={"Retry-After": "5"})
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+    
+    def publish(self, kind: str, doc: dict):
+        self.published += 1
+        event = {"id": self.published, "type": kind, "data": {k: doc[k] for k in ADMIN_EVENT_FIELDS[kind] if k in doc}}
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+    
+    def emit(self, kind: str, doc: dict):
+        """Publish a write made by this worker, unless the change stream will deliver it"""
+        if not self.change_streams:
+            self.publish(kind, doc)
+    
+    async def watch(self):
+        pipeline = [{"$match": {"$or": [
+            {"ns.coll": {"$in": ["orders", "contact_messages"]}, "operationType": "insert"},
+            {"ns.coll": {"$in": ["orders", "payments"]}, "operationType": "update", **STATUS_CHANGED}
+        ]}}]
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self.change_streams = True
+                    logger.info("Admin events fed by MongoDB change streams")
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        kind = CHANGE_EVENT_KINDS.get((change["ns"]["coll"], change["operationType"]))
+                        if kind and change.get("fullDocument"):
+                            self.publish(kind, change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.change_streams = False
+                # 40573: change streams need a replica set, stay on in-process events
+                if e.code == 40573:
+                    logger.info("Change streams unavailable, admin events published in-process")
+                    return
+                logger.warning(f"Admin event change stream failed, retrying: {e}")
+                resume_token = None if e.code == 286 else resume_token  # ChangeStreamHistoryLost
+            except Exception:
+                self.change_streams = False
+                logger.exception("Admin event change stream failed, retrying")
+            await asyncio.sleep(5)
+
+admin_events = AdminEventHub()
+
 # ============== AUTH ROUTES ==============
 @api_router.post("/auth/register")
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, request: Request):
+    await check_rate_limit("register", request)
+    
     existing = await db.users.find_one({"email": user_data.email})
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -294,7 +1459,9 @@ async def register(user_data: UserCreate):
     return {"token": token, "user": {"user_id": user_id, "email": user_data.email, "name": user_data.name, "role": UserRole.CUSTOMER.value}}
 
 @api_router.post("/auth/login")
-async def login(user_data: UserLogin, response: Response):
+async def login(user_data: UserLogin, request: Request, response: Response):
+    await check_rate_limit("login", request, email=user_data.email)
+    
     user_doc = await db.users.find_one({"email": user_data.email}, {"_id": 0})
     if not user_doc or not verify_password(user_data.password, user_doc.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -326,6 +1493,8 @@ async def login(user_data: UserLogin, response: Response):
 @api_router.post("/auth/session")
 async def process_session(request: Request, response: Response):
     """Process Emergent OAuth session_id and create local session"""
+    await check_rate_limit("session", request)
+    
     body = await request.json()
     session_id = body.get("session_id")
     
@@ -367,17 +1536,8 @@ async def process_session(request: Request, response: Response):
     
     # Store session
     session_token = auth_data["session_token"]
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-    
-    await db.user_sessions.update_one(
-        {"user_id": user_id},
-        {"$set": {
-            "session_token": session_token,
-            "expires_at": expires_at.isoformat(),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }},
-        upsert=True
-    )
+    expires_at = datetime.now(timezone.utc) + timedelta(days=SESSION_EXPIRATION_DAYS)
+    await session_store.create(user_id, session_token, expires_at)
     
     # Set cookie
     response.set_cookie(
@@ -386,7 +1546,7 @@ async def process_session(request: Request, response: Response):
         httponly=True,
         secure=True,
         samesite="none",
-        max_age=7 * 24 * 3600,
+        max_age=SESSION_EXPIRATION_DAYS * 24 * 3600,
         path="/"
     )
     
@@ -408,213 +1568,1193 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
-        await db.user_sessions.delete_one({"session_token": session_token})
+        await session_store.revoke(session_token)
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
-# ============== PRODUCTS ROUTES ==============
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[ProductCategory] = None, active_only: bool = True):
-    query = {}
-    if category:
-        query["category"] = category.value
-    if active_only:
-        query["is_active"] = True
+# ============== ORDER EVENT LOG ==============
+class OrderEventLog:
+    """Append-only history of order and payment state transitions.
     
-    products = await db.products.find(query, {"_id": 0}).to_list(100)
-    return products
-
-@api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"product_id": product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
-
-@api_router.post("/admin/products", response_model=Product)
-async def create_product(product_data: ProductCreate, admin: User = Depends(get_admin_user)):
-    product = Product(**product_data.model_dump())
-    await db.products.insert_one(product.model_dump())
-    return product
-
-@api_router.put("/admin/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, product_data: ProductUpdate, admin: User = Depends(get_admin_user)):
-    update_data = {k: v for k, v in product_data.model_dump().items() if v is not None}
-    if not update_data:
-        raise HTTPException(status_code=400, detail="No data to update")
+    record() only appends to an in-memory buffer. A background task writes
+    the buffer with one insert_many once ORDER_EVENTS_BATCH_SIZE entries
+    are waiting or every ORDER_EVENTS_FLUSH_MS, so a transition adds no
+    round trip to the request that caused it. Entries are keyed by the
+    payment reference (order_id, or checkout_id for cart-level events).
+    """
     
-    result = await db.products.update_one({"product_id": product_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Product not found")
+    def __init__(self, collection, batch_size: int, flush_interval_ms: int, max_buffer: int = ORDER_EVENTS_MAX_BUFFER):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.buffer = deque(maxlen=max_buffer)
+        self.written = 0
+        self.dropped = 0
+        self._wake = asyncio.Event()
     
-    product = await db.products.find_one({"product_id": product_id}, {"_id": 0})
-    return product
+    async def ensure_indexes(self):
+        await self.collection.create_index([("order_id", 1), ("at", 1)])
+    
+    def record(self, order_id: str, event: str, **details):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append({"order_id": order_id, "event": event, "at": datetime.now(timezone.utc), **details})
+        if len(self.buffer) >= self.batch_size:
+            self._wake.set()
+    
+    async def flush(self):
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # A retried batch may be partly written already
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    logger.error(f"Dropped order events after a bulk write error: {e.details['writeErrors'][:3]}")
+            except Exception:
+                logger.exception("Failed to write order events, will retry")
+                self.buffer.extendleft(reversed(batch))
+                return
+            self.written += len(batch)
+    
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+    
+    async def timeline(self, references: List[str]) -> List[dict]:
+        events = await self.collection.find({"order_id": {"$in": references}}, {"_id": 0}).sort("at", 1).to_list(1000)
+        # Entries still waiting in this worker's buffer; ones put back after a failed
+        # write keep the _id the driver gave them, so a retry cannot write them twice
+        events += [{k: v for k, v in e.items() if k != "_id"} for e in self.buffer if e["order_id"] in references]
+        # Stored events come back naive, buffered ones are aware
+        return sorted(events, key=lambda e: parse_datetime(e["at"]))
 
-@api_router.delete("/admin/products/{product_id}")
-async def delete_product(product_id: str, admin: User = Depends(get_admin_user)):
-    result = await db.products.delete_one({"product_id": product_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return {"message": "Product deleted"}
+order_events = OrderEventLog(db.order_events, ORDER_EVENTS_BATCH_SIZE, ORDER_EVENTS_FLUSH_MS)
 
-# ============== ORDERS ROUTES ==============
-@api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
-    product = await db.products.find_one({"product_id": order_data.product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+# ============== EMAIL OUTBOX ==============
+class EmailOutbox:
+    """Durable queue of outgoing emails, sent by a background worker.
     
-    amount = product["price_monthly"] if order_data.plan_duration == "monthly" else product["price_yearly"]
+    Request handlers only insert into the outbox collection. The sender
+    claims due messages in batches, sends them over one SMTP connection that
+    stays open between batches (until SMTP_IDLE_SECONDS unused), and
+    reschedules failures with exponential backoff until EMAIL_MAX_ATTEMPTS.
+    Invoice emails get the invoice PDF attached at send time, from the same
+    cache as the download endpoint.
     
-    order = Order(
-        user_id=current_user.user_id,
+    Claiming a message moves its next attempt EMAIL_CLAIM_SECONDS ahead, so
+    a worker dying mid-batch only delays its messages. Sent messages expire
+    after EMAIL_SENT_RETENTION_DAYS; failed ones stay for inspection. With
+    no SMTP_HOST nothing is queued. For offline runs, point SMTP_HOST and
+    SMTP_PORT at backend/smtp_stub.py.
+    """
+    
+    def __init__(self, collection, batch_size: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index("email_id", unique=True)
+        await self.collection.create_index([("status", 1), ("next_attempt_at", 1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+    
+    async def enqueue(self, messages: List[dict]):
+        """Queue messages with "to", "subject", "body" and optional "reply_to" and "invoice_id" keys"""
+        if not messages:
+            return
+        if not SMTP_HOST:
+            # No sender runs, the rows would only pile up
+            logger.info(f"SMTP_HOST is not set, not sending {len(messages)} emails")
+            return
+        now = datetime.now(timezone.utc)
+        await self.collection.insert_many([
+            {"email_id": new_id("EML"), **message, "status": "pending", "attempts": 0, "next_attempt_at": now, "created_at": now}
+            for message in messages
+        ], ordered=False)
+        self._wakeup.set()
+    
+    async def claim(self) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        due = {"status": "pending", "next_attempt_at": {"$lte": now}}
+        email_ids = [m["email_id"] for m in await self.collection.find(
+            due, {"_id": 0, "email_id": 1}
+        ).sort("next_attempt_at", 1).limit(self.batch_size).to_list(self.batch_size)]
+        if not email_ids:
+            return []
+        claim_id = uuid.uuid4().hex
+        await self.collection.update_many(
+            {**due, "email_id": {"$in": email_ids}},
+            {"$set": {"claim_id": claim_id, "next_attempt_at": now + timedelta(seconds=EMAIL_CLAIM_SECONDS)}}
+        )
+        return await self.collection.find({"claim_id": claim_id}, {"_id": 0}).to_list(None)
+    
+    async def build(self, messages: List[dict]) -> list:
+        """EmailMessage per outbox entry, or the exception that prevented building it"""
+        invoice_ids = [m["invoice_id"] for m in messages if m.get("invoice_id")]
+        invoices = {
+            i["invoice_id"]: i for i in await db.invoices.find({"invoice_id": {"$in": invoice_ids}}, {"_id": 0}).to_list(None)
+        } if invoice_ids else {}
+        emails = []
+        for message in messages:
+            email = EmailMessage()
+            email["From"] = EMAIL_FROM
+            email["To"] = message["to"]
+            email["Subject"] = message["subject"]
+            email["Message-ID"] = f"<{message['email_id']}@igate-host.com>"
+            if message.get("reply_to"):
+                email["Reply-To"] = message["reply_to"]
+            email.set_content(message["body"])
+            invoice = invoices.get(message.get("invoice_id"))
+            if invoice:
+                try:
+                    pdf = await get_invoice_pdf_bytes(invoice)
+                except Exception as e:
+                    emails.append(e)
+                    continue
+                email.add_attachment(pdf, maintype="application", subtype="pdf", filename=f"invoice_{invoice['invoice_number']}.pdf")
+            emails.append(email)
+        return emails
+    
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USERNAME:
+            smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
+        return smtp
+    
+    def _send_batch(self, emails: list) -> list:
+        """Runs in a worker thread. Returns None or the exception for each email"""
+        results = []
+        for email in emails:
+            if isinstance(email, Exception):
+                results.append(email)
+                continue
+            try:
+                for attempt in range(2):
+                    if self._smtp is None:
+                        self._smtp = self._connect()
+                    try:
+                        self._smtp.send_message(email)
+                        break
+                    except smtplib.SMTPServerDisconnected:
+                        # The server dropped the pooled connection, reconnect once
+                        self._smtp = None
+                        if attempt:
+                            raise
+                results.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                results.append(e)
+                if self._smtp is None:
+                    # Cannot connect: the rest of the batch would fail the same way
+                    results += [e] * (len(emails) - len(results))
+                    break
+        self._smtp_used_at = time.monotonic()
+        return results
+    
+    def close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+    
+    async def record(self, messages: List[dict], results: list, report: dict):
+        now = datetime.now(timezone.utc)
+        operations = []
+        for message, error in zip(messages, results):
+            match = {"email_id": message["email_id"], "claim_id": message["claim_id"]}
+            attempts = message["attempts"] + 1
+            if error is None:
+                report["sent"] += 1
+                operations.append(UpdateOne(match, {"$set": {
+                    "status": "sent", "attempts": attempts, "sent_at": now,
+                    "expires_at": now + timedelta(days=EMAIL_SENT_RETENTION_DAYS)
+                }}))
+                continue
+            rejected = isinstance(error, smtplib.SMTPRecipientsRefused) or (
+                isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+            )
+            if rejected or attempts >= EMAIL_MAX_ATTEMPTS:
+                report["failed"] += 1
+                update = {"status": "failed", "attempts": attempts, "last_error": repr(error)[:500]}
+                logger.warning(f"Email {message['email_id']} to {message['to']} failed: {error!r}")
+            else:
+                report["retried"] += 1
+                delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+                update = {"attempts": attempts, "next_attempt_at": now + timedelta(seconds=delay), "last_error": repr(error)[:500]}
+            operations.append(UpdateOne(match, {"$set": update}))
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+    
+    async def run(self) -> dict:
+        report = {"sent": 0, "retried": 0, "failed": 0}
+        async with self._lock:
+            while True:
+                messages = await self.claim()
+                if not messages:
+                    break
+                emails = await self.build(messages)
+                results = await run_in_threadpool(self._send_batch, emails)
+                await self.record(messages, results, report)
+        self.sent += report["sent"]
+        self.retried += report["retried"]
+        self.failed += report["failed"]
+        return report
+    
+    async def loop(self, poll_seconds: int):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Email outbox run failed")
+            async with self._lock:
+                if self._smtp is not None and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+                    await run_in_threadpool(self.close)
+    
+    def stats(self) -> dict:
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "connected": self._smtp is not None}
+
+email_outbox = EmailOutbox(db.email_outbox, EMAIL_OUTBOX_BATCH_SIZE)
+
+def invoice_email(invoice: Invoice) -> dict:
+    product_name = invoice.product_name_en or invoice.product_name
+    return {
+        "to": invoice.customer_email,
+        "subject": f"Invoice {invoice.invoice_number} - Igate-host",
+        "body": (
+            f"Hello {invoice.customer_name},\n\n"
+            f"Thank you for your payment. Your invoice {invoice.invoice_number} for "
+            f"{product_name} ({invoice.plan_duration}) is attached.\n\n"
+            f"Total: {invoice.total} {invoice.currency}\n\n"
+            "Igate-host\nsupport@igate-host.com"
+        ),
+        "invoice_id": invoice.invoice_id
+    }
+
+def contact_email(message: ContactMessage) -> dict:
+    return {
+        "to": ADMIN_NOTIFY_EMAIL,
+        "reply_to": message.email,
+        "subject": f"New contact message from {message.name}",
+        "body": f"{message.name} <{message.email}> wrote:\n\n{message.message}"
+    }
+
+# ============== ORDER & PAYMENT HELPERS ==============
+_transactions_supported = True
+
+def plan_price(product: dict, plan_duration: str) -> float:
+    return product["price_monthly"] if plan_duration == "monthly" else product["price_yearly"]
+
+def to_minor(value) -> int:
+    """Major units (199.99 EGP) to integer minor units (19999), rounding half up"""
+    return int((Decimal(str(value)) * MINOR_UNITS).to_integral_value(ROUND_HALF_UP))
+
+def from_minor(value: int) -> float:
+    return value / MINOR_UNITS
+
+def order_reference_query(reference_id: str) -> dict:
+    """Match the orders a payment reference covers: one order, or every order of a checkout"""
+    if reference_id.startswith(CHECKOUT_ID_PREFIX):
+        return {"checkout_id": reference_id}
+    return id_query("order_id", reference_id)
+
+def order_references_query(reference_ids: List[str]) -> dict:
+    """order_reference_query for many references at once"""
+    checkout_ids = [r for r in reference_ids if r.startswith(CHECKOUT_ID_PREFIX)]
+    order_ids = [r for r in reference_ids if not r.startswith(CHECKOUT_ID_PREFIX)]
+    return {"$or": [{"checkout_id": {"$in": checkout_ids}}, {"order_id": {"$in": order_ids}}]}
+
+_kashier_http: Optional[aiohttp.ClientSession] = None
+
+def kashier_http() -> aiohttp.ClientSession:
+    """Shared keep-alive HTTP client for Kashier, created on first use inside the running loop"""
+    global _kashier_http
+    if _kashier_http is None or _kashier_http.closed:
+        _kashier_http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=KASHIER_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=KASHIER_HTTP_TIMEOUT_SECONDS)
+        )
+    return _kashier_http
+
+async def insert_many_atomic(collection, documents: List[dict]):
+    """insert_many inside a transaction when the deployment supports one (replica set or mongos)"""
+    global _transactions_supported
+    if _transactions_supported:
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    await collection.insert_many(documents, session=session)
+            return
+        except OperationFailure as e:
+            # IllegalOperation: standalone mongod, transactions are not available
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB transactions unavailable, falling back to plain insert_many")
+    await collection.insert_many(documents)
+
+def payment_session_response(payment: dict, reused: bool = False) -> dict:
+    response = {
+        "payment_id": payment["payment_id"],
+        "order_id": payment["order_id"],
+        "amount": payment["amount"],
+        "currency": payment["currency"],
+        "reused": reused
+    }
+    if payment.get("payment_url"):
+        response["session_id"] = payment.get("session_id")
+        response["payment_url"] = payment["payment_url"]
+    else:
+        response["mock_mode"] = True
+        response["message"] = "Payment gateway not configured. Use mock payment."
+    return response
+
+async def open_payment_session(reference_id: str, orders: List[dict], idempotency_key: Optional[str] = None) -> dict:
+    """Record a pending payment covering `orders` and open a Kashier session for it.
+    
+    Calls with the same idempotency key (the Idempotency-Key header, or
+    reference and amount) get the existing pending payment and its Kashier
+    redirect back, until that session expires, for a single MongoDB read.
+    """
+    amount = from_minor(sum(to_minor(o["amount"]) for o in orders))
+    currency = orders[0]["currency"]
+    mock_mode = not KASHIER_MERCHANT_ID or not KASHIER_API_KEY
+    # Client keys are scoped to the reference, which the caller already checked belongs to the user
+    idempotency_key = f"{reference_id}:{idempotency_key or f'{int(round(amount * 100))}:{currency}'}"
+    now = datetime.now(timezone.utc)
+    
+    existing = await db.payments.find_one(
+        {"idempotency_key": idempotency_key, "status": PaymentStatus.PENDING.value}, {"_id": 0}
+    )
+    if existing:
+        session_expires_at = parse_datetime(existing.get("session_expires_at"))
+        if mock_mode or (existing.get("payment_url") and session_expires_at and session_expires_at > now):
+            return payment_session_response(existing, reused=True)
+        if not existing.get("payment_url") and now - parse_datetime(existing["created_at"]) < timedelta(minutes=1):
+            raise HTTPException(status_code=409, detail="Payment session is being created, please retry")
+        # Kashier session expired: retire it so the key can be reused
+        await db.payments.update_one(
+            {"payment_id": existing["payment_id"]},
+            {"$set": {"status": PaymentStatus.EXPIRED.value, "updated_at": now.isoformat()}}
+        )
+        order_events.record(reference_id, "payment_expired", payment_id=existing["payment_id"], reason="session_expired")
+    
+    # Create payment record
+    payment = Payment(
+        order_id=reference_id,
+        amount=amount,
+        currency=currency,
+        idempotency_key=idempotency_key
+    )
+    try:
+        await db.payments.insert_one(payment.model_dump())
+    except DuplicateKeyError:
+        # A concurrent request with the same key won the insert
+        winner = await db.payments.find_one(
+            {"idempotency_key": idempotency_key, "status": PaymentStatus.PENDING.value}, {"_id": 0}
+        )
+        if winner and (mock_mode or winner.get("payment_url")):
+            return payment_session_response(winner, reused=True)
+        raise HTTPException(status_code=409, detail="Payment session is being created, please retry")
+    order_events.record(reference_id, "payment_created", payment_id=payment.payment_id, amount=amount, currency=currency)
+    
+    # For demo/sandbox, we'll create a mock payment session
+    # In production, this would call Kashier API
+    if mock_mode:
+        # Return mock session for development
+        return payment_session_response(payment.model_dump())
+    
+    # Prepare Kashier payment request
+    payment_data = {
+        "merchant_id": KASHIER_MERCHANT_ID,
+        "merchant_order_id": reference_id,
+        "amount": int(round(amount * 100)),  # Convert to smallest unit
+        "currency": currency,
+        "customer_email": orders[0]["customer_email"],
+        "description": f"Payment for {', '.join(o['product_name'] for o in orders)}"
+    }
+    
+    # Generate signature
+    data_str = json.dumps(payment_data, separators=(',', ':'), sort_keys=True)
+    signature = hmac.new(KASHIER_API_KEY.encode(), data_str.encode(), hashlib.sha256).hexdigest().upper()
+    
+    async with kashier_http().post(
+        f"{KASHIER_API_URL}/api/v1/payment/session",
+        json=payment_data,
+        headers={"Content-Type": "application/json", "X-Signature": signature}
+    ) as resp:
+        result = await resp.json()
+    
+    if resp.status != 200 or not result.get("status"):
+        # Free the idempotency key so the customer can retry
+        await db.payments.update_one(
+            {"payment_id": payment.payment_id},
+            {"$set": {"status": PaymentStatus.FAILED.value, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        order_events.record(reference_id, "payment_failed", payment_id=payment.payment_id, reason="session_rejected")
+        raise HTTPException(status_code=400, detail=result.get("message", "Payment session failed"))
+    
+    session_fields = {
+        "session_id": result.get("id"),
+        "payment_url": result.get("redirect_url"),
+        "session_expires_at": now + timedelta(minutes=KASHIER_SESSION_TTL_MINUTES)
+    }
+    await db.payments.update_one({"payment_id": payment.payment_id}, {"$set": session_fields})
+    return payment_session_response({**payment.model_dump(), **session_fields})
+
+async def count_customer_orders(user_id: str, count: int, at: datetime):
+    """Keep the per-customer counters behind /admin/customers current"""
+    await db.users.update_one({"user_id": user_id}, {"$inc": {"order_count": count}, "$max": {"last_order_at": at}})
+
+async def count_customer_payments(paid_orders: List[dict]):
+    per_user = {}
+    for order in paid_orders:
+        totals = per_user.setdefault(order["user_id"], {"paid_order_count": 0, "paid_total": 0})
+        totals["paid_order_count"] += 1
+        totals["paid_total"] += order["amount"]
+    if per_user:
+        await db.users.bulk_write([UpdateOne({"user_id": user_id}, {"$inc": inc}) for user_id, inc in per_user.items()], ordered=False)
+
+async def issue_invoices(orders: List[dict]) -> List[Invoice]:
+    """Create one invoice per paid order with consecutive invoice numbers.
+    
+    Each order carries the payment_id of the payment that settled it.
+    """
+    invoice_count = await db.invoices.count_documents({})
+    invoices = [
+        Invoice(
+            invoice_number=f"IG-{str(invoice_count + i + 1).zfill(4)}",
+            order_id=order["order_id"],
+            user_id=order["user_id"],
+            payment_id=order["payment_id"],
+            customer_name=order["customer_name"],
+            customer_email=order["customer_email"],
+            customer_phone=order.get("customer_phone"),
+            product_name=order["product_name"],
+            product_name_ar=order.get("product_name_ar"),
+            product_name_en=order.get("product_name_en"),
+            plan_duration=order["plan_duration"],
+            subtotal=order.get("subtotal") or order["amount"],
+            tax=order.get("tax", 0),
+            tax_percentage=order.get("tax_percentage", 0),
+            total=order["amount"],
+            currency=order["currency"]
+        )
+        for i, order in enumerate(orders)
+    ]
+    if invoices:
+        await db.invoices.insert_many([invoice.model_dump() for invoice in invoices])
+    return invoices
+
+async def settle_payments(outcomes: List[dict], source: str) -> dict:
+    """Apply gateway outcomes to pending payments, their orders and invoices in bulk.
+    
+    Each outcome is {"payment_id", "paid", "transaction_id"}; `source` names
+    the caller in the order event log. A payment is
+    only settled while it is still pending, so the webhook, the reconciler
+    and a redelivered webhook never apply the same payment twice. Likewise
+    only orders still awaiting payment are moved, and only those are counted
+    and invoiced: a second payment for an order that is already paid (or
+    paid through its checkout) leaves the order alone. Such a payment was
+    still captured, so it is marked expired with refund_required instead of
+    paid. Returns the invoices issued for each settled payment_id ([] for
+    failed and superseded ones).
+    """
+    if not outcomes:
+        return {}
+    now = datetime.now(timezone.utc).isoformat()
+    settlement_id = uuid.uuid4().hex
+    await db.payments.bulk_write([
+        UpdateOne(
+            {"payment_id": o["payment_id"], "status": PaymentStatus.PENDING.value},
+            {"$set": {
+                "status": (PaymentStatus.PAID if o["paid"] else PaymentStatus.FAILED).value,
+                "kashier_transaction_id": o.get("transaction_id"),
+                "settlement_id": settlement_id,
+                "updated_at": now
+            }}
+        )
+        for o in outcomes
+    ], ordered=False)
+    settled = await db.payments.find(
+        {"payment_id": {"$in": [o["payment_id"] for o in outcomes]}, "settlement_id": settlement_id},
+        {"_id": 0, "payment_id": 1, "order_id": 1, "status": 1, "amount": 1, "currency": 1, "updated_at": 1}
+    ).to_list(None)
+    issued = {p["payment_id"]: [] for p in settled}
+    if not settled:
+        return issued
+    # Paid outcomes go first, so a failed payment settled in the same call
+    # cannot cancel an order another payment has just paid
+    settled.sort(key=lambda p: p["status"] != PaymentStatus.PAID.value)
+    await db.orders.bulk_write([
+        UpdateMany(
+            {**order_reference_query(p["order_id"]), "payment_status": PaymentStatus.PENDING.value},
+            {"$set": {
+                "payment_status": p["status"],
+                "status": (OrderStatus.COMPLETED if p["status"] == PaymentStatus.PAID.value else OrderStatus.CANCELLED).value,
+                "payment_id": p["payment_id"],
+                "settlement_id": settlement_id,
+                "updated_at": now
+            }}
+        )
+        for p in settled
+    ], ordered=True)
+    
+    orders = await db.orders.find({"settlement_id": settlement_id}, {"_id": 0}).to_list(None)
+    
+    covered = {order["payment_id"] for order in orders}
+    superseded = [p for p in settled if p["status"] == PaymentStatus.PAID.value and p["payment_id"] not in covered]
+    if superseded:
+        await db.payments.update_many(
+            {"payment_id": {"$in": [p["payment_id"] for p in superseded]}, "settlement_id": settlement_id},
+            {"$set": {"status": PaymentStatus.EXPIRED.value, "refund_required": True}}
+        )
+        for payment in superseded:
+            payment.update(status=PaymentStatus.EXPIRED.value, refund_required=True)
+            logger.warning(f"Payment {payment['payment_id']} was captured after its orders were settled, refund required")
+    transaction_ids = {o["payment_id"]: o.get("transaction_id") for o in outcomes}
+    for payment in settled:
+        admin_events.emit("payment_updated", payment)
+        order_events.record(
+            payment["order_id"], f"payment_{payment['status']}",
+            payment_id=payment["payment_id"], transaction_id=transaction_ids[payment["payment_id"]], source=source,
+            **({"reason": "superseded", "refund_required": True} if payment.get("refund_required") else {})
+        )
+    
+    if orders:
+        for order in orders:
+            admin_events.emit("order_updated", order)
+        # Reports cached for the days these orders were placed are stale now
+        await sales_report_cache.invalidate([order["created_at"] for order in orders])
+        paid_orders = [o for o in orders if o["payment_status"] == PaymentStatus.PAID.value]
+        await count_customer_payments(paid_orders)
+        invoices = await issue_invoices(paid_orders)
+        for invoice in invoices:
+            issued[invoice.payment_id].append(invoice)
+            order_events.record(invoice.order_id, "invoice_issued", invoice_id=invoice.invoice_id, invoice_number=invoice.invoice_number)
+        await email_outbox.enqueue([invoice_email(invoice) for invoice in invoices])
+    return issued
+
+# ============== COMPRESSION ==============
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/html", "text/plain", "text/css", "text/csv", "application/javascript")
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Choose br or gzip from an Accept-Encoding header, None for identity"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            continue
+        accepted[coding] = q
+    
+    wildcard = accepted.get("*", 0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressionBudget:
+    """Caps the wall time a worker spends compressing per second. Once the
+    budget is used up, responses go out uncompressed until the next window,
+    so compression never starves the event loop under load."""
+    
+    def __init__(self, ms_per_second: int):
+        self.budget = ms_per_second / 1000
+        self.window_start = time.monotonic()
+        self.spent = 0.0
+    
+    def available(self) -> bool:
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.spent = 0.0
+        return self.spent < self.budget
+    
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        started = time.perf_counter()
+        try:
+            return compress_body(body, encoding)
+        finally:
+            self.spent += time.perf_counter() - started
+
+compression_budget = CompressionBudget(COMPRESSION_CPU_BUDGET_MS)
+
+class CachedPayload:
+    """Serialized response body plus its compressed variants, built on first use"""
+    
+    def __init__(self, body: bytes):
+        self.body = body
+        self._variants = {}
+    
+    def encoded(self, encoding: Optional[str]):
+        if not encoding or len(self.body) < COMPRESSION_MIN_BYTES:
+            return self.body, None
+        variant = self._variants.get(encoding)
+        if variant is None:
+            if not compression_budget.available():
+                return self.body, None
+            variant = self._variants[encoding] = compression_budget.compress(self.body, encoding)
+        return variant, encoding
+
+def cached_payload_response(payload: CachedPayload, request: Request, vary: str = "Accept-Encoding") -> Response:
+    body, encoding = payload.encoded(negotiate_encoding(request.headers.get("Accept-Encoding")))
+    headers = {"Vary": vary}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+class CompressionMiddleware:
+    """Compress single-chunk responses negotiated from Accept-Encoding.
+    
+    Streaming bodies (PDF/ZIP downloads), bodies under the size threshold,
+    non-text content types and responses that already carry a
+    Content-Encoding (precompressed cache hits) pass through untouched.
+    """
+    
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES, budget: CompressionBudget = compression_budget):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.budget = budget
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            
+            if (
+                message.get("more_body")
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+                or not self.budget.available()
+            ):
+                await send(start)
+                await send(message)
+                return
+            
+            compressed = self.budget.compress(body, encoding)
+            headers.add_vary_header("Accept-Encoding")
+            if len(compressed) >= len(body):
+                await send(start)
+                await send(message)
+                return
+            
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+        
+        await self.app(scope, receive, send_compressed)
+
+# ============== SINGLE FLIGHT ==============
+single_flight_groups = {}
+
+class SingleFlight:
+    """Collapse concurrent identical reads into one in-flight call.
+    
+    Callers arriving while a call for the same key is running await its
+    result instead of issuing their own query. Nothing is kept once the
+    call finishes, so this is independent of (and complements) caching.
+    Results are shared between callers and must not be mutated.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        single_flight_groups[name] = self
+    
+    async def do(self, key, fn):
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: one caller disconnecting must not cancel the shared query
+        return await asyncio.shield(future)
+    
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+products_flight = SingleFlight("products")
+product_flight = SingleFlight("product")
+admin_stats_flight = SingleFlight("admin_stats")
+pricing_flight = SingleFlight("pricing")
+
+# ============== CATALOG HELPERS ==============
+def negotiate_language(accept_language: Optional[str]) -> str:
+    """Pick the best supported language from an Accept-Language header"""
+    best, best_q = DEFAULT_LANGUAGE, 0.0
+    for part in (accept_language or "").split(","):
+        tag, _, params = part.strip().partition(";")
+        primary = tag.split("-")[0].strip().lower()
+        if primary not in (Language.AR.value, Language.EN.value):
+            continue
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            continue
+        if q > best_q:
+            best, best_q = primary, q
+    return best
+
+def resolve_language(lang: Optional[Language], request: Request) -> Optional[str]:
+    if lang is None:
+        return None
+    if lang == Language.AUTO:
+        return negotiate_language(request.headers.get("Accept-Language"))
+    return lang.value
+
+def localized_product_projection(language: str) -> dict:
+    return {
+        "_id": 0,
+        "product_id": 1,
+        "name": f"$name_{language}",
+        "description": f"$description_{language}",
+        "category": 1,
+        "price_monthly": 1,
+        "price_yearly": 1,
+        "features": 1,
+        "is_active": 1,
+        "is_popular": 1,
+        "created_at": 1
+    }
+
+class CatalogCache:
+    """Pre-serialized (and lazily precompressed) catalog responses. Cleared on
+    every product write in this worker; the TTL bounds staleness for writes
+    made through other workers."""
+    
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+    
+    def get(self, key: tuple) -> Optional[CachedPayload]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def set(self, key: tuple, body: bytes) -> CachedPayload:
+        payload = CachedPayload(body)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, payload)
+        return payload
+    
+    def invalidate(self):
+        self._entries.clear()
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL_SECONDS)
+_products_adapter = TypeAdapter(List[Product])
+_localized_products_adapter = TypeAdapter(List[LocalizedProduct])
+
+# ============== PRICING ==============
+PRICING_PRODUCT_FIELDS = {"_id": 0, "product_id": 1, "name_ar": 1, "name_en": 1, "price_monthly": 1, "price_yearly": 1}
+
+class PricingSnapshot:
+    """Products and tax rate at one point in time, with prices in minor units.
+    
+    Pricing is integer arithmetic only: tax is charged per line at the rate
+    in basis points and rounded half up, and a cart total is the sum of its
+    lines, so every order and invoice adds up to what the cart was quoted.
+    """
+    
+    def __init__(self, products: List[dict], settings: Optional[dict]):
+        self.products = {p["product_id"]: p for p in products}
+        self.prices = {p["product_id"]: (to_minor(p["price_monthly"]), to_minor(p["price_yearly"])) for p in products}
+        settings = settings or {}
+        self.tax_percentage = float(settings.get("tax_percentage") or 0) if settings.get("tax_enabled") else 0.0
+        self.tax_rate_bp = to_minor(self.tax_percentage)
+    
+    def product(self, product_id: str) -> dict:
+        product = self.products.get(product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product not found: {product_id}")
+        return product
+    
+    def line(self, product_id: str, plan_duration: str) -> QuoteLine:
+        self.product(product_id)
+        monthly, yearly = self.prices[product_id]
+        subtotal = monthly if plan_duration == "monthly" else yearly
+        tax = (subtotal * self.tax_rate_bp + 5000) // 10000
+        return QuoteLine(
+            product_id=product_id, plan_duration=plan_duration,
+            subtotal_minor=subtotal, tax_minor=tax, total_minor=subtotal + tax
+        )
+    
+    def quote(self, items: List[CartItem]) -> Quote:
+        missing = list(dict.fromkeys(item.product_id for item in items if item.product_id not in self.products))
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Product not found: {', '.join(missing)}")
+        lines = [self.line(item.product_id, item.plan_duration) for item in items]
+        return Quote(
+            lines=lines,
+            subtotal_minor=sum(line.subtotal_minor for line in lines),
+            tax_minor=sum(line.tax_minor for line in lines),
+            total_minor=sum(line.total_minor for line in lines),
+            tax_percentage=self.tax_percentage
+        )
+
+class PricingCache:
+    """The current PricingSnapshot, shared by quotes, orders and checkout.
+    
+    Cleared on every product or settings write in this worker; the TTL
+    bounds staleness for writes made through other workers.
+    """
+    
+    def __init__(self, products, settings, ttl_seconds: int):
+        self.products = products
+        self.settings = settings
+        self.ttl_seconds = ttl_seconds
+        self.loads = 0
+        self._snapshot = None
+        self._expires_at = 0.0
+        self._version = 0
+    
+    async def get(self) -> PricingSnapshot:
+        if self._snapshot is not None and self._expires_at > time.monotonic():
+            return self._snapshot
+        return await pricing_flight.do(self._version, self._load)
+    
+    async def _load(self) -> PricingSnapshot:
+        version = self._version
+        products, settings = await asyncio.gather(
+            self.products.find({}, PRICING_PRODUCT_FIELDS).to_list(None),
+            self.settings.find_one({"type": "global"}, {"_id": 0, "tax_enabled": 1, "tax_percentage": 1})
+        )
+        self.loads += 1
+        snapshot = PricingSnapshot(products, settings)
+        # A write that invalidated the cache during the load wins
+        if version == self._version:
+            self._snapshot = snapshot
+            self._expires_at = time.monotonic() + self.ttl_seconds
+        return snapshot
+    
+    def invalidate(self):
+        self._version += 1
+        self._snapshot = None
+    
+    def stats(self) -> dict:
+        return {"loads": self.loads, "warm": self._snapshot is not None and self._expires_at > time.monotonic()}
+
+pricing_cache = PricingCache(db.products, db.settings, PRICING_CACHE_TTL_SECONDS)
+
+@api_router.post("/quote", response_model=Quote)
+async def quote_cart(quote_data: QuoteCreate):
+    """Price a batch of line items, tax included, in integer minor units"""
+    snapshot = await pricing_cache.get()
+    return snapshot.quote(quote_data.items)
+
+# ============== PRODUCTS ROUTES ==============
+@api_router.get("/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    category: Optional[ProductCategory] = None,
+    active_only: bool = True,
+    lang: Optional[Language] = None,
+    projection: ListProjection = Depends(list_projection(Product))
+):
+    query = {}
+    if category:
+        query["category"] = category.value
+    if active_only:
+        query["is_active"] = True
+    
+    language = resolve_language(lang, request)
+    if projection.fields:
+        if language:
+            raise HTTPException(status_code=400, detail="lang cannot be combined with fields or view")
+        products = await products_flight.do(
+            ("fields", projection.fields, category, active_only),
+            lambda: db.products.find(query, projection.mongo).to_list(100)
+        )
+        return projection.response(products)
+    
+    cache_key = (language, category.value if category else None, active_only)
+    payload = catalog_cache.get(cache_key)
+    if payload is None:
+        async def load_catalog() -> CachedPayload:
+            if language:
+                products = await db.products.find(query, localized_product_projection(language)).to_list(100)
+                body = _localized_products_adapter.dump_json(_localized_products_adapter.validate_python(products))
+            else:
+                products = await db.products.find(query, {"_id": 0}).to_list(100)
+                body = _products_adapter.dump_json(_products_adapter.validate_python(products))
+            return catalog_cache.set(cache_key, body)
+        
+        payload = await products_flight.do(("catalog", cache_key), load_catalog)
+    
+    vary = "Accept-Encoding, Accept-Language" if lang == Language.AUTO else "Accept-Encoding"
+    return cached_payload_response(payload, request, vary=vary)
+
+@api_router.get("/products/{product_id}", response_model=Product)
+async def get_product(product_id: str):
+    product = await product_flight.do(product_id, lambda: db.products.find_one({"product_id": product_id}, {"_id": 0}))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+@api_router.post("/admin/products", response_model=Product)
+async def create_product(product_data: ProductCreate, admin: User = Depends(get_admin_user)):
+    product = Product(**product_data.model_dump())
+    await db.products.insert_one(product.model_dump())
+    catalog_cache.invalidate()
+    pricing_cache.invalidate()
+    return product
+
+@api_router.put("/admin/products/{product_id}", response_model=Product)
+async def update_product(product_id: str, product_data: ProductUpdate, admin: User = Depends(get_admin_user)):
+    update_data = {k: v for k, v in product_data.model_dump().items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No data to update")
+    
+    result = await db.products.update_one({"product_id": product_id}, {"$set": update_data})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    catalog_cache.invalidate()
+    pricing_cache.invalidate()
+    
+    product = await db.products.find_one({"product_id": product_id}, {"_id": 0})
+    return product
+
+@api_router.delete("/admin/products/{product_id}")
+async def delete_product(product_id: str, admin: User = Depends(get_admin_user)):
+    result = await db.products.delete_one({"product_id": product_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
+    catalog_cache.invalidate()
+    pricing_cache.invalidate()
+    return {"message": "Product deleted"}
+
+# ============== ORDERS ROUTES ==============
+@api_router.post("/orders", response_model=Order)
+async def create_order(order_data: OrderCreate, current_user: User = Depends(get_current_user)):
+    pricing = await pricing_cache.get()
+    product = pricing.product(order_data.product_id)
+    line = pricing.line(order_data.product_id, order_data.plan_duration)
+    
+    order = Order(
+        user_id=current_user.user_id,
         product_id=order_data.product_id,
         product_name=product["name_ar"],
+        product_name_ar=product["name_ar"],
+        product_name_en=product["name_en"],
         plan_duration=order_data.plan_duration,
-        amount=amount,
+        **line.order_fields(pricing.tax_percentage),
         customer_name=order_data.customer_name,
         customer_email=order_data.customer_email,
         customer_phone=order_data.customer_phone
     )
     
     await db.orders.insert_one(order.model_dump())
+    await count_customer_orders(current_user.user_id, 1, order.created_at)
+    admin_events.emit("order_created", order.model_dump())
+    order_events.record(order.order_id, "order_created", amount=order.amount, currency=order.currency, user_id=order.user_id)
     return order
 
+@api_router.post("/checkout")
+async def checkout(checkout_data: CheckoutCreate, request: Request, current_user: User = Depends(get_current_user)):
+    """Create one order per cart item and a single payment session for the combined total"""
+    pricing = await pricing_cache.get()
+    quote = pricing.quote(checkout_data.items)
+    
+    checkout_id = new_id(CHECKOUT_ID_PREFIX.rstrip("-"))
+    orders = [
+        Order(
+            user_id=current_user.user_id,
+            product_id=line.product_id,
+            product_name=pricing.products[line.product_id]["name_ar"],
+            product_name_ar=pricing.products[line.product_id]["name_ar"],
+            product_name_en=pricing.products[line.product_id]["name_en"],
+            plan_duration=line.plan_duration,
+            **line.order_fields(quote.tax_percentage),
+            customer_name=checkout_data.customer_name,
+            customer_email=checkout_data.customer_email,
+            customer_phone=checkout_data.customer_phone,
+            checkout_id=checkout_id
+        )
+        for line in quote.lines
+    ]
+    await insert_many_atomic(db.orders, [order.model_dump() for order in orders])
+    await count_customer_orders(current_user.user_id, len(orders), orders[0].created_at)
+    for order in orders:
+        admin_events.emit("order_created", order.model_dump())
+        order_events.record(
+            order.order_id, "order_created",
+            amount=order.amount, currency=order.currency, user_id=order.user_id, checkout_id=checkout_id
+        )
+    
+    payment_session = await open_payment_session(
+        checkout_id, [order.model_dump() for order in orders], request.headers.get("Idempotency-Key")
+    )
+    
+    return {
+        "checkout_id": checkout_id,
+        "orders": orders,
+        "amount": payment_session["amount"],
+        "currency": payment_session["currency"],
+        "payment": payment_session
+    }
+
 @api_router.get("/orders", response_model=List[Order])
-async def get_user_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.user_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return orders
+async def get_user_orders(
+    current_user: User = Depends(get_current_user),
+    projection: ListProjection = Depends(list_projection(Order))
+):
+    orders = await db.orders.find({"user_id": current_user.user_id}, projection.mongo).sort("created_at", -1).to_list(100)
+    if len(orders) < 100:
+        user = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0, "archived_order_months": 1})
+        months = (user or {}).get("archived_order_months")
+        if months:
+            orders += await order_archive.store.find(
+                "orders", sorted(months, reverse=True), {"user_id": current_user.user_id},
+                lambda d: d.get("user_id") == current_user.user_id, 100 - len(orders)
+            )
+    return projection.response(orders)
 
 @api_router.get("/admin/orders", response_model=List[Order])
-async def get_all_orders(admin: User = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return orders
+async def get_all_orders(
+    admin: User = Depends(get_admin_user),
+    projection: ListProjection = Depends(list_projection(Order))
+):
+    orders = await db.orders.find({}, projection.mongo).sort("created_at", -1).to_list(1000)
+    return projection.response(orders)
 
 @api_router.put("/admin/orders/{order_id}/status")
 async def update_order_status(order_id: str, status: OrderStatus, admin: User = Depends(get_admin_user)):
-    result = await db.orders.update_one(
-        {"order_id": order_id},
-        {"$set": {"status": status.value, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    changes = {"status": status.value, "updated_at": datetime.now(timezone.utc).isoformat()}
+    previous = await db.orders.find_one_and_update(
+        id_query("order_id", order_id), {"$set": changes}, projection={"_id": 0, "order_id": 1, "status": 1}
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    admin_events.emit("order_updated", {"order_id": previous["order_id"], **changes})
+    order_events.record(
+        previous["order_id"], "status_changed",
+        from_status=previous["status"], to_status=status.value, admin_id=admin.user_id
+    )
     return {"message": "Order status updated"}
 
+@api_router.get("/admin/orders/{order_id}/timeline")
+async def get_order_timeline(order_id: str, admin: User = Depends(get_admin_user)):
+    """Every recorded transition of an order, including events of its checkout and payments"""
+    order = await db.orders.find_one(id_query("order_id", order_id), {"_id": 0, "order_id": 1, "checkout_id": 1})
+    if not order:
+        order = await order_archive.find_order(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    references = [order["order_id"]] + ([order["checkout_id"]] if order.get("checkout_id") else [])
+    return {"order_id": order["order_id"], "events": await order_events.timeline(references)}
+
 # ============== PAYMENTS ROUTES ==============
 @api_router.post("/payments/create-session")
-async def create_payment_session(order_id: str, current_user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"order_id": order_id, "user_id": current_user.user_id}, {"_id": 0})
-    if not order:
+async def create_payment_session(order_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    orders = await db.orders.find(
+        {**order_reference_query(order_id), "user_id": current_user.user_id}, {"_id": 0}
+    ).to_list(MAX_CART_ITEMS)
+    if not orders:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if order["payment_status"] == PaymentStatus.PAID.value:
+    unpaid_orders = [o for o in orders if o["payment_status"] != PaymentStatus.PAID.value]
+    if not unpaid_orders:
         raise HTTPException(status_code=400, detail="Order already paid")
     
-    # Create payment record
-    payment = Payment(
-        order_id=order_id,
-        amount=order["amount"],
-        currency=order["currency"]
-    )
-    await db.payments.insert_one(payment.model_dump())
-    
-    # For demo/sandbox, we'll create a mock payment session
-    # In production, this would call Kashier API
-    if not KASHIER_MERCHANT_ID or not KASHIER_API_KEY:
-        # Return mock session for development
-        return {
-            "payment_id": payment.payment_id,
-            "order_id": order_id,
-            "amount": order["amount"],
-            "currency": order["currency"],
-            "mock_mode": True,
-            "message": "Payment gateway not configured. Use mock payment."
-        }
-    
-    # Prepare Kashier payment request
-    payment_data = {
-        "merchant_id": KASHIER_MERCHANT_ID,
-        "merchant_order_id": order_id,
-        "amount": int(order["amount"] * 100),  # Convert to smallest unit
-        "currency": order["currency"],
-        "customer_email": order["customer_email"],
-        "description": f"Payment for {order['product_name']}"
-    }
-    
-    # Generate signature
-    data_str = json.dumps(payment_data, separators=(',', ':'), sort_keys=True)
-    signature = hmac.new(KASHIER_API_KEY.encode(), data_str.encode(), hashlib.sha256).hexdigest().upper()
+    # An order is paid either on its own or through its checkout, never both at once
+    if order_id.startswith(CHECKOUT_ID_PREFIX):
+        other_references = [o["order_id"] for o in unpaid_orders]
+    else:
+        other_references = [o["checkout_id"] for o in unpaid_orders if o.get("checkout_id")]
+    if other_references and await db.payments.find_one({
+        "order_id": {"$in": other_references},
+        "status": PaymentStatus.PENDING.value,
+        "$or": [{"session_expires_at": None}, {"session_expires_at": {"$gt": datetime.now(timezone.utc)}}]
+    }, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Order has a payment in progress, complete or wait for it to expire")
     
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{KASHIER_API_URL}/api/v1/payment/session",
-            json=payment_data,
-            headers={"Content-Type": "application/json", "X-Signature": signature}
-        ) as resp:
-            result = await resp.json()
-            if resp.status == 200 and result.get("status"):
-                return {
-                    "payment_id": payment.payment_id,
-                    "session_id": result.get("id"),
-                    "payment_url": result.get("redirect_url"),
-                    "order_id": order_id
-                }
-            else:
-                raise HTTPException(status_code=400, detail=result.get("message", "Payment session failed"))
+    return await open_payment_session(order_id, unpaid_orders, request.headers.get("Idempotency-Key"))
 
 @api_router.post("/payments/mock-complete/{payment_id}")
 async def mock_complete_payment(payment_id: str, current_user: User = Depends(get_current_user)):
     """Mock payment completion for development/testing"""
-    payment = await db.payments.find_one({"payment_id": payment_id}, {"_id": 0})
+    payment = await db.payments.find_one(id_query("payment_id", payment_id), {"_id": 0})
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
+    payment_id = payment["payment_id"]
     
-    order = await db.orders.find_one({"order_id": payment["order_id"]}, {"_id": 0})
-    if not order or order["user_id"] != current_user.user_id:
+    orders = await db.orders.find(order_reference_query(payment["order_id"]), {"_id": 0}).to_list(MAX_CART_ITEMS)
+    if not orders or any(o["user_id"] != current_user.user_id for o in orders):
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Update payment
-    await db.payments.update_one(
-        {"payment_id": payment_id},
-        {"$set": {
-            "status": PaymentStatus.PAID.value,
-            "kashier_transaction_id": f"MOCK-{uuid.uuid4().hex[:8].upper()}",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    # Update order
-    await db.orders.update_one(
-        {"order_id": payment["order_id"]},
-        {"$set": {
-            "payment_status": PaymentStatus.PAID.value,
-            "status": OrderStatus.COMPLETED.value,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    # Create invoice
-    invoice_count = await db.invoices.count_documents({})
-    invoice_number = f"IG-{str(invoice_count + 1).zfill(4)}"
-    
-    invoice = Invoice(
-        invoice_number=invoice_number,
-        order_id=payment["order_id"],
-        payment_id=payment_id,
-        customer_name=order["customer_name"],
-        customer_email=order["customer_email"],
-        customer_phone=order.get("customer_phone"),
-        product_name=order["product_name"],
-        plan_duration=order["plan_duration"],
-        subtotal=order["amount"],
-        tax=0,
-        total=order["amount"],
-        currency=order["currency"]
-    )
-    await db.invoices.insert_one(invoice.model_dump())
+    settled = await settle_payments([
+        {"payment_id": payment_id, "paid": True, "transaction_id": f"MOCK-{uuid.uuid4().hex[:8].upper()}"}
+    ], source="mock")
+    if payment_id not in settled:
+        raise HTTPException(status_code=400, detail="Payment is no longer pending")
+    invoices = settled[payment_id]
+    if not invoices:
+        raise HTTPException(status_code=409, detail="Order was already settled by another payment, this one is flagged for refund")
     
-    return {"message": "Payment completed", "invoice_id": invoice.invoice_id, "invoice_number": invoice_number}
+    return {
+        "message": "Payment completed",
+        "invoice_id": invoices[0].invoice_id,
+        "invoice_number": invoices[0].invoice_number,
+        "invoice_ids": [invoice.invoice_id for invoice in invoices]
+    }
 
 @api_router.post("/payments/webhook")
 async def payment_webhook(request: Request):
@@ -635,77 +2775,53 @@ async def payment_webhook(request: Request):
     transaction_id = payload.get("transaction_id")
     status = payload.get("status")
     
-    payment_status = PaymentStatus.PAID if status == "success" else PaymentStatus.FAILED
-    
-    # Update payment
-    await db.payments.update_one(
-        {"order_id": order_id},
-        {"$set": {
-            "status": payment_status.value,
-            "kashier_transaction_id": transaction_id,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    # Update order
-    order_status = OrderStatus.COMPLETED if status == "success" else OrderStatus.CANCELLED
-    await db.orders.update_one(
-        {"order_id": order_id},
-        {"$set": {
-            "payment_status": payment_status.value,
-            "status": order_status.value,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+    # merchant_order_id is a checkout_id for cart payments
+    payment = await db.payments.find_one(
+        {"order_id": order_id, "status": PaymentStatus.PENDING.value},
+        {"_id": 0, "payment_id": 1},
+        sort=[("created_at", -1)]
     )
-    
-    # Create invoice if paid
-    if payment_status == PaymentStatus.PAID:
-        order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
-        payment = await db.payments.find_one({"order_id": order_id}, {"_id": 0})
-        
-        invoice_count = await db.invoices.count_documents({})
-        invoice_number = f"IG-{str(invoice_count + 1).zfill(4)}"
-        
-        invoice = Invoice(
-            invoice_number=invoice_number,
-            order_id=order_id,
-            payment_id=payment["payment_id"],
-            customer_name=order["customer_name"],
-            customer_email=order["customer_email"],
-            customer_phone=order.get("customer_phone"),
-            product_name=order["product_name"],
-            plan_duration=order["plan_duration"],
-            subtotal=order["amount"],
-            total=order["amount"],
-            currency=order["currency"]
-        )
-        await db.invoices.insert_one(invoice.model_dump())
+    # Redelivered webhooks find nothing pending and are acknowledged as-is
+    if payment:
+        await settle_payments([
+            {"payment_id": payment["payment_id"], "paid": status == "success", "transaction_id": transaction_id}
+        ], source="webhook")
     
     return {"status": "ok"}
 
-# ============== INVOICES ROUTES ==============
-@api_router.get("/invoices", response_model=List[Invoice])
-async def get_user_invoices(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.user_id}, {"_id": 0}).to_list(100)
-    order_ids = [o["order_id"] for o in orders]
-    invoices = await db.invoices.find({"order_id": {"$in": order_ids}}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return invoices
+# ============== INVOICE PDF HELPERS ==============
+class InvoicePdfCache:
+    """Byte-bounded LRU of rendered invoice PDFs. Issued invoices never change, so entries never go stale."""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        pdf = self._entries.get(key)
+        if pdf is not None:
+            self._entries.move_to_end(key)
+        return pdf
+    
+    def set(self, key: str, pdf: bytes):
+        if len(pdf) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = pdf
+        self.size += len(pdf)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
 
-@api_router.get("/admin/invoices", response_model=List[Invoice])
-async def get_all_invoices(admin: User = Depends(get_admin_user)):
-    invoices = await db.invoices.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return invoices
+invoice_pdf_cache = InvoicePdfCache(INVOICE_PDF_CACHE_MB * 1024 * 1024)
 
-@api_router.get("/invoices/{invoice_id}/pdf")
-async def get_invoice_pdf(invoice_id: str, current_user: User = Depends(get_current_user)):
-    invoice = await db.invoices.find_one({"invoice_id": invoice_id}, {"_id": 0})
-    if not invoice:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    # Check user access
-    order = await db.orders.find_one({"order_id": invoice["order_id"]}, {"_id": 0})
-    if order and order["user_id"] != current_user.user_id and current_user.role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Access denied")
+def render_invoice_pdf(invoice: dict, language: Optional[str] = None) -> bytes:
+    """Render an invoice document to PDF bytes (CPU bound, call from a worker thread)"""
+    # Invoices issued before both names were stored only carry product_name
+    product_name = (language and invoice.get(f"product_name_{language}")) or invoice['product_name']
     
     # Generate PDF
     buffer = io.BytesIO()
@@ -727,9 +2843,7 @@ async def get_invoice_pdf(invoice_id: str, current_user: User = Depends(get_curr
     info_style = ParagraphStyle('Info', parent=styles['Normal'], fontSize=11, leading=16)
     elements.append(Paragraph(f"<b>Invoice Number:</b> {invoice['invoice_number']}", info_style))
     
-    created_at = invoice.get('created_at')
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    created_at = parse_datetime(invoice.get('created_at'))
     date_str = created_at.strftime('%Y-%m-%d %H:%M') if created_at else 'N/A'
     elements.append(Paragraph(f"<b>Date:</b> {date_str}", info_style))
     elements.append(Paragraph(f"<b>Status:</b> {invoice['status'].upper()}", info_style))
@@ -746,9 +2860,9 @@ async def get_invoice_pdf(invoice_id: str, current_user: User = Depends(get_curr
     # Items table
     table_data = [
         ['Item', 'Duration', 'Amount'],
-        [invoice['product_name'], invoice['plan_duration'].capitalize(), f"{invoice['subtotal']} {invoice['currency']}"],
+        [product_name, invoice['plan_duration'].capitalize(), f"{invoice['subtotal']} {invoice['currency']}"],
         ['', 'Subtotal:', f"{invoice['subtotal']} {invoice['currency']}"],
-        ['', 'Tax:', f"{invoice['tax']} {invoice['currency']}"],
+        ['', f"Tax ({invoice['tax_percentage']:g}%):" if invoice.get('tax_percentage') else 'Tax:', f"{invoice['tax']} {invoice['currency']}"],
         ['', 'Total:', f"{invoice['total']} {invoice['currency']}"]
     ]
     
@@ -774,31 +2888,179 @@ async def get_invoice_pdf(invoice_id: str, current_user: User = Depends(get_curr
     elements.append(table)
     elements.append(Spacer(1, 40))
     
-    # Footer
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, alignment=1, textColor=colors.grey)
-    elements.append(Paragraph("Thank you for choosing Igate-host!", footer_style))
-    elements.append(Paragraph("Website: www.igate-host.com | Support: support@igate-host.com", footer_style))
+    # Footer
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, alignment=1, textColor=colors.grey)
+    elements.append(Paragraph("Thank you for choosing Igate-host!", footer_style))
+    elements.append(Paragraph("Website: www.igate-host.com | Support: support@igate-host.com", footer_style))
+    
+    doc.build(elements)
+    return buffer.getvalue()
+
+async def get_invoice_pdf_bytes(invoice: dict, language: Optional[str] = None) -> bytes:
+    cache_key = f"{invoice['invoice_id']}:{language or ''}"
+    pdf = invoice_pdf_cache.get(cache_key)
+    if pdf is None:
+        pdf = await run_in_threadpool(render_invoice_pdf, invoice, language)
+        invoice_pdf_cache.set(cache_key, pdf)
+    return pdf
+
+class _ZipChunkSink:
+    """Write-only file object for zipfile. It has no tell()/seek(), so zipfile
+    switches to streaming mode (data descriptors) and we can drain the bytes
+    written so far after every entry."""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _archive_entry(invoice: dict) -> zipfile.ZipInfo:
+    created_at = parse_datetime(invoice.get("created_at")) or datetime.now(timezone.utc)
+    return zipfile.ZipInfo(
+        f"invoice_{invoice['invoice_number']}_{invoice['invoice_id']}.pdf",
+        date_time=created_at.timetuple()[:6]
+    )
+
+async def stream_invoice_archive(query: dict, language: Optional[str] = None):
+    """Yield a ZIP archive of invoice PDFs entry by entry.
     
-    doc.build(elements)
-    buffer.seek(0)
+    At most INVOICE_ARCHIVE_CONCURRENCY PDFs are rendered (or read from the
+    cache) ahead of the writer, so memory stays flat regardless of how many
+    invoices match.
+    """
+    sink = _ZipChunkSink()
+    pending = deque()
+    cursor = reporting_db.invoices.find(query, {"_id": 0}).sort("created_at", 1).batch_size(INVOICE_ARCHIVE_BATCH_SIZE)
     
-    return StreamingResponse(
-        buffer,
+    try:
+        # PDFs are already compressed internally, deflating them again only burns CPU
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            async for invoice in cursor:
+                pending.append((invoice, asyncio.ensure_future(get_invoice_pdf_bytes(invoice, language))))
+                if len(pending) < INVOICE_ARCHIVE_CONCURRENCY:
+                    continue
+                done_invoice, task = pending.popleft()
+                archive.writestr(_archive_entry(done_invoice), await task)
+                yield sink.drain()
+            
+            while pending:
+                done_invoice, task = pending.popleft()
+                archive.writestr(_archive_entry(done_invoice), await task)
+                yield sink.drain()
+        
+        # Central directory
+        yield sink.drain()
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await cursor.close()
+
+# ============== INVOICES ROUTES ==============
+@api_router.get("/invoices", response_model=List[Invoice])
+async def get_user_invoices(
+    current_user: User = Depends(get_current_user),
+    projection: ListProjection = Depends(list_projection(Invoice))
+):
+    orders = await db.orders.find({"user_id": current_user.user_id}, {"_id": 0, "order_id": 1}).to_list(100)
+    order_ids = [o["order_id"] for o in orders]
+    invoices = await db.invoices.find(
+        {"$or": [{"user_id": current_user.user_id}, {"order_id": {"$in": order_ids}}]}, projection.mongo
+    ).sort("created_at", -1).to_list(100)
+    return projection.response(invoices)
+
+@api_router.get("/admin/invoices", response_model=List[Invoice])
+async def get_all_invoices(
+    admin: User = Depends(get_admin_user),
+    projection: ListProjection = Depends(list_projection(Invoice))
+):
+    invoices = await db.invoices.find({}, projection.mongo).sort("created_at", -1).to_list(1000)
+    return projection.response(invoices)
+
+@api_router.get("/invoices/{invoice_id}/pdf")
+async def get_invoice_pdf(
+    invoice_id: str,
+    request: Request,
+    lang: Optional[Language] = None,
+    current_user: User = Depends(get_current_user)
+):
+    invoice = await db.invoices.find_one(id_query("invoice_id", invoice_id), {"_id": 0})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    # Check user access
+    if current_user.role != UserRole.ADMIN and invoice.get("user_id") != current_user.user_id:
+        order = await db.orders.find_one({"order_id": invoice["order_id"]}, {"_id": 0, "user_id": 1})
+        if not order:
+            order = await order_archive.find_order(invoice["order_id"], parse_datetime(invoice.get("created_at")))
+        if not order or order["user_id"] != current_user.user_id:
+            raise HTTPException(status_code=403, detail="Access denied")
+    
+    pdf = await get_invoice_pdf_bytes(invoice, resolve_language(lang, request))
+    
+    return Response(
+        content=pdf,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=invoice_{invoice['invoice_number']}.pdf"}
     )
 
+@api_router.get("/admin/invoices/archive")
+async def download_invoice_archive(
+    request: Request,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    lang: Optional[Language] = None,
+    admin: User = Depends(get_admin_user)
+):
+    """Stream a ZIP of every invoice PDF issued in a date range"""
+    created_range = {}
+    try:
+        if from_date:
+            created_range["$gte"] = parse_datetime(from_date)
+        if to_date and len(to_date) == 10:
+            # A bare date includes that whole day
+            created_range["$lt"] = parse_datetime(to_date) + timedelta(days=1)
+        elif to_date:
+            created_range["$lte"] = parse_datetime(to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    
+    query = {"created_at": created_range} if created_range else {}
+    filename = f"invoices_{(from_date or 'all')[:10]}_{(to_date or 'now')[:10]}.zip"
+    
+    return StreamingResponse(
+        stream_invoice_archive(query, resolve_language(lang, request)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 # ============== CONTACT ROUTES ==============
 @api_router.post("/contact", response_model=ContactMessage)
-async def submit_contact(message_data: ContactMessageCreate):
+async def submit_contact(message_data: ContactMessageCreate, request: Request):
+    await check_rate_limit("contact", request, email=message_data.email)
+    
     message = ContactMessage(**message_data.model_dump())
     await db.contact_messages.insert_one(message.model_dump())
+    await email_outbox.enqueue([contact_email(message)])
+    admin_events.emit("contact_message", message.model_dump())
     return message
 
 @api_router.get("/admin/contact", response_model=List[ContactMessage])
-async def get_contact_messages(admin: User = Depends(get_admin_user)):
-    messages = await db.contact_messages.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return messages
+async def get_contact_messages(
+    admin: User = Depends(get_admin_user),
+    projection: ListProjection = Depends(list_projection(ContactMessage))
+):
+    messages = await db.contact_messages.find({}, projection.mongo).sort("created_at", -1).to_list(100)
+    return projection.response(messages)
 
 @api_router.put("/admin/contact/{message_id}/read")
 async def mark_message_read(message_id: str, admin: User = Depends(get_admin_user)):
@@ -810,21 +3072,119 @@ async def mark_message_read(message_id: str, admin: User = Depends(get_admin_use
 # ============== STATS ROUTES ==============
 @api_router.get("/admin/stats")
 async def get_admin_stats(admin: User = Depends(get_admin_user)):
-    total_orders = await db.orders.count_documents({})
-    paid_orders = await db.orders.count_documents({"payment_status": PaymentStatus.PAID.value})
-    pending_orders = await db.orders.count_documents({"payment_status": PaymentStatus.PENDING.value})
-    total_products = await db.products.count_documents({})
-    total_users = await db.users.count_documents({})
-    unread_messages = await db.contact_messages.count_documents({"is_read": False})
+    return await admin_stats_flight.do("stats", compute_admin_stats)
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(admin: User = Depends(get_admin_user)):
+    """In-process performance counters for this worker"""
+    return {
+        "single_flight": {name: group.stats() for name, group in single_flight_groups.items()},
+        "slow_queries": {"queued": slow_query_recorder.queue.qsize(), "dropped": slow_query_recorder.dropped},
+        "pricing": pricing_cache.stats(),
+        "email_outbox": email_outbox.stats(),
+        "order_events": {"buffered": len(order_events.buffer), "written": order_events.written, "dropped": order_events.dropped},
+        "admin_events": {
+            "subscribers": len(admin_events.subscribers),
+            "change_streams": admin_events.change_streams,
+            "published": admin_events.published
+        }
+    }
+
+@api_router.get("/admin/events")
+async def stream_admin_events(admin: User = Depends(get_admin_user)):
+    """Server-Sent Events feed of new orders, order and payment status changes and contact messages"""
+    queue = admin_events.subscribe()
+    
+    async def event_stream():
+        try:
+            yield f"retry: {ADMIN_EVENTS_HEARTBEAT_SECONDS * 1000}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), ADMIN_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                data = json.dumps(event["data"], default=_json_default, ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+        finally:
+            admin_events.unsubscribe(queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(hours: int = 24, limit: int = 50, admin: User = Depends(get_admin_user)):
+    """Slow queries grouped by normalized shape, worst total time first"""
+    if SLOW_QUERY_LOG_FILE:
+        raise HTTPException(status_code=400, detail=f"Slow queries are logged to {SLOW_QUERY_LOG_FILE}")
+    
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    pipeline = [
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$group": {
+            "_id": "$shape_id",
+            "op": {"$first": "$op"},
+            "collection": {"$first": "$collection"},
+            "shape": {"$first": "$shape"},
+            "handlers": {"$addToSet": "$handler"},
+            "count": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "last_seen": {"$max": "$created_at"},
+            # Latest sampled explain: $max compares the embedded docs by "at" first
+            "latest_explain": {"$max": {"$cond": [
+                {"$ifNull": ["$explain", False]},
+                {"at": "$created_at", "explain": "$explain"},
+                None
+            ]}}
+        }},
+        {"$sort": {"total_ms": -1}},
+        {"$limit": limit}
+    ]
+    groups = await reporting_db.slow_queries.aggregate(pipeline).to_list(limit)
+    
+    return [
+        {
+            "shape_id": g["_id"],
+            "op": g["op"],
+            "collection": g["collection"],
+            "shape": json.loads(g["shape"]),
+            "handlers": g["handlers"],
+            "count": g["count"],
+            "avg_ms": round(g["total_ms"] / g["count"], 3),
+            "max_ms": g["max_ms"],
+            "total_ms": round(g["total_ms"], 3),
+            "last_seen": g["last_seen"],
+            "explain": g["latest_explain"]["explain"] if g.get("latest_explain") else None
+        }
+        for g in groups
+    ]
+
+async def compute_admin_stats() -> dict:
+    total_orders = await reporting_db.orders.count_documents({})
+    paid_orders = await reporting_db.orders.count_documents({"payment_status": PaymentStatus.PAID.value})
+    pending_orders = await reporting_db.orders.count_documents({"payment_status": PaymentStatus.PENDING.value})
+    total_products = await reporting_db.products.count_documents({})
+    total_users = await reporting_db.users.count_documents({})
+    unread_messages = await reporting_db.contact_messages.count_documents({"is_read": False})
     
     # Calculate revenue
     pipeline = [
         {"$match": {"payment_status": PaymentStatus.PAID.value}},
         {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
     ]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
+    revenue_result = await reporting_db.orders.aggregate(pipeline).to_list(1)
     total_revenue = revenue_result[0]["total"] if revenue_result else 0
     
+    # Finished orders moved to the archive are kept as rolled-up totals
+    archived = await order_archive.totals()
+    total_orders += archived["orders"]
+    paid_orders += archived["paid_orders"]
+    total_revenue += archived["revenue"]
+    
     return {
         "total_orders": total_orders,
         "paid_orders": paid_orders,
@@ -835,69 +3195,1138 @@ async def get_admin_stats(admin: User = Depends(get_admin_user)):
         "total_revenue": total_revenue
     }
 
+# ============== CUSTOMERS ==============
+CUSTOMER_SORT_FIELDS = ("paid_total", "order_count", "last_order_at")
+CUSTOMER_FIELDS = ("user_id", "name", "email", "created_at", "order_count", "paid_order_count", "paid_total", "last_order_at")
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=_json_default).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+async def ensure_customer_indexes():
+    await db.users.create_index("user_id", unique=True)
+    await db.users.create_index("email")
+    for field in CUSTOMER_SORT_FIELDS:
+        await db.users.create_index([("role", 1), (field, -1), ("user_id", -1)])
+
+async def rebuild_customer_stats() -> dict:
+    """Recompute every customer's counters from live and archived orders.
+    
+    Counters are zeroed and then merged from one aggregation, so orders
+    placed while this runs may be counted twice or missed. Run it in a quiet
+    period. Orders archived to files are not included.
+    """
+    projection = {"$project": {"_id": 0, "user_id": 1, "payment_status": 1, "amount": 1, "created_at": 1}}
+    archived = await order_archive.union_stages(None, None, [projection])
+    paid = {"$eq": ["$payment_status", PaymentStatus.PAID.value]}
+    started = time.perf_counter()
+    
+    await db.users.update_many({}, {"$set": {"order_count": 0, "paid_order_count": 0, "paid_total": 0, "last_order_at": None}})
+    await db.orders.aggregate([
+        projection,
+        *archived,
+        {"$group": {
+            "_id": "$user_id",
+            "order_count": {"$sum": 1},
+            "paid_order_count": {"$sum": {"$cond": [paid, 1, 0]}},
+            "paid_total": {"$sum": {"$cond": [paid, "$amount", 0]}},
+            "last_order_at": {"$max": "$created_at"}
+        }},
+        {"$set": {"user_id": "$_id"}},
+        {"$unset": "_id"},
+        {"$merge": {"into": "users", "on": "user_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ], allowDiskUse=True).to_list(None)
+    
+    customers = await db.users.count_documents({"order_count": {"$gt": 0}})
+    return {"customers_with_orders": customers, "archived_months": len(archived), "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+@api_router.post("/admin/maintenance/rebuild-customer-stats")
+async def run_customer_stats_rebuild(admin: User = Depends(get_admin_user)):
+    """Recompute order_count, paid_order_count, paid_total and last_order_at for every customer"""
+    return await rebuild_customer_stats()
+
+@api_router.get("/admin/customers")
+async def get_customers(
+    sort: str = "paid_total",
+    min_orders: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    admin: User = Depends(get_admin_user)
+):
+    """Customers ranked by spend, order count or recency, paginated with an opaque cursor"""
+    if sort not in CUSTOMER_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(CUSTOMER_SORT_FIELDS)}")
+    
+    query = {"role": UserRole.CUSTOMER.value}
+    if min_orders:
+        query["order_count"] = {"$gte": min_orders}
+    if cursor:
+        value, user_id = decode_cursor(cursor)
+        if sort == "last_order_at" and value:
+            value = parse_datetime(value)
+        # Keyset pagination on (sort field, user_id), both descending
+        query["$or"] = [{sort: {"$lt": value}}, {sort: value, "user_id": {"$lt": user_id}}]
+    
+    customers = await db.users.find(
+        query, {"_id": 0, **dict.fromkeys(CUSTOMER_FIELDS, 1)}
+    ).sort([(sort, -1), ("user_id", -1)]).limit(limit).to_list(limit)
+    
+    next_cursor = None
+    if len(customers) == limit:
+        last = customers[-1]
+        next_cursor = encode_cursor([last.get(sort), last["user_id"]])
+    return {"customers": customers, "next_cursor": next_cursor}
+
 # ============== SALES REPORT ROUTES ==============
+SALES_FRAGMENT_FIELDS = ("orders_count", "paid_orders", "pending_orders", "total_sales", "invoices_count")
+PRODUCT_MIX_FIELDS = ("paid_orders", "revenue", "monthly_orders", "yearly_orders")
+
+def day_bounds(day: date, tz: ZoneInfo) -> tuple:
+    """UTC start and end of a calendar day in `tz`"""
+    start = datetime.combine(day, datetime.min.time(), tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+def day_runs(days: List[date]) -> List[tuple]:
+    """Group sorted days into (first, last) runs of consecutive days"""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+class SalesReportCache:
+    """Per-day sales report fragments, keyed by date and timezone.
+    
+    Each fragment holds the day's order totals and, under `products`, the
+    paid orders per product. A fragment is stored once its day has ended
+    and reused from then on.
+    Only the open day and days whose fragment was dropped are aggregated
+    again. settle_payments drops the fragment of each day containing an
+    order whose payment status changed, for example after a late webhook.
+    """
+    
+    def __init__(self, collection):
+        self.collection = collection
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index([("start", 1), ("end", 1)])
+    
+    async def invalidate(self, created_at_values: list):
+        moments = {parse_datetime(value) for value in created_at_values if value}
+        if moments:
+            await self.collection.delete_many({"$or": [{"start": {"$lte": t}, "end": {"$gt": t}} for t in moments]})
+    
+    async def aggregate(self, database, tz: ZoneInfo, first: date, last: date) -> dict:
+        start, end = day_bounds(first, tz)[0], day_bounds(last, tz)[1]
+        day = {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": tz.key}}
+        paid = {"$eq": ["$payment_status", PaymentStatus.PAID.value]}
+        totals_stages = [
+            {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+            {"$project": {"_id": 0, "created_at": 1, "payment_status": 1, "amount": 1}}
+        ]
+        products_stages = [
+            {"$match": {"created_at": {"$gte": start, "$lt": end}, "payment_status": PaymentStatus.PAID.value}},
+            {"$project": {"_id": 0, "created_at": 1, "product_id": 1, "plan_duration": 1, "amount": 1}}
+        ]
+        orders, invoices, products = await asyncio.gather(
+            database.orders.aggregate([
+                *totals_stages,
+                *await order_archive.union_stages(start, end, totals_stages),
+                {"$group": {
+                    "_id": day,
+                    "orders_count": {"$sum": 1},
+                    "paid_orders": {"$sum": {"$cond": [paid, 1, 0]}},
+                    "pending_orders": {"$sum": {"$cond": [{"$eq": ["$payment_status", PaymentStatus.PENDING.value]}, 1, 0]}},
+                    "total_sales": {"$sum": {"$cond": [paid, "$amount", 0]}}
+                }}
+            ]).to_list(None),
+            database.invoices.aggregate([
+                {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+                {"$group": {"_id": day, "invoices_count": {"$sum": 1}}}
+            ]).to_list(None),
+            database.orders.aggregate([
+                *products_stages,
+                *await order_archive.union_stages(start, end, products_stages),
+                {"$group": {
+                    "_id": {"date": day, "product_id": "$product_id"},
+                    "paid_orders": {"$sum": 1},
+                    "revenue": {"$sum": "$amount"},
+                    "monthly_orders": {"$sum": {"$cond": [{"$eq": ["$plan_duration", "monthly"]}, 1, 0]}},
+                    "yearly_orders": {"$sum": {"$cond": [{"$eq": ["$plan_duration", "yearly"]}, 1, 0]}}
+                }}
+            ]).to_list(None)
+        )
+        totals = {}
+        for row in orders + invoices:
+            totals.setdefault(row.pop("_id"), {}).update(row)
+        for row in products:
+            key = row.pop("_id")
+            totals.setdefault(key["date"], {}).setdefault("products", []).append({"product_id": key["product_id"], **row})
+        return totals
+    
+    async def fragments(self, tz: ZoneInfo, days: List[date]) -> List[dict]:
+        cached = {
+            doc["date"]: doc for doc in await self.collection.find(
+                {"_id": {"$in": [f"{tz.key}:{d.isoformat()}" for d in days]}}, {"_id": 0}
+            ).to_list(None)
+        }
+        # Fragments stored before the product breakdown was added are rebuilt
+        missing = [d for d in days if "products" not in cached.get(d.isoformat(), {})]
+        if missing:
+            now = datetime.now(timezone.utc)
+            # Days that are stored for good are read from the primary: a
+            # secondary may not have the write that just invalidated them yet
+            closed_days = [d for d in missing if day_bounds(d, tz)[1] <= now]
+            open_days = [d for d in missing if d not in closed_days]
+            computed = {}
+            for totals in await asyncio.gather(
+                *(self.aggregate(db, tz, first, last) for first, last in day_runs(closed_days)),
+                *(self.aggregate(reporting_db, tz, first, last) for first, last in day_runs(open_days))
+            ):
+                computed.update(totals)
+            closed = []
+            for day in missing:
+                start, end = day_bounds(day, tz)
+                fragment = {field: 0 for field in SALES_FRAGMENT_FIELDS}
+                fragment["products"] = []
+                fragment.update(computed.get(day.isoformat(), {}))
+                fragment.update({"date": day.isoformat(), "timezone": tz.key, "start": start, "end": end})
+                cached[day.isoformat()] = fragment
+                if end <= now:
+                    closed.append(ReplaceOne({"_id": f"{tz.key}:{day.isoformat()}"}, fragment, upsert=True))
+            if closed:
+                await self.collection.bulk_write(closed, ordered=False)
+        return [cached[d.isoformat()] for d in days]
+
+sales_report_cache = SalesReportCache(db.sales_report_days)
+
+def report_days(from_date: str, to_date: str, tz: str) -> tuple:
+    """Timezone and calendar days (in `tz`) covered by a report date range"""
+    try:
+        from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
+        to_dt = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
+        zone = ZoneInfo(tz)
+    except (ValueError, ZoneInfoNotFoundError):
+        raise HTTPException(status_code=400, detail="Invalid date format or timezone")
+    
+    first_day = (from_dt if from_dt.tzinfo else from_dt.replace(tzinfo=timezone.utc)).astimezone(zone).date()
+    last_day = (to_dt if to_dt.tzinfo else to_dt.replace(tzinfo=timezone.utc)).astimezone(zone).date()
+    day_count = (last_day - first_day).days + 1
+    if day_count < 1 or day_count > REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    return zone, [first_day + timedelta(days=i) for i in range(day_count)]
+
+def product_mix(rows: list) -> dict:
+    totals = {field: sum(row[field] for row in rows) for field in PRODUCT_MIX_FIELDS}
+    totals["revenue"] = round(totals["revenue"], 2)
+    totals["average_order_value"] = round(totals["revenue"] / totals["paid_orders"], 2) if totals["paid_orders"] else 0
+    totals["yearly_share"] = round(totals["yearly_orders"] / totals["paid_orders"], 4) if totals["paid_orders"] else 0
+    return totals
+
 @api_router.get("/admin/sales-report")
 async def get_sales_report(
     from_date: str,
     to_date: str,
+    tz: str = REPORT_TIMEZONE,
     admin: User = Depends(get_admin_user)
 ):
-    """Get detailed sales report for a date range"""
-    try:
-        from_dt = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-        to_dt = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
-    except:
-        raise HTTPException(status_code=400, detail="Invalid date format")
-    
-    # Query orders in date range
-    query = {
-        "created_at": {
-            "$gte": from_dt.isoformat(),
-            "$lte": to_dt.isoformat()
-        }
-    }
-    
-    orders = await db.orders.find(query, {"_id": 0}).to_list(1000)
-    
-    # Calculate stats
-    total_sales = sum(o["amount"] for o in orders if o.get("payment_status") == PaymentStatus.PAID.value)
-    orders_count = len(orders)
-    paid_orders = len([o for o in orders if o.get("payment_status") == PaymentStatus.PAID.value])
-    pending_orders = len([o for o in orders if o.get("payment_status") == PaymentStatus.PENDING.value])
-    average_order_value = total_sales / paid_orders if paid_orders > 0 else 0
+    """Get detailed sales report for the calendar days (in `tz`) of a date range"""
+    zone, days = report_days(from_date, to_date, tz)
+    fragments = await sales_report_cache.fragments(zone, days)
     
-    # Get invoices count
-    invoices_count = await db.invoices.count_documents({
-        "created_at": {"$gte": from_dt.isoformat(), "$lte": to_dt.isoformat()}
-    })
-    
-    # Daily breakdown
-    daily_data = {}
-    for order in orders:
-        if order.get("payment_status") == PaymentStatus.PAID.value:
-            order_date = order["created_at"][:10]  # Get YYYY-MM-DD
-            if order_date not in daily_data:
-                daily_data[order_date] = {"orders": 0, "amount": 0}
-            daily_data[order_date]["orders"] += 1
-            daily_data[order_date]["amount"] += order["amount"]
+    totals = {field: sum(f[field] for f in fragments) for field in SALES_FRAGMENT_FIELDS}
+    average_order_value = totals["total_sales"] / totals["paid_orders"] if totals["paid_orders"] > 0 else 0
     
     daily_breakdown = [
-        {"date": date, "orders": data["orders"], "amount": data["amount"]}
-        for date, data in sorted(daily_data.items(), reverse=True)
+        {"date": f["date"], "orders": f["paid_orders"], "amount": f["total_sales"]}
+        for f in reversed(fragments) if f["paid_orders"]
     ]
     
     return {
-        "total_sales": total_sales,
-        "orders_count": orders_count,
-        "paid_orders": paid_orders,
-        "pending_orders": pending_orders,
+        **totals,
         "average_order_value": round(average_order_value, 2),
-        "invoices_count": invoices_count,
         "daily_breakdown": daily_breakdown,
+        "timezone": zone.key,
+        "from_date": from_date,
+        "to_date": to_date
+    }
+
+@api_router.get("/admin/reports/products")
+async def get_product_report(
+    from_date: str,
+    to_date: str,
+    tz: str = REPORT_TIMEZONE,
+    admin: User = Depends(get_admin_user)
+):
+    """Paid revenue, order count, average order value and plan mix per product and category"""
+    zone, days = report_days(from_date, to_date, tz)
+    fragments = await sales_report_cache.fragments(zone, days)
+    
+    rows_by_product = {}
+    for fragment in fragments:
+        for row in fragment["products"]:
+            rows_by_product.setdefault(row["product_id"], []).append(row)
+    catalog = {
+        p["product_id"]: p for p in await db.products.find(
+            {"product_id": {"$in": list(rows_by_product)}},
+            {"_id": 0, "product_id": 1, "name_ar": 1, "name_en": 1, "category": 1}
+        ).to_list(None)
+    }
+    
+    products = []
+    rows_by_category = {}
+    for product_id, rows in rows_by_product.items():
+        product = catalog.get(product_id, {})
+        category = product.get("category")
+        products.append({
+            "product_id": product_id,
+            "name_ar": product.get("name_ar"),
+            "name_en": product.get("name_en"),
+            "category": category,
+            **product_mix(rows)
+        })
+        rows_by_category.setdefault(category, []).extend(rows)
+    
+    categories = [{"category": category, **product_mix(rows)} for category, rows in rows_by_category.items()]
+    products.sort(key=lambda p: p["revenue"], reverse=True)
+    categories.sort(key=lambda c: c["revenue"], reverse=True)
+    
+    return {
+        "products": products,
+        "categories": categories,
+        "totals": product_mix([row for rows in rows_by_product.values() for row in rows]),
+        "timezone": zone.key,
         "from_date": from_date,
         "to_date": to_date
     }
 
+# ============== SUBSCRIPTION ANALYTICS ==============
+EPOCH_YEAR = 1970
+MRR_MOVEMENTS = ("new", "expansion", "reactivation", "contraction", "churn")
+MONTH_KEY_SPAN = 1 << 16  # (user, month) packed as user * MONTH_KEY_SPAN + month
+ANALYTICS_ORDER_FIELDS = ["user_id", "plan_duration", "amount", "created_at"]
+
+def month_index(dt: datetime) -> int:
+    return (dt.year - EPOCH_YEAR) * 12 + dt.month - 1
+
+def month_label(index: int) -> str:
+    return f"{EPOCH_YEAR + index // 12}-{index % 12 + 1:02d}"
+
+def month_start(index: int) -> datetime:
+    return datetime(EPOCH_YEAR + index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def parse_month(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return month_index(datetime.strptime(value, "%Y-%m"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month, expected YYYY-MM")
+
+def active_subscriptions(orders: pd.DataFrame) -> pd.DataFrame:
+    """Expand paid orders into one row per (user, month) they cover, with the
+    recurring revenue the user brings that month, sorted by user then month.
+    A yearly plan counts for a twelfth of its price in each of its 12 months."""
+    created_at = orders["created_at"]
+    start = ((created_at.dt.year - EPOCH_YEAR) * 12 + created_at.dt.month - 1).to_numpy(dtype=np.int64)
+    duration = np.where(orders["plan_duration"].to_numpy() == "yearly", 12, 1)
+    mrr = orders["amount"].to_numpy(dtype=float) / duration
+    rows = np.repeat(np.arange(len(orders)), duration)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(duration) - duration, duration)
+    keys = orders["user"].to_numpy(dtype=np.int64)[rows] * MONTH_KEY_SPAN + start[rows] + offsets
+    order = np.argsort(keys)
+    keys, mrr = keys[order], mrr[rows][order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    keys = keys[starts]
+    return pd.DataFrame({"user": keys // MONTH_KEY_SPAN, "month": keys % MONTH_KEY_SPAN, "mrr": np.add.reduceat(mrr, starts)})
+
+def first_active_months(active: pd.DataFrame) -> np.ndarray:
+    """First month of each user code in an active_subscriptions frame"""
+    users = active["user"].to_numpy()
+    return active["month"].to_numpy()[np.flatnonzero(np.r_[True, users[1:] != users[:-1]])]
+
+def monthly_records(active: pd.DataFrame, first_month: np.ndarray, months: range) -> List[dict]:
+    """MRR, MRR movements and active customers per cohort for each month.
+    
+    `first_month[user]` is the month of the user's first paid order, which
+    tells new customers from reactivated ones and names their cohort.
+    """
+    users = active["user"].to_numpy()
+    month = active["month"].to_numpy()
+    mrr = active["mrr"].to_numpy()
+    keys = users * MONTH_KEY_SPAN + month
+    last = max(len(keys) - 1, 0)
+    
+    # The same user's MRR one month earlier, and a zero-MRR row for the month after a plan lapsed
+    before = np.minimum(np.searchsorted(keys, keys - 1), last)
+    previous = np.where(keys[before] == keys - 1, mrr[before], 0.0)
+    after = np.minimum(np.searchsorted(keys, keys + 1), last)
+    lapsed = keys[after] != keys + 1
+    users = np.concatenate([users, users[lapsed]])
+    month = np.concatenate([month, month[lapsed] + 1])
+    previous = np.concatenate([previous, mrr[lapsed]])
+    mrr = np.concatenate([mrr, np.zeros(np.count_nonzero(lapsed))])
+    
+    in_range = (month >= months.start) & (month < months.stop)
+    users, month, mrr, previous = users[in_range], month[in_range], mrr[in_range], previous[in_range]
+    change = mrr - previous
+    first = first_month[users]
+    new, expansion, reactivation, contraction, churn = range(len(MRR_MOVEMENTS))
+    retained = len(MRR_MOVEMENTS)
+    movement = np.select(
+        [(previous == 0) & (month == first), previous == 0, mrr == 0, change > 0, change < 0],
+        [new, reactivation, churn, expansion, contraction],
+        retained
+    )
+    
+    n = len(months)
+    offset = month - months.start
+    movement_totals = np.bincount(offset * (retained + 1) + movement, weights=np.abs(change), minlength=n * (retained + 1)).reshape(n, -1)
+    churned = np.bincount(offset[movement == churn], minlength=n)
+    paying = mrr > 0
+    mrr_totals = np.bincount(offset[paying], weights=mrr[paying], minlength=n)
+    customers = np.bincount(offset[paying], minlength=n)
+    first_cohort = int(first[paying].min()) if paying.any() else 0
+    cohort_span = int(first[paying].max()) - first_cohort + 1 if paying.any() else 1
+    cohorts = np.bincount(
+        offset[paying] * cohort_span + first[paying] - first_cohort, minlength=n * cohort_span
+    ).reshape(n, cohort_span)
+    
+    records = []
+    for i, month_number in enumerate(months):
+        record = {"month": month_label(month_number), "mrr": round(float(mrr_totals[i]), 2), "customers": int(customers[i])}
+        for j, name in enumerate(MRR_MOVEMENTS):
+            record[name] = round(float(movement_totals[i, j]), 2)
+        record["net_new"] = round(
+            record["new"] + record["expansion"] + record["reactivation"] - record["contraction"] - record["churn"], 2
+        )
+        record["churned_customers"] = int(churned[i])
+        record["cohorts"] = {month_label(first_cohort + c): int(cohorts[i, c]) for c in np.flatnonzero(cohorts[i])}
+        records.append(record)
+    return records
+
+class SubscriptionAnalytics:
+    """Monthly MRR, MRR movements and cohort retention from paid orders.
+    
+    Paid orders are streamed in columnar batches of ANALYTICS_BATCH_SIZE
+    into pandas and processed with vectorized operations. Closed months never
+    change, so their records are kept in the `analytics_months` collection.
+    Later calls only stream the last 12 months of orders, enough to rebuild
+    every subscription still running, and compute the months since the last
+    closed one. refresh=True recomputes the full history, e.g. after a
+    refund is booked into a closed month.
+    
+    Archived orders are read through $unionWith like the sales report;
+    orders archived to files are not included.
+    """
+    
+    META_ID = "meta"
+    
+    def __init__(self, collection, batch_size: int = ANALYTICS_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+    
+    async def load_orders(self, since: Optional[datetime] = None) -> pd.DataFrame:
+        query = {"payment_status": PaymentStatus.PAID.value}
+        if since:
+            query["created_at"] = {"$gte": since}
+        stages = [{"$match": query}, {"$project": {"_id": 0, **dict.fromkeys(ANALYTICS_ORDER_FIELDS, 1)}}]
+        cursor = reporting_db.orders.aggregate(
+            [*stages, *await order_archive.union_stages(since, None, stages)], allowDiskUse=True, batchSize=self.batch_size
+        )
+        batches, batch = [], []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                batches.append(pd.DataFrame.from_records(batch, columns=ANALYTICS_ORDER_FIELDS))
+                batch = []
+        batches.append(pd.DataFrame.from_records(batch, columns=ANALYTICS_ORDER_FIELDS))
+        orders = pd.concat(batches, ignore_index=True)
+        orders["created_at"] = pd.to_datetime(orders["created_at"], utc=True)
+        return orders
+    
+    async def first_paid_months(self, user_ids: List[str], before: datetime) -> dict:
+        """Month of each user's first paid order placed before `before`"""
+        first = {}
+        for i in range(0, len(user_ids), ANALYTICS_USER_LOOKUP_CHUNK):
+            stages = [
+                {"$match": {
+                    "user_id": {"$in": user_ids[i:i + ANALYTICS_USER_LOOKUP_CHUNK]},
+                    "created_at": {"$lt": before},
+                    "payment_status": PaymentStatus.PAID.value
+                }},
+                {"$project": {"_id": 0, "user_id": 1, "created_at": 1}}
+            ]
+            rows = await reporting_db.orders.aggregate([
+                *stages,
+                *await order_archive.union_stages(None, before, stages),
+                {"$group": {"_id": "$user_id", "first": {"$min": "$created_at"}}}
+            ]).to_list(None)
+            first.update({row["_id"]: month_index(row["first"]) for row in rows})
+        return first
+    
+    async def compute(self, since_month: Optional[int], months: range) -> List[dict]:
+        since = month_start(since_month) if since_month is not None else None
+        orders = await self.load_orders(since)
+        if orders.empty:
+            empty = pd.DataFrame({"user": np.array([], dtype=np.int64), "month": np.array([], dtype=np.int64), "mrr": np.array([])})
+            return monthly_records(empty, np.array([], dtype=np.int64), months)
+        codes, user_ids = pd.factorize(orders["user_id"])
+        orders["user"] = codes
+        active = await run_in_threadpool(active_subscriptions, orders)
+        first_month = first_active_months(active)
+        if since is not None:
+            # Customers may have paid before the window
+            candidates = active.loc[active["month"] >= months.start, "user"].unique()
+            earlier = pd.Series(await self.first_paid_months(list(user_ids[candidates]), since), dtype="int64")
+            first_month[user_ids.get_indexer(earlier.index)] = earlier.to_numpy()
+        return await run_in_threadpool(monthly_records, active, first_month, months)
+    
+    async def records(self, refresh: bool = False) -> List[dict]:
+        current = month_index(datetime.now(timezone.utc))
+        meta = None if refresh else await self.collection.find_one({"_id": self.META_ID})
+        
+        if meta is None:
+            stages = [{"$match": {"payment_status": PaymentStatus.PAID.value}}, {"$project": {"_id": 0, "created_at": 1}}]
+            first = await reporting_db.orders.aggregate([
+                *stages,
+                *await order_archive.union_stages(None, None, stages),
+                {"$group": {"_id": None, "created_at": {"$min": "$created_at"}}}
+            ]).to_list(1)
+            if not first:
+                return []
+            start = month_index(parse_datetime(first[0]["created_at"]))
+            fresh = await self.compute(None, range(start, current + 1))
+        else:
+            start = meta["first_month"]
+            # Subscriptions last at most 12 months: the window rebuilds every one running since the last closed month
+            fresh = await self.compute(meta["closed_through"] - 11, range(meta["closed_through"] + 1, current + 1))
+        
+        closed = [r for r in fresh if parse_month(r["month"]) < current]
+        if closed:
+            await self.collection.bulk_write([ReplaceOne({"_id": r["month"]}, r, upsert=True) for r in closed])
+            await self.collection.replace_one(
+                {"_id": self.META_ID}, {"first_month": start, "closed_through": current - 1}, upsert=True
+            )
+        cached = await self.collection.find(
+            {"_id": {"$ne": self.META_ID, "$lt": fresh[0]["month"]}}, {"_id": 0}
+        ).sort("month", 1).to_list(None)
+        return cached + fresh
+
+subscription_analytics = SubscriptionAnalytics(db.analytics_months)
+analytics_flight = SingleFlight("analytics")
+
+def _month_window(records: List[dict], from_month: Optional[str], to_month: Optional[str]) -> List[dict]:
+    start, end = parse_month(from_month), parse_month(to_month)
+    return [
+        r for r in records
+        if (start is None or parse_month(r["month"]) >= start) and (end is None or parse_month(r["month"]) <= end)
+    ]
+
+@api_router.get("/admin/analytics/mrr")
+async def get_mrr_analytics(
+    from_month: Optional[str] = Query(None, alias="from"),
+    to_month: Optional[str] = Query(None, alias="to"),
+    refresh: bool = False,
+    admin: User = Depends(get_admin_user)
+):
+    """Monthly recurring revenue with new, expansion, reactivation, contraction and churn movements"""
+    records = await analytics_flight.do(("records", refresh), lambda: subscription_analytics.records(refresh))
+    return {"months": [
+        {k: v for k, v in r.items() if k != "cohorts"} for r in _month_window(records, from_month, to_month)
+    ]}
+
+@api_router.get("/admin/analytics/cohorts")
+async def get_cohort_analytics(
+    from_month: Optional[str] = Query(None, alias="from"),
+    to_month: Optional[str] = Query(None, alias="to"),
+    months: int = Query(12, ge=1, le=120),
+    admin: User = Depends(get_admin_user)
+):
+    """Share of each monthly cohort (by first paid month) with an active plan N months later"""
+    records = await analytics_flight.do(("records", False), lambda: subscription_analytics.records())
+    cells = pd.DataFrame(
+        [(r["month"], cohort, n) for r in records for cohort, n in r["cohorts"].items()],
+        columns=["month", "cohort", "customers"]
+    )
+    if cells.empty:
+        return {"cohorts": []}
+    cells["age"] = cells["month"].map(parse_month) - cells["cohort"].map(parse_month)
+    table = cells.pivot_table(index="cohort", columns="age", values="customers", aggfunc="sum")
+    table = table.reindex(columns=range(months + 1))
+    # No row means nobody left, unless the month has not happened yet
+    elapsed = parse_month(records[-1]["month"]) - table.index.map(parse_month).to_numpy()
+    table = table.mask(np.isnan(table.to_numpy()) & (table.columns.to_numpy() <= elapsed[:, None]), 0)
+    sizes = table[0]
+    retention = table.div(sizes, axis=0).round(4)
+    
+    cohorts = []
+    for cohort in _month_window([{"month": c} for c in table.index], from_month, to_month):
+        row = retention.loc[cohort["month"]]
+        cohorts.append({
+            "cohort": cohort["month"],
+            "customers": int(sizes[cohort["month"]]),
+            # null for months that have not happened yet
+            "retention": [None if np.isnan(v) else float(v) for v in row.to_numpy()]
+        })
+    return {"cohorts": cohorts}
+
+# ============== ARCHIVAL ==============
+ARCHIVE_ID_FIELDS = {"orders": "order_id", "payments": "payment_id", "contact_messages": "message_id"}
+ARCHIVE_INDEXES = {"orders": [[("user_id", 1), ("created_at", -1)]]}  # besides the id
+ARCHIVABLE_ORDER_QUERY = {"$or": [
+    {"status": {"$in": [OrderStatus.COMPLETED.value, OrderStatus.CANCELLED.value]}},
+    {"payment_status": PaymentStatus.FAILED.value}
+]}
+ORDER_EXPORT_COLUMNS = [
+    "order_id", "created_at", "customer_name", "customer_email", "product_name", "plan_duration",
+    "amount", "currency", "status", "payment_status", "archived"
+]
+
+def archive_month(doc: dict) -> str:
+    return (parse_datetime(doc.get("created_at")) or datetime.now(timezone.utc)).strftime("%Y_%m")
+
+def months_between(from_dt: Optional[datetime], to_dt: Optional[datetime], available: List[str]) -> List[str]:
+    """Archive months overlapping a date range, newest first"""
+    low = from_dt.strftime("%Y_%m") if from_dt else "0000_00"
+    high = to_dt.strftime("%Y_%m") if to_dt else "9999_99"
+    return sorted((m for m in available if low <= m <= high), reverse=True)
+
+class CollectionArchiveStore:
+    """Cold documents in monthly collections, e.g. orders_archive_2024_01"""
+    
+    def __init__(self, database):
+        self.database = database
+        self._indexed = set()
+    
+    async def ensure_indexes(self, kind: str, month: str):
+        collection = self.database[f"{kind}_archive_{month}"]
+        if collection.name not in self._indexed:
+            await collection.create_index(ARCHIVE_ID_FIELDS[kind], unique=True)
+            for keys in ARCHIVE_INDEXES.get(kind, []):
+                await collection.create_index(keys)
+            self._indexed.add(collection.name)
+    
+    async def write(self, kind: str, month: str, docs: List[dict]):
+        collection = self.database[f"{kind}_archive_{month}"]
+        await self.ensure_indexes(kind, month)
+        try:
+            await collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Re-running after an interrupted batch: documents already archived are fine
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+    
+    async def months(self, kind: str) -> List[str]:
+        prefix = f"{kind}_archive_"
+        names = await self.database.list_collection_names(filter={"name": {"$regex": f"^{prefix}"}})
+        return sorted(name[len(prefix):] for name in names)
+    
+    async def find(self, kind: str, months: List[str], query: dict, predicate, limit: int) -> List[dict]:
+        docs = []
+        for month in months:
+            if len(docs) >= limit:
+                break
+            docs += await self.database[f"{kind}_archive_{month}"].find(query, {"_id": 0}).sort("created_at", -1).to_list(limit - len(docs))
+        return docs
+    
+    async def iterate(self, kind: str, months: List[str], query: dict, predicate):
+        for month in months:
+            async for doc in self.database[f"{kind}_archive_{month}"].find(query, {"_id": 0}).sort("created_at", -1):
+                yield doc
+
+class FileArchiveStore:
+    """Cold documents in gzip-compressed NDJSON files, ARCHIVE_DIR/<kind>/<YYYY_MM>.ndjson.gz.
+    
+    Each batch is appended as a new gzip member. Files are scanned and filtered
+    in Python, so this trades search speed for keeping MongoDB small.
+    """
+    
+    def __init__(self, directory: Path):
+        self.directory = directory
+    
+    def _path(self, kind: str, month: str) -> Path:
+        return self.directory / kind / f"{month}.ndjson.gz"
+    
+    def _append(self, path: Path, docs: List[dict]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n")
+    
+    def _read(self, path: Path) -> List[dict]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    
+    async def write(self, kind: str, month: str, docs: List[dict]):
+        await run_in_threadpool(self._append, self._path(kind, month), docs)
+    
+    async def months(self, kind: str) -> List[str]:
+        kind_dir = self.directory / kind
+        if not kind_dir.exists():
+            return []
+        return sorted(p.name[:-len(".ndjson.gz")] for p in kind_dir.glob("*.ndjson.gz"))
+    
+    async def find(self, kind: str, months: List[str], query: dict, predicate, limit: int) -> List[dict]:
+        docs = []
+        async for doc in self.iterate(kind, months, query, predicate):
+            docs.append(doc)
+            if len(docs) >= limit:
+                break
+        return docs
+    
+    async def iterate(self, kind: str, months: List[str], query: dict, predicate):
+        for month in months:
+            month_docs = await run_in_threadpool(self._read, self._path(kind, month))
+            for doc in sorted(month_docs, key=lambda d: str(d.get("created_at")), reverse=True):
+                if predicate(doc):
+                    yield doc
+
+class OrderArchive:
+    """Moves finished orders, their payments and read contact messages older
+    than the retention window out of the hot collections.
+    
+    Reads that must still see archived orders: the admin stats use totals
+    rolled up in `archive_totals` as orders are moved, and the sales report
+    adds the archive collections with $unionWith. With the file store the
+    report days of moved orders (in REPORT_TIMEZONE) are stored before the
+    move instead, so only other timezones miss archived orders. Each user
+    records the archive months holding their orders (archived_order_months),
+    so a customer's order history reads only those, and nothing for most.
+    """
+    
+    def __init__(self, store, retention_days: int, batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.store = store
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+    
+    async def union_stages(self, from_dt: Optional[datetime], to_dt: Optional[datetime], pipeline: List[dict]) -> List[dict]:
+        """$unionWith stages adding archived orders created in a range to an orders pipeline"""
+        if not isinstance(self.store, CollectionArchiveStore):
+            return []
+        months = months_between(from_dt, to_dt, await self.store.months("orders"))
+        return [{"$unionWith": {"coll": f"orders_archive_{month}", "pipeline": pipeline}} for month in months]
+    
+    async def totals(self) -> dict:
+        """Order count, paid count and revenue of every archived order"""
+        doc = await db.archive_totals.find_one({"_id": "orders"})
+        if doc is None:
+            # Archives written before the totals were kept: count them once
+            doc = {"orders": 0, "paid_orders": 0, "revenue": 0}
+            user_months = {}
+            async for order in self.store.iterate("orders", await self.store.months("orders"), {}, lambda d: True):
+                self._add(doc, order)
+                user_months.setdefault(order["user_id"], set()).add(archive_month(order))
+            await self._mark_users(user_months)
+            await db.archive_totals.update_one({"_id": "orders"}, {"$setOnInsert": doc}, upsert=True)
+            doc = await db.archive_totals.find_one({"_id": "orders"})
+        return doc
+    
+    @staticmethod
+    async def _mark_users(user_months: dict):
+        if user_months:
+            await db.users.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$addToSet": {"archived_order_months": {"$each": sorted(months)}}})
+                for user_id, months in user_months.items()
+            ], ordered=False)
+    
+    @staticmethod
+    def _add(totals: dict, order: dict):
+        totals["orders"] += 1
+        if order.get("payment_status") == PaymentStatus.PAID.value:
+            totals["paid_orders"] += 1
+            totals["revenue"] += order.get("amount", 0)
+    
+    async def _move(self, kind: str, docs: List[dict]) -> int:
+        by_month = {}
+        for doc in docs:
+            by_month.setdefault(archive_month(doc), []).append(doc)
+        for month, month_docs in by_month.items():
+            await self.store.write(kind, month, month_docs)
+        # Delete only after every month is written, a crash in between just archives twice (ignored)
+        id_field = ARCHIVE_ID_FIELDS[kind]
+        await db[kind].delete_many({id_field: {"$in": [d[id_field] for d in docs]}})
+        return len(docs)
+    
+    async def run(self, dry_run: bool = False) -> dict:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        order_query = {"created_at": {"$lt": cutoff}, **ARCHIVABLE_ORDER_QUERY}
+        message_query = {"created_at": {"$lt": cutoff}, "is_read": True}
+        
+        if dry_run:
+            return {
+                "dry_run": True,
+                "cutoff": cutoff,
+                "orders": await db.orders.count_documents(order_query),
+                "contact_messages": await db.contact_messages.count_documents(message_query)
+            }
+        
+        moved = {"orders": 0, "payments": 0, "contact_messages": 0}
+        await self.totals()
+        report_zone = ZoneInfo(REPORT_TIMEZONE)
+        while True:
+            orders = await db.orders.find(order_query, {"_id": 0}).limit(self.batch_size).to_list(self.batch_size)
+            if not orders:
+                break
+            if not isinstance(self.store, CollectionArchiveStore):
+                days = {parse_datetime(o["created_at"]).astimezone(report_zone).date() for o in orders}
+                await sales_report_cache.fragments(report_zone, sorted(days))
+            # Cart payments reference the checkout_id rather than an order_id
+            references = list({o["order_id"] for o in orders} | {o["checkout_id"] for o in orders if o.get("checkout_id")})
+            payments = await db.payments.find({"order_id": {"$in": references}}, {"_id": 0}).to_list(None)
+            if payments:
+                moved["payments"] += await self._move("payments", payments)
+            moved["orders"] += await self._move("orders", orders)
+            rollup = {"orders": 0, "paid_orders": 0, "revenue": 0}
+            user_months = {}
+            for order in orders:
+                self._add(rollup, order)
+                user_months.setdefault(order["user_id"], set()).add(archive_month(order))
+            await self._mark_users(user_months)
+            await db.archive_totals.update_one({"_id": "orders"}, {"$inc": rollup}, upsert=True)
+        
+        while True:
+            messages = await db.contact_messages.find(message_query, {"_id": 0}).limit(self.batch_size).to_list(self.batch_size)
+            if not messages:
+                break
+            moved["contact_messages"] += await self._move("contact_messages", messages)
+        
+        logger.info(f"Archived {moved} older than {cutoff.date()}")
+        return {"dry_run": False, "cutoff": cutoff, **moved}
+    
+    async def find_order(self, order_id: str, near: Optional[datetime] = None) -> Optional[dict]:
+        """Look an archived order up, checking the months around `near` when given"""
+        near = near or id_timestamp(order_id)
+        months = await self.store.months("orders")
+        if near:
+            previous = (near.replace(day=1) - timedelta(days=1)).strftime("%Y_%m")
+            months = [m for m in (near.strftime("%Y_%m"), previous) if m in months]
+        docs = await self.store.find("orders", months, {"order_id": order_id}, lambda d: d.get("order_id") == order_id, 1)
+        return docs[0] if docs else None
+    
+    async def loop(self, interval_hours: int):
+        while True:
+            await asyncio.sleep(interval_hours * 3600)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Archive run failed")
+
+order_archive = OrderArchive(
+    FileArchiveStore(ARCHIVE_DIR) if ARCHIVE_STORAGE == "files" else CollectionArchiveStore(db),
+    ARCHIVE_RETENTION_DAYS
+)
+
+def order_search_filters(q: Optional[str], status: Optional[OrderStatus], from_dt: Optional[datetime], to_dt: Optional[datetime]):
+    """The same search as a MongoDB query and as a predicate for file archives"""
+    query = {}
+    if q:
+        query["$or"] = [{"order_id": q}, {"customer_email": {"$in": [q, q.lower()]}}, {"checkout_id": q}]
+    if status:
+        query["status"] = status.value
+    if from_dt or to_dt:
+        query["created_at"] = {}
+        if from_dt:
+            query["created_at"]["$gte"] = from_dt
+        if to_dt:
+            query["created_at"]["$lte"] = to_dt
+    
+    def predicate(doc: dict) -> bool:
+        if q and q not in (doc.get("order_id"), doc.get("customer_email"), doc.get("checkout_id")) and q.lower() != doc.get("customer_email"):
+            return False
+        if status and doc.get("status") != status.value:
+            return False
+        created_at = parse_datetime(doc.get("created_at"))
+        if from_dt and (not created_at or created_at < from_dt):
+            return False
+        if to_dt and (not created_at or created_at > to_dt):
+            return False
+        return True
+    
+    return query, predicate
+
+def _parse_range(from_date: Optional[str], to_date: Optional[str]):
+    try:
+        return parse_datetime(from_date), parse_datetime(to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+@api_router.post("/admin/archive/run")
+async def run_archive(dry_run: bool = False, admin: User = Depends(get_admin_user)):
+    """Archive finished orders, payments and read messages older than the retention window"""
+    return await order_archive.run(dry_run=dry_run)
+
+@api_router.get("/admin/orders/search")
+async def search_orders(
+    q: Optional[str] = None,
+    status: Optional[OrderStatus] = None,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    include_archive: bool = True,
+    limit: int = Query(100, ge=1, le=1000),
+    admin: User = Depends(get_admin_user)
+):
+    """Search orders by id, checkout id or customer email across hot and archived data"""
+    from_dt, to_dt = _parse_range(from_date, to_date)
+    query, predicate = order_search_filters(q, status, from_dt, to_dt)
+    
+    orders = await reporting_db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+    if include_archive and len(orders) < limit:
+        months = months_between(from_dt, to_dt, await order_archive.store.months("orders"))
+        archived = await order_archive.store.find("orders", months, query, predicate, limit - len(orders))
+        orders += [{**order, "archived": True} for order in archived]
+    return orders
+
+@api_router.get("/admin/orders/export")
+async def export_orders(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    include_archive: bool = True,
+    admin: User = Depends(get_admin_user)
+):
+    """Stream orders in a date range as CSV, archived months included"""
+    from_dt, to_dt = _parse_range(from_date, to_date)
+    query, predicate = order_search_filters(None, None, from_dt, to_dt)
+    
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=ORDER_EXPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        
+        async def sources():
+            async for order in reporting_db.orders.find(query, {"_id": 0}).sort("created_at", -1):
+                yield {**order, "archived": False}
+            if include_archive:
+                months = months_between(from_dt, to_dt, await order_archive.store.months("orders"))
+                async for order in order_archive.store.iterate("orders", months, query, predicate):
+                    yield {**order, "archived": True}
+        
+        async for order in sources():
+            writer.writerow(order)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    filename = f"orders_{(from_date or 'all')[:10]}_{(to_date or 'now')[:10]}.csv"
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+# ============== PENDING SWEEPER ==============
+class PendingSweeper:
+    """Cleans up abandoned checkouts.
+    
+    - pending orders older than PENDING_ORDER_MAX_AGE_HOURS are cancelled
+      and their payment_status set to expired
+    - pending payments of cancelled orders, older than
+      PENDING_PAYMENT_MAX_AGE_HOURS, or superseded by a newer pending
+      payment for the same order are marked expired
+    
+    Updates are sent in bulk_write batches, never one round trip per record.
+    """
+    
+    def __init__(self, order_max_age_hours: int, payment_max_age_hours: int, batch_size: int = SWEEP_BATCH_SIZE):
+        self.order_max_age = timedelta(hours=order_max_age_hours)
+        self.payment_max_age = timedelta(hours=payment_max_age_hours)
+        self.batch_size = batch_size
+    
+    async def cancel_abandoned_orders(self, now: datetime) -> List[str]:
+        query = {
+            "status": OrderStatus.PENDING.value,
+            "payment_status": PaymentStatus.PENDING.value,
+            "created_at": {"$lt": now - self.order_max_age}
+        }
+        updated_at = now.isoformat()
+        references = []
+        while True:
+            orders = await db.orders.find(query, {"_id": 0, "order_id": 1}).limit(self.batch_size).to_list(self.batch_size)
+            if not orders:
+                break
+            order_ids = [o["order_id"] for o in orders]
+            # Re-check the status so an order paid since the read is left alone
+            await db.orders.update_many(
+                {"order_id": {"$in": order_ids}, "status": OrderStatus.PENDING.value, "payment_status": PaymentStatus.PENDING.value},
+                {"$set": {"status": OrderStatus.CANCELLED.value, "payment_status": PaymentStatus.EXPIRED.value, "updated_at": updated_at}}
+            )
+            cancelled = await db.orders.find(
+                {"order_id": {"$in": order_ids}, "status": OrderStatus.CANCELLED.value, "updated_at": updated_at},
+                {"_id": 0, **dict.fromkeys(ADMIN_EVENT_FIELDS["order_updated"], 1), "checkout_id": 1, "created_at": 1}
+            ).to_list(None)
+            for order in cancelled:
+                admin_events.emit("order_updated", order)
+                order_events.record(order["order_id"], "order_cancelled", source="sweeper")
+            await sales_report_cache.invalidate([order["created_at"] for order in cancelled])
+            references += [o.get("checkout_id") or o["order_id"] for o in cancelled]
+        # A cart's orders can land in different batches
+        return list(dict.fromkeys(references))
+    
+    async def expire_payments(self, now: datetime, cancelled_references: List[str]) -> dict:
+        expire = {"$set": {"status": PaymentStatus.EXPIRED.value, "updated_at": now.isoformat()}}
+        pending = PaymentStatus.PENDING.value
+        
+        expired = 0
+        superseded = 0
+        
+        # Keep the newest pending payment per order, expire the rest, one batch at a time
+        batch = []
+        duplicates = db.payments.aggregate([
+            {"$match": {"status": pending}},
+            {"$sort": {"created_at": -1}},
+            {"$group": {"_id": "$order_id", "payment_ids": {"$push": "$payment_id"}}},
+            {"$match": {"payment_ids.1": {"$exists": True}}}
+        ], allowDiskUse=True, batchSize=self.batch_size)
+        async for duplicate in duplicates:
+            batch += duplicate["payment_ids"][1:]
+            if len(batch) >= self.batch_size:
+                superseded += len(batch)
+                expired += (await db.payments.update_many({"payment_id": {"$in": batch}, "status": pending}, expire)).modified_count
+                batch = []
+        if batch:
+            superseded += len(batch)
+            expired += (await db.payments.update_many({"payment_id": {"$in": batch}, "status": pending}, expire)).modified_count
+        
+        operations = [
+            UpdateMany({"order_id": {"$in": cancelled_references[i:i + self.batch_size]}, "status": pending}, expire)
+            for i in range(0, len(cancelled_references), self.batch_size)
+        ]
+        operations.append(UpdateMany({"status": pending, "created_at": {"$lt": now - self.payment_max_age}}, expire))
+        expired += (await db.payments.bulk_write(operations, ordered=False)).modified_count
+        return {"duplicate_payments": superseded, "payments_expired": expired}
+    
+    async def run(self) -> dict:
+        now = datetime.now(timezone.utc)
+        cancelled_references = await self.cancel_abandoned_orders(now)
+        report = {"orders_cancelled": len(cancelled_references), **await self.expire_payments(now, cancelled_references)}
+        if any(report.values()):
+            logger.info(f"Pending sweep: {report}")
+        return report
+    
+    async def loop(self, interval_minutes: int):
+        while True:
+            await asyncio.sleep(interval_minutes * 60)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Pending sweep failed")
+
+pending_sweeper = PendingSweeper(PENDING_ORDER_MAX_AGE_HOURS, PENDING_PAYMENT_MAX_AGE_HOURS)
+
+@api_router.post("/admin/maintenance/sweep")
+async def run_pending_sweep(admin: User = Depends(get_admin_user)):
+    """Cancel abandoned pending orders and expire stale or duplicate pending payments"""
+    return await pending_sweeper.run()
+
+# ============== PAYMENT RECONCILIATION ==============
+class PaymentReconciler:
+    """Settles pending payments whose Kashier webhook never arrived.
+    
+    Pages through pending payments older than RECONCILE_MIN_AGE_MINUTES,
+    asks the gateway for each one's status over the pooled HTTP client
+    (at most RECONCILE_CONCURRENCY requests in flight) and applies every
+    page of answers with one settle_payments call. Payments the gateway
+    still reports as pending are left for the next run or the sweeper.
+    
+    For offline runs, point KASHIER_API_URL at backend/kashier_stub.py.
+    """
+    
+    def __init__(self, min_age_minutes: int, concurrency: int, batch_size: int = RECONCILE_BATCH_SIZE):
+        self.min_age = timedelta(minutes=min_age_minutes)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+    
+    async def gateway_status(self, payment: dict, semaphore: asyncio.Semaphore) -> Optional[dict]:
+        reference_id = payment["order_id"]
+        signature = hmac.new(KASHIER_API_KEY.encode(), f"{KASHIER_MERCHANT_ID}:{reference_id}".encode(), hashlib.sha256).hexdigest().upper()
+        async with semaphore:
+            async with kashier_http().get(
+                f"{KASHIER_API_URL}/api/v1/payment/{reference_id}",
+                params={"merchant_id": KASHIER_MERCHANT_ID},
+                headers={"X-Signature": signature}
+            ) as resp:
+                if resp.status == 404:
+                    return None
+                resp.raise_for_status()
+                result = await resp.json()
+        status = result.get("payment_status")
+        if status not in ("success", "failed"):
+            return None
+        return {"payment_id": payment["payment_id"], "paid": status == "success", "transaction_id": result.get("transaction_id")}
+    
+    async def run(self) -> dict:
+        if not KASHIER_MERCHANT_ID or not KASHIER_API_KEY:
+            return {"skipped": "Payment gateway not configured"}
+        
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {"checked": 0, "paid": 0, "failed": 0, "still_pending": 0, "errors": 0}
+        query = {
+            "status": PaymentStatus.PENDING.value,
+            "created_at": {"$lt": datetime.now(timezone.utc) - self.min_age}
+        }
+        last_id = None
+        while True:
+            page_query = {**query, "_id": {"$gt": last_id}} if last_id else query
+            payments = await db.payments.find(
+                page_query, {"_id": 1, "payment_id": 1, "order_id": 1}
+            ).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not payments:
+                break
+            last_id = payments[-1]["_id"]
+            
+            results = await asyncio.gather(
+                *(self.gateway_status(p, semaphore) for p in payments), return_exceptions=True
+            )
+            outcomes = []
+            for payment, result in zip(payments, results):
+                if isinstance(result, Exception):
+                    report["errors"] += 1
+                    logger.warning(f"Reconciling {payment['payment_id']} failed: {result!r}")
+                elif result is None:
+                    report["still_pending"] += 1
+                else:
+                    outcomes.append(result)
+            
+            settled = await settle_payments(outcomes, source="reconciler")
+            for outcome in outcomes:
+                if outcome["payment_id"] in settled:
+                    report["paid" if outcome["paid"] else "failed"] += 1
+            report["checked"] += len(payments)
+        
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if report["paid"] or report["failed"] or report["errors"]:
+            logger.info(f"Payment reconciliation: {report}")
+        return report
+    
+    async def loop(self, interval_minutes: int):
+        while True:
+            await asyncio.sleep(interval_minutes * 60)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Payment reconciliation failed")
+
+payment_reconciler = PaymentReconciler(RECONCILE_MIN_AGE_MINUTES, RECONCILE_CONCURRENCY)
+
+@api_router.post("/admin/maintenance/reconcile-payments")
+async def run_payment_reconciliation(admin: User = Depends(get_admin_user)):
+    """Settle pending payments from the gateway's status when their webhook was lost"""
+    return await payment_reconciler.run()
+
 # ============== SETTINGS ROUTES ==============
 class SettingsModel(BaseModel):
     kashier_merchant_id: Optional[str] = ""
@@ -956,6 +4385,7 @@ async def update_settings(settings: SettingsModel, admin: User = Depends(get_adm
         {"$set": settings_dict},
         upsert=True
     )
+    pricing_cache.invalidate()
     
     return {"message": "Settings updated successfully"}
 
@@ -981,8 +4411,10 @@ async def test_kashier_connection(admin: User = Depends(get_admin_user)):
 
 # ============== SEED DATA ==============
 @api_router.post("/seed")
-async def seed_data():
+async def seed_data(request: Request):
     """Seed initial hosting plans - for development"""
+    await check_rate_limit("seed", request)
+    
     existing = await db.products.count_documents({})
     if existing > 0:
         return {"message": "Data already seeded"}
@@ -1061,6 +4493,8 @@ async def seed_data():
     ]
     
     await db.products.insert_many(products)
+    catalog_cache.invalidate()
+    pricing_cache.invalidate()
     
     # Create admin user
     admin_exists = await db.users.find_one({"email": "admin@igate-host.com"})
@@ -1084,6 +4518,15 @@ async def root():
 # Include router
 app.include_router(api_router)
 
+# Per-request DB profiler (inside compression, so it sees the raw body)
+app.add_middleware(DbProfilerMiddleware)
+
+# Response compression
+app.add_middleware(CompressionMiddleware)
+
+# Load shedding (rejects before any handler work is done)
+app.add_middleware(LoadSheddingMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -1093,6 +4536,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def ensure_indexes():
+    await ensure_unique_id_index(db.orders, "order_id", "ORD", [
+        (db.payments, "order_id"), (db.invoices, "order_id"), (db.order_events, "order_id")
+    ])
+    await ensure_unique_id_index(db.payments, "payment_id", "PAY", [
+        (db.orders, "payment_id"), (db.invoices, "payment_id"), (db.order_events, "payment_id")
+    ])
+    await ensure_unique_id_index(db.invoices, "invoice_id", "INV", [
+        (db.order_events, "invoice_id"), (db.email_outbox, "invoice_id")
+    ])
+    await db.orders.create_index("checkout_id", sparse=True)
+    await db.orders.create_index("settlement_id", sparse=True)
+    await db.orders.create_index([("status", 1), ("created_at", 1)])
+    await db.orders.create_index([("user_id", 1), ("created_at", 1)])
+    # Covers the daily sales and product report aggregations
+    await db.orders.create_index([("created_at", 1), ("payment_status", 1), ("product_id", 1), ("plan_duration", 1), ("amount", 1)])
+    await db.payments.create_index([("order_id", 1), ("status", 1)])
+    await db.payments.create_index([("status", 1), ("created_at", 1)])
+    await db.payments.create_index(
+        "idempotency_key",
+        unique=True,
+        partialFilterExpression={"status": PaymentStatus.PENDING.value, "idempotency_key": {"$type": "string"}}
+    )
+    await session_store.ensure_indexes()
+    await rate_limit_backend.ensure_indexes()
+    await slow_query_recorder.ensure_collection()
+    if isinstance(order_archive.store, CollectionArchiveStore):
+        for month in await order_archive.store.months("orders"):
+            await order_archive.store.ensure_indexes("orders", month)
+    await order_events.ensure_indexes()
+    await sales_report_cache.ensure_indexes()
+    await ensure_customer_indexes()
+    await email_outbox.ensure_indexes()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.background_tasks = [
+        asyncio.create_task(loop_lag_monitor.run()),
+        asyncio.create_task(slow_query_recorder.run()),
+        asyncio.create_task(admin_events.watch()),
+        asyncio.create_task(order_events.run())
+    ]
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        app.state.background_tasks.append(asyncio.create_task(order_archive.loop(ARCHIVE_INTERVAL_HOURS)))
+    if SWEEP_INTERVAL_MINUTES > 0:
+        app.state.background_tasks.append(asyncio.create_task(pending_sweeper.loop(SWEEP_INTERVAL_MINUTES)))
+    if RECONCILE_INTERVAL_MINUTES > 0 and KASHIER_MERCHANT_ID and KASHIER_API_KEY:
+        app.state.background_tasks.append(asyncio.create_task(payment_reconciler.loop(RECONCILE_INTERVAL_MINUTES)))
+    if SMTP_HOST:
+        app.state.background_tasks.append(asyncio.create_task(email_outbox.loop(EMAIL_OUTBOX_POLL_SECONDS)))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in getattr(app.state, "background_tasks", []):
+        task.cancel()
+    await order_events.flush()
+    if _kashier_http is not None:
+        await _kashier_http.close()
+    await run_in_threadpool(email_outbox.close)
     client.close()
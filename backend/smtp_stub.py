@@ -0,0 +1,86 @@
+"""Local stand-in SMTP server for the email outbox, for offline testing.
+
+    python smtp_stub.py --port 8025 --temp-fail-ratio 0.1
+
+then start the API with SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=false.
+
+Accepts every message and prints its sender, recipients, subject and
+attachments. With --temp-fail-ratio a share of messages is rejected with a
+451 (derived from a hash of the Message-ID, so the same messages fail on
+every run) to exercise the outbox retries, and --reject-domain answers 550
+for recipients of one domain.
+"""
+import argparse
+import asyncio
+import hashlib
+from email import message_from_bytes, policy
+
+from aiosmtpd.controller import Controller
+
+
+def temporary_failure(message_id: str, ratio: float, attempts: dict) -> bool:
+    """Fail a message's first delivery when its hash falls below `ratio`"""
+    if not ratio:
+        return False
+    attempts[message_id] = attempts.get(message_id, 0) + 1
+    bucket = int(hashlib.sha256(message_id.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < ratio and attempts[message_id] == 1
+
+
+class StubHandler:
+    def __init__(self, temp_fail_ratio: float = 0, reject_domain: str = "", quiet: bool = False):
+        self.temp_fail_ratio = temp_fail_ratio
+        self.reject_domain = reject_domain
+        self.quiet = quiet
+        self.messages = []
+        self.stats = {"connections": 0, "accepted": 0, "temporary_failures": 0, "rejected": 0}
+        self._attempts = {}
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.stats["connections"] += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.reject_domain and address.lower().endswith(f"@{self.reject_domain}"):
+            self.stats["rejected"] += 1
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        message = message_from_bytes(envelope.content, policy=policy.default)
+        if temporary_failure(message.get("Message-ID", ""), self.temp_fail_ratio, self._attempts):
+            self.stats["temporary_failures"] += 1
+            return "451 Try again later"
+        self.messages.append(message)
+        self.stats["accepted"] += 1
+        if not self.quiet:
+            attachments = [part.get_filename() for part in message.iter_attachments()]
+            print(f"{envelope.mail_from} -> {', '.join(envelope.rcpt_tos)}: {message['Subject']} {attachments or ''}")
+        return "250 Message accepted for delivery"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--temp-fail-ratio", type=float, default=0, help="share of messages answered 451 once")
+    parser.add_argument("--reject-domain", default="", help="answer 550 for recipients of this domain")
+    args = parser.parse_args()
+
+    handler = StubHandler(args.temp_fail_ratio, args.reject_domain)
+    controller = Controller(handler, hostname=args.host, port=args.port)
+    controller.start()
+    print(f"SMTP stub listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(asyncio.Event().wait())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+        print(handler.stats)
+
+
+if __name__ == "__main__":
+    main()
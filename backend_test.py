@@ -7,7 +7,9 @@ Tests all API endpoints including auth, products, orders, invoices, and admin fu
 import requests
 import sys
 import json
-from datetime import datetime
+import io
+import zipfile
+from datetime import datetime, timezone
 
 class IgateHostAPITester:
     def __init__(self, base_url="https://igate-host.preview.emergentagent.com"):
@@ -276,6 +278,43 @@ class IgateHostAPITester:
             self.log_test("Mock Payment", False, str(e))
             return False
 
+    def test_cart_checkout(self, products):
+        """Test multi-item checkout with a single payment for the cart"""
+        if len(products) < 2:
+            self.log_test("Cart Checkout", False, "Need at least two products")
+            return False
+            
+        try:
+            checkout_data = {
+                "items": [
+                    {"product_id": products[0]["product_id"], "plan_duration": "monthly"},
+                    {"product_id": products[1]["product_id"], "plan_duration": "yearly"}
+                ],
+                "customer_name": "Test Customer",
+                "customer_email": "testcustomer@example.com",
+                "customer_phone": "+201234567890"
+            }
+            
+            headers = {'Authorization': f'Bearer {self.user_token}'}
+            response = self.session.post(f"{self.api_url}/checkout", json=checkout_data, headers=headers)
+            success = response.status_code == 200
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                data = response.json()
+                details += f", Checkout ID: {data.get('checkout_id')}, Orders: {len(data.get('orders', []))}, Amount: {data.get('amount')}"
+                
+                payment_id = data.get('payment', {}).get('payment_id')
+                complete_response = self.session.post(f"{self.api_url}/payments/mock-complete/{payment_id}", headers=headers)
+                success = complete_response.status_code == 200 and len(complete_response.json().get('invoice_ids', [])) == 2
+                details += f", Complete Status: {complete_response.status_code}"
+            
+            self.log_test("Cart Checkout", success, details)
+            return success
+        except Exception as e:
+            self.log_test("Cart Checkout", False, str(e))
+            return False
+
     def test_admin_orders(self):
         """Test admin orders endpoint"""
         try:
@@ -317,6 +356,37 @@ class IgateHostAPITester:
             self.log_test("Admin Invoices", False, str(e))
             return False
 
+    def test_admin_invoice_archive(self):
+        """Test streamed ZIP export of invoice PDFs"""
+        try:
+            headers = {'Authorization': f'Bearer {self.admin_token}'}
+            invoices = self.session.get(f"{self.api_url}/admin/invoices", headers=headers).json()
+            # A bare "to" date covers the whole day, so invoices issued today are included
+            response = self.session.get(
+                f"{self.api_url}/admin/invoices/archive",
+                params={"from": "2000-01-01", "to": datetime.now(timezone.utc).date().isoformat()},
+                headers=headers
+            )
+            success = response.status_code == 200 and response.headers.get('content-type', '').startswith('application/zip')
+            details = f"Status: {response.status_code}"
+            
+            if success:
+                archive = zipfile.ZipFile(io.BytesIO(response.content))
+                names = archive.namelist()
+                success = (
+                    archive.testzip() is None
+                    # The invoice list stops at 1000
+                    and (len(names) == len(invoices) if len(invoices) < 1000 else len(names) >= 1000)
+                    and all(name.endswith('.pdf') and archive.read(name).startswith(b'%PDF') for name in names)
+                )
+                details += f", PDFs in archive: {len(names)}, invoices: {len(invoices)}"
+            
+            self.log_test("Admin Invoice Archive", success, details)
+            return success
+        except Exception as e:
+            self.log_test("Admin Invoice Archive", False, str(e))
+            return False
+
     def test_admin_messages(self):
         """Test admin contact messages endpoint"""
         try:
@@ -523,6 +593,9 @@ class IgateHostAPITester:
                 order_success, order = self.test_create_order(products)
                 if order_success:
                     self.test_mock_payment(order)
+                self.test_cart_checkout(products)
+            # After the payment flow, so today's invoices are in the archive
+            self.test_admin_invoice_archive()
         
         # Print summary
         print("\n" + "=" * 50)
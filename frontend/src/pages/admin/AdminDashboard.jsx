@@ -57,6 +57,44 @@ const AdminDashboard = () => {
     fetchData();
   }, [dateRange]);
 
+  // Live deltas instead of polling; stats are refetched at most every few seconds
+  useEffect(() => {
+    const events = new EventSource(`${API}/admin/events`, { withCredentials: true });
+    let statsTimer = null;
+    const refreshStats = () => {
+      if (statsTimer) return;
+      statsTimer = setTimeout(async () => {
+        statsTimer = null;
+        try {
+          const statsRes = await axios.get(`${API}/admin/stats`, { withCredentials: true });
+          setStats(statsRes.data);
+        } catch (error) {
+          console.error("Error fetching stats:", error);
+        }
+      }, 3000);
+    };
+
+    events.addEventListener("order_created", (e) => {
+      const order = JSON.parse(e.data);
+      setRecentOrders((orders) => [order, ...orders.filter((o) => o.order_id !== order.order_id)].slice(0, 5));
+      refreshStats();
+    });
+    events.addEventListener("order_updated", (e) => {
+      const update = JSON.parse(e.data);
+      setRecentOrders((orders) => orders.map((o) => (o.order_id === update.order_id ? { ...o, ...update } : o)));
+      refreshStats();
+    });
+    events.addEventListener("payment_updated", refreshStats);
+    events.addEventListener("contact_message", () => {
+      setStats((current) => current && { ...current, unread_messages: current.unread_messages + 1 });
+    });
+
+    return () => {
+      clearTimeout(statsTimer);
+      events.close();
+    };
+  }, []);
+
   const quickDateRanges = [
     { label: "اليوم", from: new Date(), to: new Date() },
     { label: "آخر 7 أيام", from: subDays(new Date(), 7), to: new Date() },
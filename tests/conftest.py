@@ -0,0 +1,98 @@
+import os
+import sys
+from datetime import timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import mongomock.aggregate
+import pytest
+
+# server.py reads these at import time; the unit tests never connect
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "igate_unit_tests")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+def _union_with(collection, database, options):
+    """mongomock has no $unionWith, which the archive-aware reads use"""
+    return list(collection) + list(database[options["coll"]].aggregate(options.get("pipeline", [])))
+
+
+mongomock.aggregate._PIPELINE_HANDLERS.setdefault("$unionWith", _union_with)
+
+_handle_date_operator = mongomock.aggregate._Parser._handle_date_operator
+
+
+def _date_operator_in_zone(parser, operator, values):
+    """mongomock's $dateToString has no timezone, which the sales fragments group days by"""
+    if operator == "$dateToString" and isinstance(values, dict) and "timezone" in values:
+        value = parser.parse(values["date"])
+        value = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return value.astimezone(ZoneInfo(values["timezone"])).strftime(values["format"])
+    return _handle_date_operator(parser, operator, values)
+
+
+mongomock.aggregate._Parser._handle_date_operator = _date_operator_in_zone
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An in-memory database in place of the primary and the reporting
+    secondary, including the collections bound at import time"""
+    import server
+    from mongomock_motor import AsyncMongoMockClient
+
+    database = AsyncMongoMockClient()[os.environ["DB_NAME"]]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "reporting_db", database)
+    for instance in (server.session_store, server.order_events, server.email_outbox, server.sales_report_cache,
+                     server.subscription_analytics):
+        monkeypatch.setattr(instance, "collection", database[instance.collection.name])
+    monkeypatch.setattr(server.pricing_cache, "products", database.products)
+    monkeypatch.setattr(server.pricing_cache, "settings", database.settings)
+    monkeypatch.setattr(server.order_archive, "store", server.CollectionArchiveStore(database))
+    # No replica set behind mongomock, and payments stay in mock mode unless a test sets Kashier up
+    monkeypatch.setattr(server, "_transactions_supported", False)
+    monkeypatch.setattr(server, "KASHIER_MERCHANT_ID", "")
+    monkeypatch.setattr(server, "KASHIER_API_KEY", "")
+    server.pricing_cache.invalidate()
+    server.catalog_cache.invalidate()
+    monkeypatch.setattr(server.order_events, "buffer", server.deque(maxlen=server.order_events.buffer.maxlen))
+    return database
+
+
+@pytest.fixture
+def catalog(mongo):
+    """Two products, 14% tax and a customer"""
+    import asyncio
+
+    import server
+
+    async def seed():
+        await mongo.products.insert_many([
+            server.Product(
+                product_id=product_id, name_ar=f"{product_id} ar", name_en=f"{product_id} en", description_ar="",
+                description_en="", category=server.ProductCategory.HOSTING, price_monthly=monthly, price_yearly=yearly
+            ).model_dump()
+            for product_id, monthly, yearly in (("basic", 99.99, 999.99), ("pro", 149.5, 1495))
+        ])
+        await mongo.settings.insert_one({"type": "global", "tax_enabled": True, "tax_percentage": 14})
+        await mongo.users.insert_one({"user_id": "user_1", "email": "c@example.com", "name": "Customer"})
+    asyncio.run(seed())
+    return mongo
+
+
+@pytest.fixture
+def customer():
+    import server
+
+    return server.User(user_id="user_1", email="c@example.com", name="Customer")
+
+
+def make_request(headers=None, client=("127.0.0.1", 1234)):
+    from starlette.requests import Request
+
+    return Request({
+        "type": "http", "client": client,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    })
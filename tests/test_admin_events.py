@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import AdminEventHub, CartItem, CheckoutCreate
+from tests.conftest import make_request
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = AdminEventHub(max_subscribers=2, queue_size=2)
+    monkeypatch.setattr(server, "admin_events", hub)
+    return hub
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_events_fan_out_with_only_the_published_fields(hub):
+    first, second = hub.subscribe(), hub.subscribe()
+    hub.emit("order_updated", {"order_id": "ORD-1", "status": "completed", "customer_email": "c@example.com"})
+    expected = [{"id": 1, "type": "order_updated", "data": {"order_id": "ORD-1", "status": "completed"}}]
+    assert drain(first) == drain(second) == expected
+
+
+def test_slow_subscriber_loses_its_oldest_events(hub):
+    queue = hub.subscribe()
+    for n in range(3):
+        hub.publish("contact_message", {"message_id": f"MSG-{n}"})
+    assert [e["data"]["message_id"] for e in drain(queue)] == ["MSG-1", "MSG-2"]
+
+
+def test_subscribers_are_capped(hub):
+    queue = hub.subscribe()
+    hub.subscribe()
+    with pytest.raises(HTTPException) as e:
+        hub.subscribe()
+    assert e.value.status_code == 503
+    hub.unsubscribe(queue)
+    hub.subscribe()
+
+
+def test_emit_defers_to_the_change_stream(hub):
+    queue = hub.subscribe()
+    hub.change_streams = True
+    hub.emit("order_updated", {"order_id": "ORD-1"})
+    assert queue.empty() and hub.published == 0
+
+
+def test_checkout_publishes_its_orders(catalog, customer, hub):
+    queue = hub.subscribe()
+    result = asyncio.run(server.checkout(
+        CheckoutCreate(items=[CartItem(product_id="basic", plan_duration="monthly")],
+                       customer_name="Customer", customer_email="c@example.com"),
+        make_request(), customer
+    ))
+    events = drain(queue)
+    assert [e["type"] for e in events] == ["order_created"]
+    assert events[0]["data"]["checkout_id"] == result["checkout_id"]
+    assert "customer_email" not in events[0]["data"]
+
+
+def test_stream_sends_events_as_sse_and_unsubscribes(hub, customer):
+    async def read():
+        response = await server.stream_admin_events(customer)
+        body = response.body_iterator
+        retry = await body.__anext__()
+        hub.publish("order_updated", {"order_id": "ORD-1", "status": "cancelled"})
+        event = await body.__anext__()
+        await body.aclose()
+        return retry, event
+
+    retry, event = asyncio.run(read())
+    assert retry == f"retry: {server.ADMIN_EVENTS_HEARTBEAT_SECONDS * 1000}\n\n"
+    head, data = event.rstrip("\n").rsplit("\n", 1)
+    assert head == "id: 1\nevent: order_updated"
+    assert json.loads(data.removeprefix("data: ")) == {"order_id": "ORD-1", "status": "cancelled"}
+    assert not hub.subscribers
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import ListProjection, Order, OrderStatus, PaymentStatus, order_archive
+
+
+def order(order_id, user_id, age_days, status=OrderStatus.COMPLETED, payment_status=PaymentStatus.PAID, amount=100):
+    return Order(
+        order_id=order_id, user_id=user_id, product_id="prod_1", product_name="Hosting", plan_duration="monthly",
+        amount=amount, status=status, payment_status=payment_status, customer_name="Customer",
+        customer_email=f"{user_id}@example.com", created_at=datetime.now(timezone.utc) - timedelta(days=age_days)
+    ).model_dump()
+
+
+@pytest.fixture
+def history(mongo):
+    async def seed():
+        await mongo.users.insert_many([{"user_id": "user_1"}, {"user_id": "user_2"}])
+        await mongo.orders.insert_many([
+            order("ORD-OLD", "user_1", 500),
+            order("ORD-OLD-CANCELLED", "user_1", 450, OrderStatus.CANCELLED, PaymentStatus.EXPIRED),
+            order("ORD-OLD-PENDING", "user_1", 480, OrderStatus.PENDING, PaymentStatus.PENDING),
+            order("ORD-NEW", "user_1", 10),
+            order("ORD-OTHER", "user_2", 5),
+        ])
+        await mongo.payments.insert_many([
+            server.Payment(payment_id="PAY-OLD", order_id="ORD-OLD", amount=100).model_dump(),
+            server.Payment(payment_id="PAY-NEW", order_id="ORD-NEW", amount=100).model_dump(),
+        ])
+    asyncio.run(seed())
+    return mongo
+
+
+def archived_ids(mongo, kind):
+    async def read():
+        ids = []
+        for name in await mongo.list_collection_names():
+            if name.startswith(f"{kind}_archive_"):
+                ids += [d[server.ARCHIVE_ID_FIELDS[kind]] for d in await mongo[name].find().to_list(None)]
+        return sorted(ids)
+    return asyncio.run(read())
+
+
+def user_orders(user_id):
+    return asyncio.run(server.get_user_orders(
+        server.User(user_id=user_id, email=f"{user_id}@example.com", name="Customer"), ListProjection(Order)
+    ))
+
+
+def test_finished_orders_older_than_retention_are_moved(history):
+    report = asyncio.run(order_archive.run())
+    assert (report["orders"], report["payments"]) == (2, 1)
+    assert archived_ids(history, "orders") == ["ORD-OLD", "ORD-OLD-CANCELLED"]
+    assert archived_ids(history, "payments") == ["PAY-OLD"]
+    live = asyncio.run(history.orders.distinct("order_id"))
+    assert sorted(live) == ["ORD-NEW", "ORD-OLD-PENDING", "ORD-OTHER"]
+
+
+def test_archived_orders_can_still_be_looked_up(history):
+    asyncio.run(order_archive.run())
+    found = asyncio.run(order_archive.find_order("ORD-OLD", near=datetime.now(timezone.utc) - timedelta(days=500)))
+    assert found["order_id"] == "ORD-OLD"
+    assert asyncio.run(order_archive.find_order("ORD-MISSING")) is None
+
+
+def test_totals_and_stats_survive_the_move(history):
+    before = asyncio.run(server.compute_admin_stats())
+    asyncio.run(order_archive.run())
+    assert asyncio.run(order_archive.totals())["orders"] == 2
+    after = asyncio.run(server.compute_admin_stats())
+    assert (after["total_orders"], after["total_revenue"]) == (before["total_orders"], before["total_revenue"])
+
+
+def test_order_history_reads_the_users_archive_months(history):
+    asyncio.run(order_archive.run())
+    orders = user_orders("user_1")
+    assert [o["order_id"] for o in orders] == ["ORD-NEW", "ORD-OLD-PENDING", "ORD-OLD-CANCELLED", "ORD-OLD"]
+    user = asyncio.run(history.users.find_one({"user_id": "user_1"}))
+    now = datetime.now(timezone.utc)
+    assert user["archived_order_months"] == sorted({(now - timedelta(days=d)).strftime("%Y_%m") for d in (500, 450)})
+
+
+def test_order_history_skips_the_archive_for_users_without_archived_orders(history, monkeypatch):
+    asyncio.run(order_archive.run())
+
+    async def no_scan(*args):
+        raise AssertionError("the archive was read")
+
+    monkeypatch.setattr(order_archive.store, "months", no_scan)
+    monkeypatch.setattr(order_archive.store, "find", no_scan)
+    assert [o["order_id"] for o in user_orders("user_2")] == ["ORD-OTHER"]
+
+
+def test_file_store_round_trip(history, monkeypatch, tmp_path):
+    monkeypatch.setattr(order_archive, "store", server.FileArchiveStore(tmp_path))
+    stored_days = []
+
+    async def fragments(zone, days):
+        # mongomock cannot group by day in a timezone; only check the days are stored before the move
+        stored_days.extend(days)
+
+    monkeypatch.setattr(server.sales_report_cache, "fragments", fragments)
+    asyncio.run(order_archive.run())
+    assert len(stored_days) == 2
+    assert list((tmp_path / "orders").glob("*.ndjson.gz"))
+    assert asyncio.run(order_archive.find_order("ORD-OLD"))["order_id"] == "ORD-OLD"
+    assert [o["order_id"] for o in user_orders("user_1")][-2:] == ["ORD-OLD-CANCELLED", "ORD-OLD"]
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import CartItem, CheckoutCreate, OrderStatus, PaymentStatus
+from tests.conftest import make_request
+
+
+def checkout(customer, *items, headers=None):
+    return asyncio.run(server.checkout(
+        CheckoutCreate(
+            items=[CartItem(product_id=p, plan_duration=d) for p, d in items],
+            customer_name="Customer", customer_email="c@example.com"
+        ),
+        make_request(headers), customer
+    ))
+
+
+def test_checkout_creates_one_order_per_item_and_one_payment(catalog, customer):
+    result = checkout(customer, ("basic", "monthly"), ("pro", "yearly"))
+    orders = asyncio.run(catalog.orders.find({"checkout_id": result["checkout_id"]}).to_list(None))
+    payments = asyncio.run(catalog.payments.find({}).to_list(None))
+    assert len(orders) == 2
+    assert {o["payment_status"] for o in orders} == {PaymentStatus.PENDING.value}
+    assert [p["order_id"] for p in payments] == [result["checkout_id"]]
+    # 99.99 + 14.00 tax and 1495.00 + 209.30 tax
+    assert result["amount"] == payments[0]["amount"] == 1818.29
+    assert sum(o["amount"] for o in orders) == pytest.approx(1818.29)
+    user = asyncio.run(catalog.users.find_one({"user_id": "user_1"}))
+    assert user["order_count"] == 2
+
+
+def test_paying_the_checkout_pays_every_order(catalog, customer):
+    result = checkout(customer, ("basic", "monthly"), ("pro", "yearly"))
+    completed = asyncio.run(server.mock_complete_payment(result["payment"]["payment_id"], customer))
+    assert len(completed["invoice_ids"]) == 2
+    orders = asyncio.run(catalog.orders.find({"checkout_id": result["checkout_id"]}).to_list(None))
+    assert {(o["status"], o["payment_status"]) for o in orders} == {(OrderStatus.COMPLETED.value, PaymentStatus.PAID.value)}
+
+
+def test_unknown_product_creates_nothing(catalog, customer):
+    with pytest.raises(HTTPException) as error:
+        checkout(customer, ("basic", "monthly"), ("gone", "monthly"))
+    assert error.value.status_code == 404
+    assert asyncio.run(catalog.orders.count_documents({})) == 0
+
+
+def test_order_of_a_checkout_with_a_live_payment_cannot_be_paid_alone(catalog, customer):
+    result = checkout(customer, ("basic", "monthly"), ("pro", "monthly"))
+    order_id = result["orders"][0].order_id
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.create_payment_session(order_id, make_request(), customer))
+    assert error.value.status_code == 409
+
+    # Once the checkout payment is gone the order can be paid on its own
+    asyncio.run(catalog.payments.update_many({}, {"$set": {"status": PaymentStatus.EXPIRED.value}}))
+    session = asyncio.run(server.create_payment_session(order_id, make_request(), customer))
+    assert session["order_id"] == order_id
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.create_payment_session(result["checkout_id"], make_request(), customer))
+    assert error.value.status_code == 409
+
+
+def test_other_customers_cannot_pay_the_checkout(catalog, customer):
+    result = checkout(customer, ("basic", "monthly"))
+    stranger = server.User(user_id="user_2", email="s@example.com", name="Stranger")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.create_payment_session(result["checkout_id"], make_request(), stranger))
+    assert error.value.status_code == 404
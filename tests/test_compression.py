@@ -0,0 +1,41 @@
+import gzip
+
+import brotli
+import pytest
+
+import server
+from server import compress_body, negotiate_encoding
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("GZIP;q=0.5", "gzip"),
+    ("br;q=oops, gzip", "gzip"),
+])
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+def test_brotli_is_skipped_when_not_installed(monkeypatch):
+    monkeypatch.setattr(server, "brotli", None)
+    assert negotiate_encoding("br, gzip") == "gzip"
+    assert negotiate_encoding("br") is None
+
+
+def test_compress_body_round_trips():
+    body = b'{"products": []}' * 200
+    assert gzip.decompress(compress_body(body, "gzip")) == body
+    assert brotli.decompress(compress_body(body, "br")) == body
+
+
+def test_gzip_output_is_deterministic():
+    # No timestamp in the header, so a cached payload matches a fresh one byte for byte
+    assert compress_body(b"catalog" * 100, "gzip") == compress_body(b"catalog" * 100, "gzip")
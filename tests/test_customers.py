@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from server import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor([1250.5, "user_9"])) == [1250.5, "user_9"]
+
+
+def test_datetime_cursor_values_are_iso_strings():
+    at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor([at, "user_1"])) == [at.isoformat(), "user_1"]
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor({"a": 1}), encode_cursor([1, 2, 3]), "e30="])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
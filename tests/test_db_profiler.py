@@ -0,0 +1,89 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import server
+from server import (
+    DbProfilerMiddleware, MongoCommandListener, RequestDbProfile, db_profile_var, explainable_command,
+    winning_plan_stages,
+)
+
+
+def run_command(listener, request_id, op, command, reply, duration_micros=1500):
+    listener.started(SimpleNamespace(request_id=request_id, command_name=op, command=command, database_name="igate"))
+    listener.succeeded(SimpleNamespace(request_id=request_id, command_name=op, duration_micros=duration_micros, reply=reply))
+
+
+def test_commands_are_recorded_on_the_active_profile():
+    listener = MongoCommandListener()
+    profile = RequestDbProfile(explain_sample=1)
+    token = db_profile_var.set(profile)
+    try:
+        run_command(listener, 1, "find", {"find": "orders", "filter": {"user_id": "u"}, "lsid": {}},
+                    {"cursor": {"firstBatch": [{}, {}]}})
+        run_command(listener, 2, "insert", {"insert": "orders", "documents": [{}]}, {"n": 1}, 500)
+    finally:
+        db_profile_var.reset(token)
+    run_command(listener, 3, "find", {"find": "products"}, {"cursor": {"firstBatch": []}})
+
+    assert [(c["op"], c["collection"], c["docs"]) for c in profile.commands] == [("find", "orders", 2), ("insert", "orders", 1)]
+    assert profile.total_ms == 2.0
+    # Only explainable commands are sampled, without session fields
+    assert [command for _, _, command in profile._explain_candidates] == [{"find": "orders", "filter": {"user_id": "u"}}]
+
+
+def test_server_timing_lists_each_command():
+    profile = RequestDbProfile()
+    profile.commands = [
+        {"op": "find", "collection": "orders", "duration_ms": 1.5, "docs": 2, "collscan": True},
+        {"op": "ping", "collection": None, "duration_ms": 0.5, "docs": None},
+    ]
+    assert profile.server_timing() == (
+        'db;dur=2.0;desc="2 commands", db1-find-orders;dur=1.5;desc="docs=2 COLLSCAN", '
+        'db2-ping-admin;dur=0.5;desc="docs=None"'
+    )
+    assert profile.summary()["collscans"] == 1
+
+
+def test_explainable_command():
+    assert explainable_command("aggregate", {"aggregate": "orders", "pipeline": [{"$merge": {"into": "x"}}]}) is None
+    assert explainable_command("update", {"update": "orders"}) is None
+    assert explainable_command("count", {"count": "orders", "query": {}, "lsid": 1}) == {"count": "orders", "query": {}}
+
+
+def test_winning_plan_stages_walk_nested_plans():
+    explain = [
+        {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}},
+        {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "COLLSCAN"}}}}}]},
+    ]
+    assert winning_plan_stages(explain) == ["FETCH", "IXSCAN", "COLLSCAN"]
+    assert winning_plan_stages({"ok": 1}) == []
+
+
+def test_middleware_adds_server_timing_and_wraps_json(monkeypatch):
+    monkeypatch.setattr(server, "DB_PROFILER_ENABLED", True)
+
+    async def explain(database, command, verbosity="queryPlanner"):
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+
+    monkeypatch.setattr(server, "explain_command", explain)
+
+    async def app(scope, receive, send):
+        run_command(server.mongo_command_listener, "req-1", "find", {"find": "orders", "filter": {}}, {"cursor": {"firstBatch": [{}]}})
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"ok": true}'})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"x-debug-db", b"json")]}
+    asyncio.run(DbProfilerMiddleware(app)(scope, None, send))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"server-timing"].startswith(b'db;dur=1.5;desc="1 commands", db1-find-orders')
+    assert b"COLLSCAN" in headers[b"server-timing"]
+    body = json.loads(sent[1]["body"])
+    assert body["data"] == {"ok": True}
+    assert body["db_profile"]["collscans"] == 1
+    assert int(headers[b"content-length"]) == len(sent[1]["body"])
@@ -0,0 +1,96 @@
+import asyncio
+import smtplib
+
+import pytest
+
+import server
+from server import EMAIL_MAX_ATTEMPTS, email_outbox
+
+
+@pytest.fixture
+def outbox(mongo, monkeypatch):
+    monkeypatch.setattr(server, "SMTP_HOST", "smtp.test")
+    return mongo.email_outbox
+
+
+def send_with(monkeypatch, *errors):
+    """Make the next batches fail with `errors`, one per queued message"""
+    monkeypatch.setattr(email_outbox, "_send_batch", lambda emails: list(errors[:len(emails)]))
+
+
+def enqueue(count=1):
+    asyncio.run(email_outbox.enqueue([
+        {"to": f"user{i}@example.com", "subject": "Invoice", "body": "Thanks"} for i in range(count)
+    ]))
+
+
+def rows(outbox):
+    return asyncio.run(outbox.find({}, {"_id": 0}).sort("to", 1).to_list(None))
+
+
+def test_nothing_is_queued_without_smtp_host(mongo, monkeypatch):
+    monkeypatch.setattr(server, "SMTP_HOST", "")
+    enqueue()
+    assert rows(mongo.email_outbox) == []
+
+
+def test_sent_messages_expire(outbox, monkeypatch):
+    enqueue()
+    send_with(monkeypatch, None)
+    assert asyncio.run(email_outbox.run()) == {"sent": 1, "retried": 0, "failed": 0}
+    [row] = rows(outbox)
+    assert row["status"] == "sent"
+    assert row["expires_at"] > row["sent_at"]
+
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPResponseException(451, b"Try again later"),
+    smtplib.SMTPServerDisconnected("Connection lost"),
+    ConnectionRefusedError(),
+    TimeoutError(),
+])
+def test_temporary_failures_are_retried_with_backoff(outbox, monkeypatch, error):
+    enqueue()
+    send_with(monkeypatch, error)
+    assert asyncio.run(email_outbox.run()) == {"sent": 0, "retried": 1, "failed": 0}
+    [row] = rows(outbox)
+    assert row["status"] == "pending"
+    assert row["attempts"] == 1
+    assert (row["next_attempt_at"] - row["created_at"]).total_seconds() >= server.EMAIL_RETRY_BASE_SECONDS
+
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPRecipientsRefused({"user0@example.com": (550, b"No such user")}),
+    smtplib.SMTPResponseException(552, b"Message too large"),
+    smtplib.SMTPSenderRefused(553, b"Sender rejected", "billing@igate-host.com"),
+])
+def test_permanent_failures_are_not_retried(outbox, monkeypatch, error):
+    enqueue()
+    send_with(monkeypatch, error)
+    assert asyncio.run(email_outbox.run()) == {"sent": 0, "retried": 0, "failed": 1}
+    [row] = rows(outbox)
+    assert row["status"] == "failed"
+    assert "expires_at" not in row
+
+
+def test_message_fails_after_max_attempts(outbox, monkeypatch):
+    enqueue()
+    send_with(monkeypatch, smtplib.SMTPResponseException(451, b"Try again later"))
+    asyncio.run(outbox.update_many({}, {"$set": {"attempts": EMAIL_MAX_ATTEMPTS - 1}}))
+    assert asyncio.run(email_outbox.run()) == {"sent": 0, "retried": 0, "failed": 1}
+    assert rows(outbox)[0]["attempts"] == EMAIL_MAX_ATTEMPTS
+
+
+def test_each_message_is_classified_on_its_own(outbox, monkeypatch):
+    enqueue(3)
+    send_with(monkeypatch, None, smtplib.SMTPResponseException(451, b"Busy"), smtplib.SMTPResponseException(550, b"No"))
+    assert asyncio.run(email_outbox.run()) == {"sent": 1, "retried": 1, "failed": 1}
+    assert [row["status"] for row in rows(outbox)] == ["sent", "pending", "failed"]
+
+
+def test_retried_message_is_not_due_again_straight_away(outbox, monkeypatch):
+    enqueue()
+    send_with(monkeypatch, smtplib.SMTPResponseException(451, b"Busy"))
+    asyncio.run(email_outbox.run())
+    send_with(monkeypatch, None)
+    assert asyncio.run(email_outbox.run()) == {"sent": 0, "retried": 0, "failed": 0}
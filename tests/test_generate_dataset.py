@@ -0,0 +1,67 @@
+import asyncio
+from argparse import Namespace
+from datetime import datetime, timezone
+
+import pytest
+
+import generate_dataset
+from generate_dataset import DatasetGenerator
+from server import OrderStatus, PaymentStatus
+
+PRODUCTS = [
+    {"product_id": "basic", "name_ar": "أساسي", "name_en": "Basic", "price_monthly": 99.99, "price_yearly": 999.99},
+    {"product_id": "pro", "name_ar": "احترافي", "name_en": "Pro", "price_monthly": 149.5, "price_yearly": 1495,
+     "is_popular": True},
+]
+
+
+def arguments(seed=42, orders=400):
+    return Namespace(seed=seed, orders=orders, users=100, contacts=20, days=365,
+                     end=datetime(2026, 1, 1, tzinfo=timezone.utc), batch_size=150, concurrency=2)
+
+
+@pytest.fixture
+def dataset_db(mongo, monkeypatch):
+    monkeypatch.setattr(generate_dataset, "db", mongo)
+    return mongo
+
+
+def test_output_is_a_function_of_the_seed():
+    chunk = DatasetGenerator(arguments(), PRODUCTS).orders_chunk(0, 0, 100)
+    again = DatasetGenerator(arguments(), list(reversed(PRODUCTS))).orders_chunk(0, 0, 100)
+    other = DatasetGenerator(arguments(seed=7), PRODUCTS).orders_chunk(0, 0, 100)
+    assert chunk == again
+    assert [o["order_id"] for o in other["orders"]] != [o["order_id"] for o in chunk["orders"]]
+
+
+def test_orders_follow_their_outcome():
+    docs = DatasetGenerator(arguments(), PRODUCTS).orders_chunk(0, 0, 400)
+    payments = {p["order_id"]: p for p in docs["payments"]}
+    invoiced = {i["order_id"] for i in docs["invoices"]}
+    outcomes = set()
+    for order in docs["orders"]:
+        outcome = (order["status"], order["payment_status"])
+        outcomes.add(outcome)
+        assert outcome in {
+            (OrderStatus.COMPLETED, PaymentStatus.PAID),
+            (OrderStatus.CANCELLED, PaymentStatus.FAILED),
+            (OrderStatus.CANCELLED, PaymentStatus.EXPIRED),
+            (OrderStatus.PENDING, PaymentStatus.PENDING),
+        }
+        assert payments[order["order_id"]]["status"] == order["payment_status"]
+        assert (order["order_id"] in invoiced) == (order["payment_status"] == PaymentStatus.PAID)
+        assert order["synthetic"] is True
+    # Abandoned checkouts look like the sweeper already handled them
+    assert (OrderStatus.CANCELLED, PaymentStatus.EXPIRED) in outcomes
+
+
+def test_run_writes_every_collection_and_purge_removes_it(dataset_db):
+    asyncio.run(dataset_db.users.insert_one({"user_id": "real"}))
+    counts = asyncio.run(DatasetGenerator(arguments(), PRODUCTS).run())
+    assert (counts["users"], counts["orders"], counts["payments"], counts["contact_messages"]) == (100, 400, 400, 20)
+    assert asyncio.run(dataset_db.orders.count_documents({})) == 400
+    assert len(set(asyncio.run(dataset_db.orders.distinct("order_id")))) == 400
+
+    removed = asyncio.run(generate_dataset.purge())
+    assert removed["users"] == 100 and removed["orders"] == 400
+    assert asyncio.run(dataset_db.users.distinct("user_id")) == ["real"]
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from server import (
+    SORTABLE_ID_LENGTH, SortableIdGenerator, encode_sortable_id, ensure_unique_id_index, id_query, id_timestamp,
+    is_sortable_id, new_id,
+)
+
+
+def test_ids_are_strictly_increasing():
+    ids = [new_id("ORD") for _ in range(5000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_ids_within_one_millisecond_increment(monkeypatch):
+    monkeypatch.setattr(server.time, "time_ns", lambda: 1_700_000_000_000 * 1_000_000)
+    generator = SortableIdGenerator()
+    ids = [generator.new("PAY") for _ in range(100)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 100
+    assert {id_timestamp(i) for i in ids} == {datetime.fromtimestamp(1_700_000_000, tz=timezone.utc)}
+
+
+def test_exhausted_random_part_borrows_the_next_millisecond(monkeypatch):
+    monkeypatch.setattr(server.time, "time_ns", lambda: 1_700_000_000_000 * 1_000_000)
+    generator = SortableIdGenerator()
+    first = generator.new("ORD")
+    generator._last_random = (1 << 80) - 1
+    second = generator.new("ORD")
+    assert first < second
+    assert (id_timestamp(second) - id_timestamp(first)).total_seconds() == pytest.approx(0.001)
+
+
+def test_ids_sort_by_timestamp_across_milliseconds():
+    earlier = encode_sortable_id("ORD", 1_000, (1 << 80) - 1)
+    later = encode_sortable_id("ORD", 1_001, 0)
+    assert earlier < later
+
+
+def test_id_format():
+    value = new_id("INV")
+    prefix, _, suffix = value.partition("-")
+    assert prefix == "INV"
+    assert len(suffix) == SORTABLE_ID_LENGTH
+    assert is_sortable_id(value)
+
+
+@pytest.mark.parametrize("value", [
+    "ORD-12345678", "ORD-", "order_abc123", "ORD-01HZX3K7Q8Y2V5N4M6P9R0S1TI", "ORD-01hzx3k7q8y2v5n4m6p9r0s1t2",
+])
+def test_legacy_ids_are_not_sortable(value):
+    assert not is_sortable_id(value)
+    assert id_timestamp(value) is None
+
+
+def test_id_query_also_matches_legacy_ids():
+    sortable = new_id("ORD")
+    assert id_query("order_id", sortable) == {"order_id": sortable}
+    assert id_query("order_id", "ORD-1") == {"$or": [{"order_id": "ORD-1"}, {"legacy_id": "ORD-1"}]}
+
+
+def test_duplicate_ids_are_re_keyed_oldest_first(mongo):
+    async def scenario():
+        await mongo.orders.insert_many([
+            {"order_id": "ORD-1", "created_at": "2024-01-02", "n": 2},
+            {"order_id": "ORD-1", "created_at": "2024-01-01", "n": 1},
+            {"order_id": "ORD-2", "created_at": "2024-01-01", "n": 3},
+        ])
+        await ensure_unique_id_index(mongo.orders, "order_id", "ORD", [(mongo.payments, "order_id")])
+        return await mongo.orders.find({}, {"_id": 0}).sort("n", 1).to_list(None), await mongo.orders.index_information()
+
+    orders, indexes = asyncio.run(scenario())
+    assert orders[0]["order_id"] == "ORD-1" and "legacy_id" not in orders[0]
+    assert is_sortable_id(orders[1]["order_id"]) and orders[1]["legacy_id"] == "ORD-1"
+    assert orders[2]["order_id"] == "ORD-2"
+    assert indexes["order_id_1"]["unique"]
+
+
+def test_referenced_duplicates_are_left_alone(mongo):
+    async def scenario():
+        await mongo.orders.insert_many([
+            {"order_id": "ORD-1", "created_at": "2024-01-01"},
+            {"order_id": "ORD-1", "created_at": "2024-01-02"},
+        ])
+        await mongo.payments.insert_one({"payment_id": "PAY-1", "order_id": "ORD-1"})
+        await ensure_unique_id_index(mongo.orders, "order_id", "ORD", [(mongo.payments, "order_id")])
+        return await mongo.orders.distinct("order_id"), await mongo.orders.index_information()
+
+    order_ids, indexes = asyncio.run(scenario())
+    assert order_ids == ["ORD-1"]
+    assert not indexes["order_id_1"].get("unique")
@@ -0,0 +1,25 @@
+import pytest
+
+from server import negotiate_language
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, "ar"),
+    ("", "ar"),
+    ("en", "en"),
+    ("en-US,en;q=0.9", "en"),
+    ("ar-EG", "ar"),
+    ("fr-FR,fr;q=0.9", "ar"),
+    ("fr-FR,en;q=0.5", "en"),
+    ("en;q=0.4,ar;q=0.8", "ar"),
+    ("ar;q=0.3, EN;q=0.7", "en"),
+    ("en;q=bogus,ar;q=0.2", "ar"),
+    ("en;q=0", "ar"),
+])
+def test_negotiate_language(header, expected):
+    assert negotiate_language(header) == expected
+
+
+def test_first_language_wins_a_tie():
+    assert negotiate_language("en,ar") == "en"
+    assert negotiate_language("ar,en") == "ar"
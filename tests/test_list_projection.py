@@ -0,0 +1,52 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from server import LIST_VIEWS, ListProjection, Order, Product, list_projection
+
+
+def resolve(model, fields=None, view=None):
+    return asyncio.run(list_projection(model)(fields=fields, view=view))
+
+
+def test_no_selection_reads_and_returns_whole_documents():
+    projection = resolve(Order)
+    assert projection.fields is None
+    assert projection.mongo == {"_id": 0}
+    docs = [{"order_id": "ORD-1", "amount": 10}]
+    assert projection.response(docs) is docs
+
+
+def test_fields_are_kept_in_model_order():
+    projection = resolve(Order, fields="status, order_id,,amount")
+    assert projection.fields == ("order_id", "amount", "status")
+    assert projection.mongo == {"_id": 0, "order_id": 1, "amount": 1, "status": 1}
+
+
+def test_view_and_fields_combine():
+    projection = resolve(Product, fields="features", view="summary")
+    assert set(projection.fields) == set(LIST_VIEWS[Product]["summary"]) | {"features"}
+
+
+@pytest.mark.parametrize("fields, view, detail", [
+    ("order_id,password_hash", None, "Unknown field: password_hash"),
+    (None, "everything", "Unknown view: everything"),
+])
+def test_unknown_selection_is_rejected(fields, view, detail):
+    with pytest.raises(HTTPException) as error:
+        resolve(Order, fields=fields, view=view)
+    assert (error.value.status_code, error.value.detail) == (400, detail)
+
+
+def test_response_contains_only_the_selected_fields():
+    projection = ListProjection(Order, ("order_id", "created_at"))
+    created_at = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    response = projection.response([{"order_id": "ORD-1", "created_at": created_at, "amount": 10}, {"order_id": "ORD-2"}])
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == [
+        {"order_id": "ORD-1", "created_at": "2024-05-01T00:00:00Z"},
+        {"order_id": "ORD-2", "created_at": None},
+    ]
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import AutoReconnect
+
+from server import OrderEventLog
+
+
+class FlakyCollection:
+    """Fails the first insert_many after the driver has stamped the _ids, like a dropped connection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.failures = 1
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection closed")
+        return await self.collection.insert_many(docs, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_flush_writes_buffered_events_in_batches(mongo):
+    log = OrderEventLog(mongo.order_events, batch_size=2, flush_interval_ms=1000)
+    for event in ("order_created", "payment_created", "payment_paid"):
+        log.record("ORD-1", event)
+    assert log._wake.is_set()
+    asyncio.run(log.flush())
+    assert log.written == 3 and not log.buffer
+    assert asyncio.run(mongo.order_events.count_documents({"order_id": "ORD-1"})) == 3
+
+
+def test_timeline_merges_stored_and_buffered_events_in_order(mongo):
+    log = OrderEventLog(mongo.order_events, batch_size=10, flush_interval_ms=1000)
+    log.record("ORD-1", "order_created")
+    log.record("CHK-1", "payment_created", payment_id="PAY-1")
+    asyncio.run(log.flush())
+    log.record("ORD-1", "payment_paid")
+    log.record("ORD-2", "order_created")
+    timeline = asyncio.run(log.timeline(["ORD-1", "CHK-1"]))
+    assert [(e["order_id"], e["event"]) for e in timeline] == [
+        ("ORD-1", "order_created"), ("CHK-1", "payment_created"), ("ORD-1", "payment_paid")
+    ]
+
+
+def test_events_put_back_after_a_failed_write_are_served_and_written_once(mongo):
+    log = OrderEventLog(FlakyCollection(mongo.order_events), batch_size=10, flush_interval_ms=1000)
+    log.record("ORD-1", "order_created")
+    asyncio.run(log.flush())
+    assert len(log.buffer) == 1 and log.written == 0
+
+    timeline = asyncio.run(log.timeline(["ORD-1"]))
+    assert "_id" not in timeline[0]
+    json.dumps(jsonable_encoder(timeline))
+
+    asyncio.run(log.flush())
+    asyncio.run(log.flush())
+    assert log.written == 1
+    assert asyncio.run(mongo.order_events.count_documents({})) == 1
+
+
+def test_full_buffer_drops_the_oldest_events(mongo):
+    log = OrderEventLog(mongo.order_events, batch_size=100, flush_interval_ms=1000, max_buffer=2)
+    for event in ("a", "b", "c"):
+        log.record("ORD-1", event)
+    assert log.dropped == 1
+    assert [e["event"] for e in log.buffer] == ["b", "c"]
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import Order, PaymentStatus
+from tests.conftest import make_request
+
+
+@pytest.fixture
+def pending_order(mongo):
+    order = Order(
+        order_id="ORD-1", user_id="user_1", product_id="basic", product_name="Basic", plan_duration="monthly",
+        amount=113.99, customer_name="Customer", customer_email="c@example.com"
+    ).model_dump()
+    asyncio.run(mongo.orders.insert_one(order))
+    return mongo
+
+
+class FakeResponse:
+    def __init__(self, session_id):
+        self.status = 200
+        self.session_id = session_id
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return {"status": True, "id": self.session_id, "redirect_url": f"https://pay.example/{self.session_id}"}
+
+
+class FakeKashier:
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, url, json, headers):
+        self.calls += 1
+        return FakeResponse(f"SES-{self.calls}")
+
+
+@pytest.fixture
+def kashier(monkeypatch):
+    fake = FakeKashier()
+    monkeypatch.setattr(server, "kashier_http", lambda: fake)
+    monkeypatch.setattr(server, "KASHIER_MERCHANT_ID", "MID-1")
+    monkeypatch.setattr(server, "KASHIER_API_KEY", "secret")
+    return fake
+
+
+def open_session(customer, key=None):
+    headers = {"Idempotency-Key": key} if key else None
+    return asyncio.run(server.create_payment_session("ORD-1", make_request(headers), customer))
+
+
+def pending_payments(mongo):
+    return asyncio.run(mongo.payments.count_documents({"status": PaymentStatus.PENDING.value}))
+
+
+def test_same_idempotency_key_replays_the_payment(pending_order, customer):
+    first = open_session(customer, "key-1")
+    replay = open_session(customer, "key-1")
+    assert first["reused"] is False and replay["reused"] is True
+    assert replay["payment_id"] == first["payment_id"]
+    assert pending_payments(pending_order) == 1
+
+
+def test_new_idempotency_key_opens_a_new_payment(pending_order, customer):
+    first = open_session(customer, "key-1")
+    second = open_session(customer, "key-2")
+    assert second["payment_id"] != first["payment_id"]
+    assert pending_payments(pending_order) == 2
+
+
+def test_without_a_key_the_amount_is_the_key(pending_order, customer):
+    first = open_session(customer)
+    assert open_session(customer)["payment_id"] == first["payment_id"]
+    payment = asyncio.run(pending_order.payments.find_one({"payment_id": first["payment_id"]}))
+    assert payment["idempotency_key"] == "ORD-1:11399:EGP"
+
+
+def test_replay_returns_the_open_kashier_session(pending_order, customer, kashier):
+    first = open_session(customer, "key-1")
+    replay = open_session(customer, "key-1")
+    assert kashier.calls == 1
+    assert replay["reused"] is True
+    assert replay["payment_url"] == first["payment_url"] == "https://pay.example/SES-1"
+
+
+def test_expired_kashier_session_is_retired_and_replaced(pending_order, customer, kashier):
+    first = open_session(customer, "key-1")
+    asyncio.run(pending_order.payments.update_one(
+        {"payment_id": first["payment_id"]},
+        {"$set": {"session_expires_at": datetime.now(timezone.utc) - timedelta(minutes=1)}}
+    ))
+    second = open_session(customer, "key-1")
+    assert kashier.calls == 2
+    assert second["reused"] is False and second["payment_id"] != first["payment_id"]
+    assert second["payment_url"] == "https://pay.example/SES-2"
+    retired = asyncio.run(pending_order.payments.find_one({"payment_id": first["payment_id"]}))
+    assert retired["status"] == PaymentStatus.EXPIRED.value
+    assert pending_payments(pending_order) == 1
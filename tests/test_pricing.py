@@ -0,0 +1,74 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from server import CartItem, PricingSnapshot, from_minor, to_minor
+
+PRODUCTS = [
+    {"product_id": "basic", "price_monthly": 99.99, "price_yearly": 999.99},
+    {"product_id": "pro", "price_monthly": 0.05, "price_yearly": 10.10},
+]
+
+
+@pytest.mark.parametrize("value, expected", [
+    (199.99, 19999), ("0.1", 10), (0.005, 1), (0.004, 0), (1.005, 101), (2.675, 268), (0, 0), (10, 1000),
+])
+def test_to_minor_rounds_half_up_from_the_decimal_value(value, expected):
+    assert to_minor(value) == expected
+
+
+def test_minor_units_round_trip():
+    for minor in (0, 1, 99, 19999, 123456789):
+        assert to_minor(from_minor(minor)) == minor
+
+
+def snapshot(tax_percentage=14, enabled=True):
+    return PricingSnapshot(PRODUCTS, {"tax_enabled": enabled, "tax_percentage": tax_percentage})
+
+
+def test_line_tax_is_rounded_half_up_in_minor_units():
+    line = snapshot().line("basic", "monthly")
+    # 9999 * 14% = 1399.86
+    assert (line.subtotal_minor, line.tax_minor, line.total_minor) == (9999, 1400, 11399)
+    # 5 * 14% = 0.7, 1010 * 14% = 141.4
+    assert snapshot().line("pro", "monthly").tax_minor == 1
+    assert snapshot().line("pro", "yearly").tax_minor == 141
+
+
+def test_exact_half_rounds_up():
+    # 5 * 10% = 0.5 piastre
+    assert snapshot(tax_percentage=10).line("pro", "monthly").tax_minor == 1
+
+
+def test_fractional_tax_rate():
+    line = snapshot(tax_percentage=14.25).line("basic", "yearly")
+    assert line.tax_minor == int((Decimal(99999) * Decimal("0.1425")).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def test_disabled_tax_charges_nothing():
+    line = snapshot(enabled=False).line("basic", "yearly")
+    assert (line.tax_minor, line.total_minor) == (0, 99999)
+    assert PricingSnapshot(PRODUCTS, None).tax_percentage == 0.0
+
+
+def test_quote_totals_are_the_sum_of_their_lines():
+    items = [CartItem(product_id=p, plan_duration=d) for p in ("basic", "pro") for d in ("monthly", "yearly")] * 3
+    quote = snapshot().quote(items)
+    assert quote.subtotal_minor == sum(line.subtotal_minor for line in quote.lines)
+    assert quote.tax_minor == sum(line.tax_minor for line in quote.lines)
+    assert quote.total_minor == quote.subtotal_minor + quote.tax_minor
+    assert quote.tax_percentage == 14.0
+
+
+def test_order_fields_are_in_major_units():
+    fields = snapshot().line("basic", "monthly").order_fields(14.0)
+    assert fields == {"amount": 113.99, "subtotal": 99.99, "tax": 14.0, "tax_percentage": 14.0}
+
+
+def test_unknown_products_are_listed_once():
+    items = [CartItem(product_id="gone", plan_duration="monthly")] * 2 + [CartItem(product_id="basic", plan_duration="monthly")]
+    with pytest.raises(HTTPException) as error:
+        snapshot().quote(items)
+    assert error.value.status_code == 404
+    assert error.value.detail == "Product not found: gone"
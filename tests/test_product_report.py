@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import server
+from server import PaymentStatus, ProductCategory, day_bounds, order_archive, product_mix
+from tests.test_sales_report import NEW_DAY, OLD_DAY, TODAY, order
+
+
+@pytest.fixture
+def product_sales(catalog):
+    """Basic sold yearly (archived) and monthly, pro sold monthly, one basic order unpaid"""
+    async def seed():
+        await catalog.orders.insert_many([
+            order("ORD-OLD", OLD_DAY, amount=999.99, plan_duration="yearly"),
+            order("ORD-BASIC", NEW_DAY, amount=99.99),
+            order("ORD-PRO", NEW_DAY, amount=149.5, product_id="pro"),
+            order("ORD-PENDING", NEW_DAY, PaymentStatus.PENDING, amount=99.99),
+        ])
+        assert (await order_archive.run())["orders"] == 1
+    asyncio.run(seed())
+    return catalog
+
+
+def product_report():
+    return asyncio.run(server.get_product_report(OLD_DAY.isoformat(), TODAY.isoformat(), "Africa/Cairo"))
+
+
+def test_product_mix_totals_rows():
+    rows = [
+        {"paid_orders": 2, "revenue": 199.98, "monthly_orders": 2, "yearly_orders": 0},
+        {"paid_orders": 1, "revenue": 999.99, "monthly_orders": 0, "yearly_orders": 1},
+    ]
+    assert product_mix(rows) == {
+        "paid_orders": 3, "revenue": 1199.97, "monthly_orders": 2, "yearly_orders": 1,
+        "average_order_value": 399.99, "yearly_share": 0.3333
+    }
+    assert product_mix([]) == {
+        "paid_orders": 0, "revenue": 0, "monthly_orders": 0, "yearly_orders": 0,
+        "average_order_value": 0, "yearly_share": 0
+    }
+
+
+def test_products_include_archived_sales(product_sales):
+    report = product_report()
+    basic, pro = report["products"]
+    assert (basic["product_id"], basic["name_en"], basic["category"]) == ("basic", "basic en", ProductCategory.HOSTING.value)
+    assert (basic["paid_orders"], basic["revenue"], basic["monthly_orders"], basic["yearly_orders"]) == (2, 1099.98, 1, 1)
+    assert basic["average_order_value"] == 549.99
+    assert (pro["product_id"], pro["paid_orders"], pro["revenue"]) == ("pro", 1, 149.5)
+    category, = report["categories"]
+    assert (category["category"], category["paid_orders"], category["revenue"]) == (ProductCategory.HOSTING.value, 3, 1249.48)
+    assert report["totals"]["paid_orders"] == 3
+
+
+def test_products_missing_from_the_catalog_are_still_reported(product_sales):
+    asyncio.run(product_sales.products.delete_one({"product_id": "pro"}))
+    pro = next(p for p in product_report()["products"] if p["product_id"] == "pro")
+    assert (pro["name_en"], pro["category"], pro["revenue"]) == (None, None, 149.5)
+
+
+def test_fragments_without_a_product_breakdown_are_rebuilt(product_sales):
+    zone = server.ZoneInfo("Africa/Cairo")
+    start, end = day_bounds(NEW_DAY, zone)
+    asyncio.run(product_sales.sales_report_days.insert_one({
+        "_id": f"{zone.key}:{NEW_DAY.isoformat()}", "date": NEW_DAY.isoformat(), "timezone": zone.key,
+        "start": start, "end": end, "orders_count": 0, "paid_orders": 0, "pending_orders": 0,
+        "total_sales": 0, "invoices_count": 0
+    }))
+    assert product_report()["totals"]["paid_orders"] == 3
+    stored = asyncio.run(product_sales.sales_report_days.find_one({"date": NEW_DAY.isoformat()}))
+    assert [p["product_id"] for p in sorted(stored["products"], key=lambda p: p["product_id"])] == ["basic", "pro"]
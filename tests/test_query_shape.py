@@ -0,0 +1,52 @@
+from bson import SON
+
+from server import _find_key, query_shape
+
+
+def test_literals_are_replaced_but_fields_and_operators_kept():
+    command = {"find": "orders", "filter": {"user_id": "user_1", "created_at": {"$gte": "2024-01-01"}}}
+    assert query_shape(command) == {"filter": {"user_id": "?", "created_at": {"$gte": "?"}}}
+
+
+def test_queries_differing_only_in_values_share_a_shape():
+    first = {"find": "orders", "filter": {"order_id": {"$in": ["ORD-1", "ORD-2"]}, "status": "paid"}}
+    second = {"find": "orders", "filter": {"order_id": {"$in": ["ORD-3"]}, "status": "pending"}}
+    assert query_shape(first) == query_shape(second) == {"filter": {"order_id": {"$in": ["?"]}, "status": "?"}}
+
+
+def test_nested_documents_in_lists_keep_their_shape():
+    command = {"find": "payments", "filter": {"$or": [{"order_id": "A"}, {"legacy_id": "A"}]}}
+    assert query_shape(command) == {"filter": {"$or": [{"order_id": "?"}, {"legacy_id": "?"}]}}
+
+
+def test_pipeline_sort_and_projection():
+    command = SON([
+        ("aggregate", "orders"),
+        ("pipeline", [{"$match": {"payment_status": "paid"}}, {"$group": {"_id": "$user_id", "n": {"$sum": 1}}}]),
+        ("sort", SON([("created_at", -1)])),
+        ("projection", {"_id": 0}),
+    ])
+    assert query_shape(command) == {
+        "pipeline": [{"$match": {"payment_status": "?"}}, {"$group": {"_id": "?", "n": {"$sum": "?"}}}],
+        "sort": {"created_at": -1},
+        "projection": {"_id": 0},
+    }
+
+
+def test_write_commands_use_the_first_statement():
+    command = {"update": "orders", "updates": [{"q": {"order_id": "A"}, "u": {"$set": {"status": "x"}}}, {"q": {"other": 1}}]}
+    assert query_shape(command) == {"q": {"order_id": "?"}}
+    assert query_shape({"delete": "sessions", "deletes": [{"q": {"expires_at": {"$lt": 5}}}]}) == {"q": {"expires_at": {"$lt": "?"}}}
+
+
+def test_commands_without_a_query_have_an_empty_shape():
+    assert query_shape({"insert": "orders", "documents": [{"a": 1}]}) == {}
+    assert query_shape({"update": "orders", "updates": []}) == {}
+
+
+def test_find_key_searches_nested_explain_output():
+    explain = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}},
+               "stages": [{"$cursor": {"executionStats": {"totalDocsExamined": 12}}}]}
+    assert _find_key(explain, "totalDocsExamined") == 12
+    assert _find_key(explain, "stage") == "FETCH"
+    assert _find_key(explain, "missing") is None
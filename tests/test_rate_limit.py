@@ -0,0 +1,105 @@
+import asyncio
+import ipaddress
+
+import pytest
+from starlette.requests import Request
+
+import server
+from server import LocalRateLimitBackend, client_ip
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+def consume(backend, key, capacity=3, refill_per_second=1.0):
+    return asyncio.run(backend.consume(key, capacity, refill_per_second))
+
+
+def test_bucket_allows_its_capacity_then_reports_wait(clock):
+    backend = LocalRateLimitBackend()
+    assert [consume(backend, "ip:a") for _ in range(3)] == [0, 0, 0]
+    assert consume(backend, "ip:a") == pytest.approx(1.0)
+
+
+def test_bucket_refills_over_time(clock):
+    backend = LocalRateLimitBackend()
+    for _ in range(3):
+        consume(backend, "ip:a")
+    clock.now += 0.5
+    assert consume(backend, "ip:a") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert consume(backend, "ip:a") == 0
+
+
+def test_refill_is_capped_at_capacity(clock):
+    backend = LocalRateLimitBackend()
+    consume(backend, "ip:a")
+    clock.now += 3600
+    assert [consume(backend, "ip:a") for _ in range(3)] == [0, 0, 0]
+    assert consume(backend, "ip:a") > 0
+
+
+def test_keys_have_separate_buckets(clock):
+    backend = LocalRateLimitBackend()
+    for _ in range(3):
+        consume(backend, "ip:a")
+    assert consume(backend, "ip:a") > 0
+    assert consume(backend, "ip:b") == 0
+
+
+def test_least_recently_used_key_is_evicted(clock):
+    backend = LocalRateLimitBackend(max_keys=2)
+    for _ in range(3):
+        consume(backend, "ip:a")
+    consume(backend, "ip:b")
+    consume(backend, "ip:a")  # a is now the most recent
+    consume(backend, "ip:c")
+    assert list(backend._buckets) == ["ip:a", "ip:c"]
+    # a kept its empty bucket, b starts afresh
+    assert consume(backend, "ip:a") > 0
+    assert consume(backend, "ip:b") == 0
+
+
+def make_request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+@pytest.fixture
+def trust_forwarded(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUST_FORWARDED", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUSTED_PROXIES", [
+        ipaddress.ip_network("127.0.0.1"), ipaddress.ip_network("10.0.0.0/8")
+    ])
+
+
+def test_forwarded_header_is_ignored_by_default(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_TRUST_FORWARDED", False)
+    assert client_ip(make_request("203.0.113.9", "198.51.100.1")) == "203.0.113.9"
+
+
+@pytest.mark.parametrize("peer, forwarded, expected", [
+    ("127.0.0.1", "198.51.100.1", "198.51.100.1"),
+    # The client wrote the left-most entry itself
+    ("127.0.0.1", "1.2.3.4, 198.51.100.1", "198.51.100.1"),
+    ("127.0.0.1", "1.2.3.4, 198.51.100.1, 10.0.0.5", "198.51.100.1"),
+    # An untrusted peer is the client, whatever it claims
+    ("203.0.113.9", "198.51.100.1", "203.0.113.9"),
+    ("127.0.0.1", None, "127.0.0.1"),
+    ("127.0.0.1", "10.0.0.7, 10.0.0.5", "10.0.0.7"),
+    ("127.0.0.1", "not-an-ip, 10.0.0.5", "not-an-ip"),
+])
+def test_client_ip_uses_right_most_untrusted_hop(trust_forwarded, peer, forwarded, expected):
+    assert client_ip(make_request(peer, forwarded)) == expected
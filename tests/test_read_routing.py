@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.read_preferences import Primary
+
+import server
+from server import read_preference
+
+
+def test_read_preference_modes():
+    assert read_preference("primary", 120) == Primary()
+    preference = read_preference("secondaryPreferred", 120)
+    assert (preference.mongos_mode, preference.max_staleness) == ("secondaryPreferred", 120)
+    assert read_preference("nearest").max_staleness == -1
+
+
+def test_max_staleness_is_raised_to_the_server_minimum():
+    assert read_preference("secondary", 30).max_staleness == 90
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(KeyError):
+        read_preference("fastest", 120)
+
+
+def test_reporting_database_uses_the_configured_preference_and_db_the_primary():
+    assert server.db.read_preference == Primary()
+    assert server.reporting_db.read_preference == read_preference(
+        server.REPORTING_READ_PREFERENCE, server.REPORTING_MAX_STALENESS_SECONDS
+    )
+    assert server.reporting_db.name == server.db.name
+
+
+def test_admin_stats_come_from_the_reporting_database(mongo, monkeypatch):
+    secondary = AsyncMongoMockClient()["secondary"]
+    monkeypatch.setattr(server, "reporting_db", secondary)
+
+    async def scenario():
+        await mongo.orders.insert_one({"order_id": "ORD-NEW", "payment_status": "paid", "amount": 50})
+        await secondary.orders.insert_many([
+            {"order_id": "ORD-1", "payment_status": "paid", "amount": 100},
+            {"order_id": "ORD-2", "payment_status": "pending", "amount": 70},
+        ])
+        return await server.compute_admin_stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["total_orders"], stats["paid_orders"], stats["total_revenue"]) == (2, 1, 100)
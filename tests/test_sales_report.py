@@ -0,0 +1,109 @@
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import Invoice, Order, OrderStatus, PaymentStatus, order_archive, report_days, sales_report_cache
+
+TODAY = datetime.now(timezone.utc).date()
+OLD_DAY = TODAY - timedelta(days=500)
+NEW_DAY = TODAY - timedelta(days=10)
+
+
+def at_noon(day):
+    return datetime.combine(day, time(12), tzinfo=timezone.utc)
+
+
+def order(order_id, day, payment_status=PaymentStatus.PAID, amount=100, product_id="basic", plan_duration="monthly"):
+    status = {PaymentStatus.PAID: OrderStatus.COMPLETED, PaymentStatus.PENDING: OrderStatus.PENDING}[payment_status]
+    return Order(
+        order_id=order_id, user_id="user_1", product_id=product_id, product_name=product_id,
+        plan_duration=plan_duration, amount=amount, status=status, payment_status=payment_status,
+        customer_name="Customer", customer_email="c@example.com", created_at=at_noon(day)
+    ).model_dump()
+
+
+def invoice(order_id, day, amount):
+    return Invoice(
+        invoice_number=f"IG-{order_id}", order_id=order_id, user_id="user_1", payment_id=f"PAY-{order_id}",
+        customer_name="Customer", customer_email="c@example.com", product_name="basic", plan_duration="monthly",
+        subtotal=amount, total=amount, created_at=at_noon(day)
+    ).model_dump()
+
+
+@pytest.fixture
+def sales(catalog):
+    """A paid order moved to the archive, and a paid and a pending one still live"""
+    async def seed():
+        await catalog.orders.insert_many([
+            order("ORD-OLD", OLD_DAY, amount=999.99, plan_duration="yearly"),
+            order("ORD-NEW", NEW_DAY, amount=149.5, product_id="pro"),
+            order("ORD-PENDING", NEW_DAY, PaymentStatus.PENDING),
+        ])
+        await catalog.invoices.insert_many([invoice("ORD-OLD", OLD_DAY, 999.99), invoice("ORD-NEW", NEW_DAY, 149.5)])
+        assert (await order_archive.run())["orders"] == 1
+    asyncio.run(seed())
+    return catalog
+
+
+def sales_report(from_day=OLD_DAY, to_day=TODAY):
+    return asyncio.run(server.get_sales_report(from_day.isoformat(), to_day.isoformat(), "Africa/Cairo"))
+
+
+def test_report_counts_live_and_archived_orders(sales):
+    report = sales_report()
+    assert (report["orders_count"], report["paid_orders"], report["pending_orders"]) == (3, 2, 1)
+    assert report["total_sales"] == pytest.approx(1149.49)
+    assert report["invoices_count"] == 2
+    assert report["average_order_value"] == 574.75
+    assert [(d["date"], d["orders"]) for d in report["daily_breakdown"]] == [
+        (NEW_DAY.isoformat(), 1), (OLD_DAY.isoformat(), 1)
+    ]
+
+
+def test_archived_days_have_their_fragment(sales):
+    fragment, = asyncio.run(sales_report_cache.fragments(server.ZoneInfo("Africa/Cairo"), [OLD_DAY]))
+    assert (fragment["orders_count"], fragment["paid_orders"], fragment["total_sales"]) == (1, 1, 999.99)
+    assert fragment["products"] == [
+        {"product_id": "basic", "paid_orders": 1, "revenue": 999.99, "monthly_orders": 0, "yearly_orders": 1}
+    ]
+
+
+def test_closed_days_are_stored_and_reused_until_invalidated(sales):
+    sales_report()
+    stored = asyncio.run(sales.sales_report_days.distinct("date"))
+    assert len(stored) == (TODAY - OLD_DAY).days  # every day but the open one
+    assert TODAY.isoformat() not in stored
+
+    asyncio.run(sales.orders.update_one({"order_id": "ORD-PENDING"}, {"$set": {"payment_status": PaymentStatus.PAID.value}}))
+    assert sales_report()["paid_orders"] == 2
+
+    asyncio.run(sales_report_cache.invalidate([at_noon(NEW_DAY)]))
+    assert sales_report()["paid_orders"] == 3
+    assert len(asyncio.run(sales.sales_report_days.distinct("date"))) == len(stored)
+
+
+def test_open_day_is_always_aggregated(sales):
+    assert sales_report(TODAY, TODAY)["orders_count"] == 0
+    asyncio.run(sales.orders.insert_one(order("ORD-TODAY", TODAY, amount=50)))
+    assert sales_report(TODAY, TODAY)["orders_count"] == 1
+
+
+def test_report_days_are_calendar_days_in_the_zone():
+    zone, days = report_days("2026-03-01T23:30:00Z", "2026-03-03T12:00:00Z", "Africa/Cairo")
+    assert zone.key == "Africa/Cairo"
+    assert days == [date(2026, 3, 2), date(2026, 3, 3)]
+
+
+@pytest.mark.parametrize("from_date, to_date, tz", [
+    ("2026-03-03", "2026-03-01", "UTC"),
+    ("2000-01-01", "2026-03-01", "UTC"),
+    ("yesterday", "2026-03-01", "UTC"),
+    ("2026-03-01", "2026-03-02", "Mars/Olympus"),
+])
+def test_invalid_ranges_are_rejected(from_date, to_date, tz):
+    with pytest.raises(HTTPException) as e:
+        report_days(from_date, to_date, tz)
+    assert e.value.status_code == 400
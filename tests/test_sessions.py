@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from server import SessionStore, hash_session_token
+
+
+def store(mongo, cache_size=10):
+    return SessionStore(mongo.user_sessions, 30, cache_size)
+
+
+def test_legacy_sessions_are_migrated_to_digests(mongo):
+    now = datetime.now(timezone.utc)
+
+    async def scenario():
+        await mongo.user_sessions.insert_many([
+            {"user_id": "user_1", "session_token": "live", "expires_at": (now + timedelta(days=1)).isoformat()},
+            {"user_id": "user_2", "session_token": "stale", "expires_at": (now - timedelta(days=1)).isoformat()},
+            {"user_id": "user_3", "expires_at": (now + timedelta(days=1)).isoformat()},
+        ])
+        await mongo.users.insert_one({"user_id": "user_1", "email": "u@example.com", "password_hash": "secret"})
+        sessions = store(mongo)
+        migrated = await sessions.migrate_legacy_sessions()
+        return migrated, await mongo.user_sessions.find({}, {"_id": 0}).to_list(None), await sessions.resolve("live")
+
+    migrated, rows, resolved = asyncio.run(scenario())
+    assert migrated == 1
+    assert len(rows) == 1
+    assert rows[0]["token_digest"] == hash_session_token("live")
+    assert "session_token" not in rows[0]
+    assert isinstance(rows[0]["expires_at"], datetime)
+    _, user = resolved
+    assert user == {"user_id": "user_1", "email": "u@example.com"}
+
+
+def test_new_session_evicts_the_users_cached_token(mongo):
+    async def scenario():
+        await mongo.users.insert_one({"user_id": "user_1"})
+        sessions = store(mongo)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+        await sessions.create("user_1", "first", expires_at)
+        assert await sessions.resolve("first")
+        await sessions.create("user_1", "second", expires_at)
+        return sessions, await sessions.resolve("first"), await sessions.resolve("second")
+
+    sessions, first, second = asyncio.run(scenario())
+    assert first is None
+    assert second[1] == {"user_id": "user_1"}
+    assert sessions._digests == {"user_1": hash_session_token("second")}
+
+
+def test_cache_is_bounded(mongo):
+    async def scenario():
+        sessions = store(mongo, cache_size=2)
+        expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+        for i in range(3):
+            await sessions.create(f"user_{i}", f"token_{i}", expires_at)
+            await sessions.resolve(f"token_{i}")
+        return sessions
+
+    sessions = asyncio.run(scenario())
+    assert list(sessions._cache) == [hash_session_token("token_1"), hash_session_token("token_2")]
+    assert set(sessions._digests) == {"user_1", "user_2"}
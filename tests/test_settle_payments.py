@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import OrderStatus, PaymentStatus, settle_payments
+
+
+@pytest.fixture
+def pending_order(mongo):
+    async def seed():
+        await mongo.users.insert_one({"user_id": "user_1", "paid_order_count": 0, "paid_total": 0})
+        await mongo.orders.insert_one(server.Order(
+            order_id="ORD-1", user_id="user_1", product_id="prod_1", product_name="Hosting",
+            plan_duration="monthly", amount=100, customer_name="Customer", customer_email="c@example.com"
+        ).model_dump())
+        for payment_id in ("PAY-1", "PAY-2"):
+            await mongo.payments.insert_one(server.Payment(payment_id=payment_id, order_id="ORD-1", amount=100).model_dump())
+    asyncio.run(seed())
+    return mongo
+
+
+def settle(*outcomes):
+    return asyncio.run(settle_payments(list(outcomes), "test"))
+
+
+def paid(payment_id):
+    return {"payment_id": payment_id, "paid": True, "transaction_id": f"TX-{payment_id}"}
+
+
+def failed(payment_id):
+    return {"payment_id": payment_id, "paid": False, "transaction_id": None}
+
+
+def state(mongo):
+    async def read():
+        return (
+            await mongo.orders.find_one({"order_id": "ORD-1"}),
+            await mongo.invoices.find({}).to_list(None),
+            await mongo.users.find_one({"user_id": "user_1"}),
+        )
+    return asyncio.run(read())
+
+
+def test_paid_outcome_completes_the_order_and_invoices_it(pending_order):
+    issued = settle(paid("PAY-1"))
+    order, invoices, user = state(pending_order)
+    assert order["payment_status"] == PaymentStatus.PAID.value
+    assert order["status"] == OrderStatus.COMPLETED.value
+    assert order["payment_id"] == "PAY-1"
+    assert [i.payment_id for i in issued["PAY-1"]] == ["PAY-1"]
+    assert len(invoices) == 1
+    assert (user["paid_order_count"], user["paid_total"]) == (1, 100)
+
+
+def test_redelivered_outcome_is_a_no_op(pending_order):
+    settle(paid("PAY-1"))
+    assert settle(paid("PAY-1")) == {}
+    order, invoices, user = state(pending_order)
+    assert order["payment_status"] == PaymentStatus.PAID.value
+    assert len(invoices) == 1
+    assert (user["paid_order_count"], user["paid_total"]) == (1, 100)
+
+
+def test_second_payment_does_not_touch_a_paid_order(pending_order):
+    settle(paid("PAY-1"))
+    assert settle(failed("PAY-2")) == {"PAY-2": []}
+    order, invoices, user = state(pending_order)
+    assert order["payment_status"] == PaymentStatus.PAID.value
+    assert order["payment_id"] == "PAY-1"
+    assert len(invoices) == 1
+    assert user["paid_order_count"] == 1
+
+    settle(paid("PAY-2"))
+    order, invoices, user = state(pending_order)
+    assert order["payment_id"] == "PAY-1"
+    assert len(invoices) == 1
+    assert user["paid_order_count"] == 1
+
+
+def payment(mongo, payment_id):
+    return asyncio.run(mongo.payments.find_one({"payment_id": payment_id}, {"_id": 0}))
+
+
+def test_payment_captured_after_the_order_was_paid_is_flagged_for_refund(pending_order):
+    settle(paid("PAY-1"))
+    assert settle(paid("PAY-2")) == {"PAY-2": []}
+    late = payment(pending_order, "PAY-2")
+    assert late["status"] == PaymentStatus.EXPIRED.value
+    assert late["refund_required"] is True
+    assert payment(pending_order, "PAY-1")["status"] == PaymentStatus.PAID.value
+    order, invoices, user = state(pending_order)
+    assert order["payment_id"] == "PAY-1"
+    assert len(invoices) == 1
+    assert user["paid_order_count"] == 1
+
+
+def test_two_captures_in_one_call_pay_the_order_once(pending_order):
+    issued = settle(paid("PAY-1"), paid("PAY-2"))
+    assert len(issued["PAY-1"]) == 1 and issued["PAY-2"] == []
+    assert payment(pending_order, "PAY-2")["refund_required"] is True
+    assert len(state(pending_order)[1]) == 1
+
+
+def test_mock_completion_of_a_superseded_payment_is_a_conflict(pending_order):
+    customer = server.User(user_id="user_1", email="c@example.com", name="Customer")
+    completed = asyncio.run(server.mock_complete_payment("PAY-1", current_user=customer))
+    assert completed["invoice_ids"]
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.mock_complete_payment("PAY-2", current_user=customer))
+    assert error.value.status_code == 409
+
+
+def test_paid_wins_over_a_failure_settled_in_the_same_call(pending_order):
+    issued = settle(failed("PAY-2"), paid("PAY-1"))
+    order, invoices, _ = state(pending_order)
+    assert order["payment_status"] == PaymentStatus.PAID.value
+    assert order["payment_id"] == "PAY-1"
+    assert issued == {"PAY-1": [issued["PAY-1"][0]], "PAY-2": []}
+    assert len(invoices) == 1
+
+
+def test_unknown_payment_settles_nothing(pending_order):
+    assert settle(paid("PAY-404")) == {}
+    order, invoices, _ = state(pending_order)
+    assert order["payment_status"] == PaymentStatus.PENDING.value
+    assert invoices == []
@@ -0,0 +1,88 @@
+import asyncio
+
+from server import SingleFlight, single_flight_groups
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test-coalesce")
+        executions = 0
+        release = asyncio.Event()
+
+        async def query():
+            nonlocal executions
+            executions += 1
+            await release.wait()
+            return {"value": 42}
+
+        callers = [asyncio.ensure_future(flight.do("key", query)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert flight.stats() == {"calls": 5, "coalesced": 4, "in_flight": 1}
+        release.set()
+        results = await asyncio.gather(*callers)
+        return flight, executions, results
+
+    flight, executions, results = asyncio.run(scenario())
+    assert executions == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight("test-keys")
+
+        async def query(value):
+            await asyncio.sleep(0)
+            return value
+
+        return await asyncio.gather(flight.do("a", lambda: query("a")), flight.do("b", lambda: query("b")))
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+
+
+def test_error_reaches_every_waiter_and_is_not_kept():
+    async def scenario():
+        flight = SingleFlight("test-errors")
+        attempts = 0
+
+        async def failing():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0)
+            raise RuntimeError("primary unavailable")
+
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        # The next call after the failure runs again instead of reusing it
+        retry = await flight.do("key", lambda: asyncio.sleep(0, result="ok"))
+        return attempts, results, retry, flight
+
+    attempts, results, retry, flight = asyncio.run(scenario())
+    assert attempts == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert retry == "ok"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight("test-cancel")
+        release = asyncio.Event()
+
+        async def query():
+            await release.wait()
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("key", query))
+        second = asyncio.ensure_future(flight.do("key", query))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        return await second, first.cancelled()
+
+    assert asyncio.run(scenario()) == ("done", True)
+
+
+def test_groups_are_registered_by_name():
+    flight = SingleFlight("test-registry")
+    assert single_flight_groups["test-registry"] is flight
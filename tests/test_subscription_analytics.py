@@ -0,0 +1,144 @@
+import asyncio
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+import server
+from server import (
+    MRR_MOVEMENTS, active_subscriptions, first_active_months, month_index, month_label, monthly_records,
+)
+
+
+def random_orders(seed, users=40, orders=300):
+    rng = random.Random(seed)
+    rows = [
+        {
+            "user": user if i < users else rng.randrange(users),  # every user code has an order
+            "plan_duration": rng.choice(["monthly", "monthly", "yearly"]),
+            "amount": 12 * rng.randint(1, 40),  # whole monthly amounts keep the sums exact
+            "created_at": datetime(2023, rng.randint(1, 12), rng.randint(1, 28), tzinfo=timezone.utc)
+            if rng.random() < 0.5 else datetime(2024, rng.randint(1, 12), rng.randint(1, 28), tzinfo=timezone.utc),
+        }
+        for i, user in enumerate(list(range(users)) + [None] * (orders - users))
+    ]
+    return pd.DataFrame(rows)
+
+
+def naive_active(orders):
+    active = defaultdict(float)
+    for order in orders.itertuples():
+        duration = 12 if order.plan_duration == "yearly" else 1
+        for offset in range(duration):
+            active[(order.user, month_index(order.created_at) + offset)] += order.amount / duration
+    return active
+
+
+def naive_records(orders, months):
+    active = naive_active(orders)
+    first = {}
+    for user, month in active:
+        first[user] = min(first.get(user, month), month)
+    records = []
+    for m in months:
+        totals = dict.fromkeys(MRR_MOVEMENTS, 0.0)
+        record = {"mrr": 0.0, "customers": 0, "churned_customers": 0, "cohorts": defaultdict(int)}
+        for user in first:
+            current, previous = active.get((user, m), 0.0), active.get((user, m - 1), 0.0)
+            if not current and not previous:
+                continue
+            change = current - previous
+            if not previous:
+                movement = "new" if m == first[user] else "reactivation"
+            elif not current:
+                movement = "churn"
+                record["churned_customers"] += 1
+            elif change > 0:
+                movement = "expansion"
+            elif change < 0:
+                movement = "contraction"
+            else:
+                movement = None
+            if movement:
+                totals[movement] += abs(change)
+            if current:
+                record["mrr"] += current
+                record["customers"] += 1
+                record["cohorts"][month_label(first[user])] += 1
+        records.append({
+            "month": month_label(m), "mrr": round(record["mrr"], 2), "customers": record["customers"],
+            **{name: round(value, 2) for name, value in totals.items()},
+            "net_new": round(totals["new"] + totals["expansion"] + totals["reactivation"] - totals["contraction"] - totals["churn"], 2),
+            "churned_customers": record["churned_customers"],
+            "cohorts": dict(record["cohorts"]),
+        })
+    return records
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_active_subscriptions_match_a_loop(seed):
+    orders = random_orders(seed)
+    active = active_subscriptions(orders)
+    assert list(active.itertuples(index=False, name=None)) == sorted(
+        (user, month, mrr) for (user, month), mrr in naive_active(orders).items()
+    )
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_monthly_records_match_a_loop(seed):
+    orders = random_orders(seed)
+    active = active_subscriptions(orders)
+    months = range(month_index(datetime(2023, 1, 1)), month_index(datetime(2026, 3, 1)))
+    assert monthly_records(active, first_active_months(active), months) == naive_records(orders, months)
+
+
+def test_yearly_plan_spreads_over_twelve_months():
+    orders = pd.DataFrame([
+        {"user": 0, "plan_duration": "yearly", "amount": 1200, "created_at": datetime(2024, 3, 5, tzinfo=timezone.utc)},
+    ])
+    active = active_subscriptions(orders)
+    assert list(active["month"]) == list(range(month_index(datetime(2024, 3, 1)), month_index(datetime(2025, 3, 1))))
+    assert set(active["mrr"]) == {100.0}
+    months = range(month_index(datetime(2024, 3, 1)), month_index(datetime(2025, 4, 1)))
+    records = monthly_records(active, first_active_months(active), months)
+    assert records[0]["new"] == 100.0
+    assert records[-2]["customers"] == 1
+    assert (records[-1]["month"], records[-1]["customers"], records[-1]["churn"]) == ("2025-03", 0, 100.0)
+
+
+def paid_order(order_id, user_id, plan_duration, amount, created_at):
+    return {"order_id": order_id, "user_id": user_id, "plan_duration": plan_duration, "amount": amount,
+            "payment_status": "paid", "created_at": created_at}
+
+
+def seed_archived_history(mongo):
+    async def seed():
+        await mongo["orders_archive_2024_01"].insert_one(
+            paid_order("ORD-1", "user_1", "yearly", 1200, datetime(2024, 1, 15, tzinfo=timezone.utc))
+        )
+        await mongo.orders.insert_many([
+            paid_order("ORD-2", "user_1", "monthly", 50, datetime(2025, 3, 10, tzinfo=timezone.utc)),
+            paid_order("ORD-3", "user_2", "monthly", 80, datetime(2025, 3, 1, tzinfo=timezone.utc)),
+        ])
+    asyncio.run(seed())
+
+
+def test_full_history_includes_archived_orders(mongo):
+    seed_archived_history(mongo)
+    records = {r["month"]: r for r in asyncio.run(server.subscription_analytics.records(refresh=True))}
+    assert min(records) == "2024-01"
+    assert (records["2024-01"]["mrr"], records["2024-01"]["new"]) == (100.0, 100.0)
+    assert records["2025-01"]["churn"] == 100.0
+    march = records["2025-03"]
+    assert (march["new"], march["reactivation"]) == (80.0, 50.0)
+    assert march["cohorts"] == {"2024-01": 1, "2025-03": 1}
+
+
+def test_window_finds_first_payments_in_the_archive(mongo):
+    seed_archived_history(mongo)
+    march = month_index(datetime(2025, 3, 1))
+    [record] = asyncio.run(server.subscription_analytics.compute(march - 1, range(march, march + 1)))
+    assert (record["new"], record["reactivation"]) == (80.0, 50.0)
+    assert record["cohorts"] == {"2024-01": 1, "2025-03": 1}
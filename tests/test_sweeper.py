@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from server import Order, OrderStatus, Payment, PaymentStatus, PendingSweeper
+
+
+def order(order_id, age_hours, status=OrderStatus.PENDING, payment_status=PaymentStatus.PENDING, checkout_id=None):
+    return Order(
+        order_id=order_id, user_id="user_1", product_id="prod_1", product_name="Hosting", plan_duration="monthly",
+        amount=100, status=status, payment_status=payment_status, customer_name="Customer",
+        customer_email="c@example.com", checkout_id=checkout_id,
+        created_at=datetime.now(timezone.utc) - timedelta(hours=age_hours)
+    ).model_dump()
+
+
+def payment(payment_id, order_id, age_hours, status=PaymentStatus.PENDING):
+    return Payment(
+        payment_id=payment_id, order_id=order_id, amount=100, status=status,
+        created_at=datetime.now(timezone.utc) - timedelta(hours=age_hours)
+    ).model_dump()
+
+
+@pytest.fixture
+def checkouts(mongo):
+    async def seed():
+        await mongo.orders.insert_many([
+            order("ORD-ABANDONED", 48),
+            order("ORD-CART-1", 30, checkout_id="CHK-1"),
+            order("ORD-CART-2", 30, checkout_id="CHK-1"),
+            order("ORD-FRESH", 1),
+            order("ORD-PAID", 48, OrderStatus.COMPLETED, PaymentStatus.PAID),
+        ])
+        await mongo.payments.insert_many([
+            payment("PAY-ABANDONED", "ORD-ABANDONED", 1),
+            payment("PAY-CART", "CHK-1", 1),
+            payment("PAY-FRESH-OLD", "ORD-FRESH", 1),
+            payment("PAY-FRESH-NEW", "ORD-FRESH", 0.5),
+            payment("PAY-PAID", "ORD-PAID", 48, PaymentStatus.PAID),
+        ])
+    asyncio.run(seed())
+    return mongo
+
+
+def statuses(collection, id_field):
+    async def read():
+        return {d[id_field]: d["status"] for d in await collection.find().to_list(None)}
+    return asyncio.run(read())
+
+
+def sweeper():
+    return PendingSweeper(order_max_age_hours=24, payment_max_age_hours=24, batch_size=1)
+
+
+def test_abandoned_orders_are_cancelled(checkouts):
+    references = asyncio.run(sweeper().cancel_abandoned_orders(datetime.now(timezone.utc)))
+    assert sorted(references) == ["CHK-1", "ORD-ABANDONED"]
+    orders = statuses(checkouts.orders, "order_id")
+    assert orders["ORD-ABANDONED"] == orders["ORD-CART-1"] == orders["ORD-CART-2"] == OrderStatus.CANCELLED.value
+    assert orders["ORD-FRESH"] == OrderStatus.PENDING.value
+    assert orders["ORD-PAID"] == OrderStatus.COMPLETED.value
+    abandoned = asyncio.run(checkouts.orders.find_one({"order_id": "ORD-ABANDONED"}))
+    assert abandoned["payment_status"] == PaymentStatus.EXPIRED.value
+    events = [e["event"] for e in server.order_events.buffer]
+    assert events.count("order_cancelled") == 3
+
+
+def test_payments_of_cancelled_orders_and_duplicates_are_expired(checkouts):
+    report = asyncio.run(sweeper().run())
+    assert report == {"orders_cancelled": 2, "duplicate_payments": 1, "payments_expired": 3}
+    payments = statuses(checkouts.payments, "payment_id")
+    assert payments == {
+        "PAY-ABANDONED": PaymentStatus.EXPIRED.value,
+        "PAY-CART": PaymentStatus.EXPIRED.value,
+        "PAY-FRESH-OLD": PaymentStatus.EXPIRED.value,
+        "PAY-FRESH-NEW": PaymentStatus.PENDING.value,
+        "PAY-PAID": PaymentStatus.PAID.value,
+    }
+
+
+def test_old_pending_payments_are_expired(mongo):
+    asyncio.run(mongo.payments.insert_many([payment("PAY-STALE", "ORD-GONE", 30), payment("PAY-LIVE", "ORD-LIVE", 1)]))
+    report = asyncio.run(sweeper().run())
+    assert report == {"orders_cancelled": 0, "duplicate_payments": 0, "payments_expired": 1}
+    assert statuses(mongo.payments, "payment_id") == {
+        "PAY-STALE": PaymentStatus.EXPIRED.value, "PAY-LIVE": PaymentStatus.PENDING.value
+    }
+
+
+def test_second_run_finds_nothing_to_do(checkouts):
+    asyncio.run(sweeper().run())
+    assert asyncio.run(sweeper().run()) == {"orders_cancelled": 0, "duplicate_payments": 0, "payments_expired": 0}